@@ -0,0 +1,92 @@
+"""
+Crossover of the worker pool backends (worker_pool.BACKENDS): per-request
+latency of the Euler-Jacobi bases of a random odd n on the process pool, the
+thread pool and inline in the calling thread, over a range of bit sizes.
+
+Each request runs prime_numbers.euler_test_single_base once per base,
+through worker_pool.as_completed_results() exactly like
+run_euler_tests_parallel. The thresholds printed at the end are the first
+size at which threads beat inline execution and processes beat threads;
+export them to make select_backend() follow this host.
+
+Usage:
+    python benchmarks/bench_backends.py [--bits 128 256 ... 16384] [--requests 20] [--bases 8] [--workers N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_numbers
+import worker_pool
+
+
+def run_request(args_list, backend):
+    return [result for _, result, _ in
+            worker_pool.as_completed_results(prime_numbers.euler_test_single_base, args_list, backend=backend)]
+
+
+def median_latency(args_list, backend, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        run_request(args_list, backend)
+        latencies.append(time.perf_counter() - start)
+    return statistics.median(latencies)
+
+
+def first_size_faster(rows, faster, slower):
+    """The first bit size from which `faster` stays ahead of `slower`, or None."""
+    for i, (bits, _) in enumerate(rows):
+        if all(later[faster] < later[slower] for _, later in rows[i:]):
+            return bits
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+",
+                        default=[128, 256, 384, 512, 768, 1024, 2048, 3072, 4096, 6144, 8192, 16384])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--bases", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    state = gmpy2.random_state(12345)
+    print(f"workers={worker_pool.get_pool_size()} requests={args.requests} bases={args.bases} "
+          f"free-threaded={worker_pool.FREE_THREADED} gmpy2 releases the GIL={worker_pool.GMPY2_RELEASES_GIL}")
+    print(f"{'bits':>6} {'inline':>10} {'thread':>10} {'process':>10} {'fastest':>8} {'auto':>8}")
+
+    for backend in worker_pool.BACKENDS: # Start the pools outside the timings
+        run_request([(mpz(7), mpz(2))], backend)
+
+    rows = []
+    for bits in args.bits:
+        n_mpz = gmpy2.mpz_urandomb(state, bits) | (mpz(1) << (bits - 1)) | 1
+        args_list = [(n_mpz, mpz(2 + i)) for i in range(args.bases)]
+        latency = {backend: median_latency(args_list, backend, args.requests) for backend in worker_pool.BACKENDS}
+        rows.append((bits, latency))
+        print(f"{bits:>6} {latency['inline'] * 1000:>8.2f}ms {latency['thread'] * 1000:>8.2f}ms "
+              f"{latency['process'] * 1000:>8.2f}ms {min(latency, key=latency.get):>8} "
+              f"{worker_pool.select_backend(bits):>8}", flush=True)
+
+    inline_max_bits = first_size_faster(rows, "thread", "inline")
+    thread_max_bits = first_size_faster(rows, "process", "thread")
+    if inline_max_bits is None or not worker_pool.threads_run_in_parallel():
+        inline_max_bits = first_size_faster(rows, "process", "inline") # Threads do not help here
+    if thread_max_bits is None:
+        thread_max_bits = args.bits[-1] * 2
+    if inline_max_bits is None:
+        inline_max_bits = thread_max_bits
+    print(f"\nexport PRIME_INLINE_MAX_BITS={inline_max_bits} PRIME_THREAD_MAX_BITS={max(thread_max_bits, inline_max_bits)}")
+
+
+if __name__ == "__main__":
+    main()
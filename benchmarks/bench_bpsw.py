@@ -0,0 +1,56 @@
+"""
+Prime-verdict latency: Baillie-PSW mode versus the default Euler-Jacobi mode
+(DEFAULT_NUM_BASES random bases plus the Miller-Rabin guard when triggered).
+
+Primes are the cases where every exponentiation has to run, so this is the
+latency of a "probable prime" answer. The inputs are the Proth-like primes
+3*2**n+1 (OEIS A002253), which are not in the known prime tables, so the
+whole pipeline runs. The default sizes are about 2k, 20k and 200k bits; a
+single 200k-bit exponentiation takes minutes, so the last case is slow.
+
+With one worker BPSW does less work than five bases. With five or more workers
+the Euler-Jacobi bases run side by side, so its latency is about one
+exponentiation, while the Lucas half of BPSW costs about two and cannot be split.
+
+Usage:
+    python benchmarks/bench_bpsw.py [--exponents 2208 20909 213321] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_numbers
+import worker_pool
+
+
+def timed_verdict(n, mode):
+    start = time.perf_counter()
+    verdict = prime_numbers.run_primality_pipeline(n, mode=mode)
+    return time.perf_counter() - start, verdict
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exponents", type=int, nargs="+", default=[2208, 20909, 213321],
+                        help="exponents n of the primes 3*2**n+1 to test")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    worker_pool.map_tasks(abs, [0] * worker_pool.get_pool_size()) # start the workers outside the timings
+    print(f"workers={worker_pool.get_pool_size()} euler_jacobi bases={prime_numbers.DEFAULT_NUM_BASES}")
+    print(f"{'bits':>8} {'euler_jacobi':>13} {'bpsw':>10} {'speedup':>8}")
+    for exponent in args.exponents:
+        n = 3 * mpz(2)**exponent + 1
+        euler_time, euler_verdict = timed_verdict(n, "euler_jacobi")
+        bpsw_time, bpsw_verdict = timed_verdict(n, "bpsw")
+        assert euler_verdict["verdict"] == bpsw_verdict["verdict"] == "probable_prime", exponent
+        print(f"{n.bit_length():>8} {euler_time:>12.3f}s {bpsw_time:>9.3f}s {euler_time / bpsw_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+classical_filter: primorial GCD filter (small_primes.py) versus the original
+6k±1 trial-division loop.
+
+The inputs have no factor below the bound, which is the common case for a
+number that goes on to the Euler-Jacobi stage and the worst case for the
+loop (it runs to the end). The first call of the GCD filter also builds the
+cached primorial; that one-off cost is reported separately.
+
+Usage:
+    python benchmarks/bench_classical_filter.py [--digits 1000 10000 100000] [--bound 1000003] [--repeat 3]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import small_primes
+
+basic_field = [2, 3, 5, 7, 11, 13]
+
+
+def loop_filter(n, bound):
+    """The original classical_filter loop, returning the divisor instead of a message."""
+    for divisor in basic_field:
+        if n % divisor == 0 and n != divisor:
+            return divisor
+    k = 1
+    end = bound - 2
+    while True:
+        divisor1 = 6 * k - 1
+        divisor2 = 6 * k + 1
+        if divisor1 > end:
+            break
+        if n % divisor1 == 0 and n != divisor1:
+            return divisor1
+        if n % divisor2 == 0 and n != divisor2:
+            return divisor2
+        k += 1
+    return None
+
+
+def rough_number(digits, bound):
+    """A number with about `digits` digits and no prime factor <= bound."""
+    p = gmpy2.next_prime(mpz(bound) * 1000)
+    exponent = max(1, math.ceil(digits / gmpy2.num_digits(p)))
+    return p ** exponent
+
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--digits", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--bound", type=int, default=small_primes.DEFAULT_FILTER_BOUND)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    small_primes.primorial_blocks(args.bound)
+    print(f"bound={args.bound}: building the cached primorial took {time.perf_counter() - start:.3f}s")
+    print(f"{'digits':>8} {'6k±1 loop':>12} {'gcd filter':>12} {'speedup':>8}")
+
+    for digits in args.digits:
+        n = rough_number(digits, args.bound)
+        assert loop_filter(n, args.bound) is None and small_primes.smallest_prime_divisor(n, args.bound) is None
+        loop_time = best_of(args.repeat, loop_filter, n, args.bound)
+        gcd_time = best_of(args.repeat, small_primes.smallest_prime_divisor, n, args.bound)
+        print(f"{digits:>8} {loop_time:>11.4f}s {gcd_time:>11.4f}s {loop_time / gcd_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
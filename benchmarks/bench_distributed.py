@@ -0,0 +1,107 @@
+"""
+End-to-end run of the coordinator/worker mode (distributed.py) on localhost:
+starts a coordinator in this process and --hosts worker processes (each with
+--workers pool processes), then times the same jobs on the local pool and on
+the workers:
+
+  * the Euler-Jacobi bases of the largest known Mersenne prime of at most
+    --bits bits and of a composite (which stops at the first failing base),
+  * ECM on a --factor-digits prime times a 160-bit prime,
+  * counting the primes in a sieve range,
+  * trial factoring M_p to --tf-depth bits.
+
+The results must agree. With --kill-one, one worker host is killed while
+the prime's bases run, and its unit is reissued once its lease (--lease
+seconds) runs out.
+
+Usage:
+    python benchmarks/bench_distributed.py [--hosts 3] [--workers 1] [--bits 20000] [--kill-one]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import distributed
+import factorization
+import known_primes
+import mersenne_factoring
+import prime_numbers
+import prime_sieve
+import worker_pool
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def random_prime(bits, random_state):
+    return gmpy2.next_prime(gmpy2.mpz_urandomb(random_state, bits) | (mpz(1) << (bits - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=3, help="worker processes to start (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1, help="pool size of each worker (default: %(default)s)")
+    parser.add_argument("--bits", type=int, default=20000, help="size of the number tested (default: %(default)s)")
+    parser.add_argument("--bases", type=int, default=6, help="Euler-Jacobi bases (default: %(default)s)")
+    parser.add_argument("--factor-digits", type=int, default=18)
+    parser.add_argument("--count", type=int, default=10**9, help="sieve [10^12, 10^12 + count] (default: %(default)s)")
+    parser.add_argument("--tf-p", type=int, default=1000003, help="Mersenne exponent (default: %(default)s)")
+    parser.add_argument("--tf-depth", type=int, default=40)
+    parser.add_argument("--lease", type=float, default=5.0)
+    parser.add_argument("--kill-one", action="store_true", help="kill one worker host during the first job")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    random_state = gmpy2.random_state(args.seed)
+    n = (mpz(1) << max(p for p in known_primes.KNOWN_MERSENNE_EXPONENTS if p <= args.bits)) - 1
+    composite = n * random_prime(64, random_state)
+    semiprime = random_prime(int(args.factor_digits * 3.32), random_state) * random_prime(160, random_state)
+    bases = list(range(2, 2 + args.bases))
+    jobs = [
+        ("Euler-Jacobi bases (prime)", lambda: [r[1] for r in prime_numbers.run_euler_tests_parallel(
+            n, bases, None, None, 0)]),
+        ("Euler-Jacobi bases (composite)", lambda: any(r[1] for r in prime_numbers.run_euler_tests_parallel(
+            composite, bases, None, None, 0))),
+        ("ECM", lambda: semiprime % factorization.ecm(semiprime, time_limit=600) == 0),
+        ("sieve count", lambda: prime_sieve.count_primes_between(10**12, 10**12 + args.count)),
+        ("trial factoring", lambda: mersenne_factoring.trial_factor(args.tf_p, args.tf_depth)),
+    ]
+
+    local = []
+    print(f"{worker_pool.get_pool_size()} local workers, {args.hosts} hosts x {args.workers} workers")
+    for name, job in jobs:
+        local.append(timed(job))
+
+    coordinator = distributed.start_coordinator(port=0, lease_seconds=args.lease)
+    host, port = coordinator.address
+    hosts = [subprocess.Popen([sys.executable, os.path.join(ROOT, "distributed.py"), "worker", f"{host}:{port}",
+                               "--workers", str(args.workers)]) for _ in range(args.hosts)]
+    try:
+        coordinator.wait_for_workers(args.hosts * args.workers)
+        if args.kill_one:
+            threading.Timer(1.0, hosts[0].kill).start()
+        print(f"{'job':<32} {'local':>9} {'distributed':>12}")
+        for (name, job), (expected, local_seconds) in zip(jobs, local):
+            result, seconds = timed(job)
+            assert result == expected, (name, result, expected)
+            print(f"{name:<32} {local_seconds:>8.2f}s {seconds:>11.2f}s", flush=True)
+        print(f"{coordinator.units_leased} units leased, {coordinator.units_reissued} reissued")
+    finally:
+        distributed.stop_coordinator()
+        for process in hosts:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
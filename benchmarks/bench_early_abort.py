@@ -0,0 +1,73 @@
+"""
+Early abort of the Euler-Jacobi stage: wall time on known composites with
+stop_on_failure=False (every base runs to completion, the old behaviour)
+versus stop_on_failure=True (the first failing base cancels the others).
+
+The inputs are products of random 512-bit primes, so they pass the small
+divisor filter and every base fails; with early abort the stage should take roughly
+the time of one exponentiation per worker instead of all of them. The
+repository has no test suite, so the script also asserts that both modes
+agree and that early abort is not slower.
+
+Usage:
+    python benchmarks/bench_early_abort.py [--bits 2048 8192 24576] [--bases 16] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_numbers
+import worker_pool
+
+
+FACTOR_BITS = 512
+
+
+def known_composite(bits, state):
+    """A product of random FACTOR_BITS-bit primes with at least `bits` bits (no small factors)."""
+    n = mpz(1)
+    while n.bit_length() < bits:
+        n *= gmpy2.next_prime(gmpy2.mpz_urandomb(state, FACTOR_BITS - 1) | (mpz(1) << (FACTOR_BITS - 1)))
+    return n
+
+
+def timed_run(n, bases, stop_on_failure):
+    start = time.perf_counter()
+    results = prime_numbers.run_euler_tests_parallel(n, bases, None, None, 0, stop_on_failure=stop_on_failure)
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+", default=[2048, 8192, 24576])
+    parser.add_argument("--bases", type=int, default=16, help="number of Euler-Jacobi bases")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    worker_pool.map_tasks(abs, [0] * worker_pool.get_pool_size()) # start the workers outside the timings
+    state = gmpy2.random_state(args.seed)
+    bases = prime_numbers.DEFAULT_SMALL_PRIME_BASES + list(range(19, 19 + 2 * args.bases, 2))
+    bases = bases[:args.bases]
+
+    print(f"workers={worker_pool.get_pool_size()} bases={len(bases)}")
+    print(f"{'bits':>8} {'all bases':>11} {'early abort':>12} {'speedup':>8} {'bases run':>10}")
+    for bits in args.bits:
+        n = known_composite(bits, state)
+        full_time, full_results = timed_run(n, bases, False)
+        abort_time, abort_results = timed_run(n, bases, True)
+        assert len(full_results) == len(bases) and not any(passed for _, passed, _ in full_results)
+        assert abort_results and not any(passed for _, passed, _ in abort_results)
+        assert abort_time <= full_time * 1.1, "early abort should never be slower than running every base"
+        print(f"{bits:>8} {full_time:>10.3f}s {abort_time:>11.3f}s {full_time / abort_time:>7.1f}x "
+              f"{len(abort_results):>5}/{len(bases)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Input parsing: the AST evaluator in expression_eval.py versus the old
+sympy.sympify() + mpz(str(expr)) path, on large power and factorial
+expressions. Both results are compared, so the script also checks that the
+evaluator agrees with sympy.
+
+Usage:
+    python benchmarks/bench_expression_eval.py [--repeat 3] [--skip-slow]
+"""
+import argparse
+import os
+import sys
+import time
+
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import expression_eval
+
+EXPRESSIONS = [
+    "2**127-1",
+    "15!-1",
+    "3*2**100000+1",
+    "2**1000000-1",
+    "2**3000000-1",
+    "20000!+1",
+    "100000!-1",
+]
+SLOW_FOR_SYMPY = {"2**3000000-1", "100000!-1"} # Skipped with --skip-slow (several seconds each in sympy)
+
+
+def sympy_value(text):
+    """The old input path: sympify, then convert through a decimal string."""
+    import sympy
+    return mpz(str(sympy.sympify(text)))
+
+
+def best_of(repeat, fn, *args):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-slow", action="store_true", help="skip the expressions that take sympy several seconds")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    import sympy # noqa: F401 (import time reported separately, it is paid once per process)
+    print(f"import sympy took {time.perf_counter() - start:.3f}s")
+    print(f"{'expression':>16} {'sympify':>10} {'ast eval':>10} {'speedup':>8}")
+    for text in EXPRESSIONS:
+        if args.skip_slow and text in SLOW_FOR_SYMPY:
+            continue
+        sympy_time, expected = best_of(1, sympy_value, text)
+        eval_time, value = best_of(args.repeat, expression_eval.evaluate_expression, text)
+        assert value == expected, text
+        print(f"{text:>16} {sympy_time:>9.4f}s {eval_time:>9.4f}s {sympy_time / eval_time:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Trial factoring of Mersenne numbers (mersenne_factoring.py) against a plain
+loop over the candidates q = 2kp + 1 with q = +-1 (mod 8), one
+powmod(2, p, q) each, and against classical_filter (the primorial gcd up to
+10^6, which can only find factors below 10^6).
+
+Both searches run to the same bit depth for the first --count prime
+exponents from --start; the plain loop stops at its first factor, like the
+class sieve stops after the first bit level with one.
+
+Usage:
+    python benchmarks/bench_mersenne_factoring.py [--start 100000] [--count 10] [--depth 40] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mersenne_factoring
+import prime_numbers
+import worker_pool
+
+
+def plain_trial_factor(p, depth):
+    """The smallest factor 2kp + 1 < 2^depth of M_p, trying every k with q = +-1 (mod 8)."""
+    for k in range(1, ((1 << depth) - 1) // (2 * p) + 1):
+        q = 2 * k * p + 1
+        if q % 8 in (1, 7) and gmpy2.powmod(2, p, q) == 1:
+            return q
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", type=int, default=100000)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--depth", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    print(f"{worker_pool.get_pool_size()} workers, depth 2^{args.depth}")
+    print(f"{'p':>9} {'factor':>14} {'class sieve':>12} {'plain loop':>11} {'classical_filter':>17}")
+    p = int(gmpy2.next_prime(args.start - 1))
+    for _ in range(args.count):
+        start = time.perf_counter()
+        factor, _ = mersenne_factoring.trial_factor(p, args.depth)
+        sieve_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        plain_factor = plain_trial_factor(p, args.depth)
+        plain_time = time.perf_counter() - start
+        assert plain_factor == factor, (p, plain_factor, factor)
+
+        n = (mpz(1) << p) - 1
+        start = time.perf_counter()
+        divisor = prime_numbers.classical_filter_divisor(n)
+        filter_time = time.perf_counter() - start
+        filter_text = f"{filter_time:.3f}s" + (" (found)" if divisor else "")
+        print(f"{p:>9} {str(factor or '-'):>14} {sieve_time:>11.3f}s {plain_time:>10.3f}s {filter_text:>17}", flush=True)
+        p = int(gmpy2.next_prime(p))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Primes per second from prime_generation.random_prime() versus the old way of
+finding a prime: run_primality_pipeline() (what check_prime() runs) on
+successive odd candidates after a random starting point, with the
+classical filter and a round of pool tasks per candidate.
+
+Every method gets the same seeded starting points. random_prime() runs once
+in the calling process (serial) and once with its windows on the pool
+(parallel; only different from serial with more than one worker).
+
+Usage:
+    python benchmarks/bench_prime_generation.py [--bits 1024 2048 4096] [--count 5] [--skip-legacy]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_generation
+import prime_numbers
+import verdict_cache
+import worker_pool
+
+
+def legacy_random_prime(bits, seed):
+    """The first prime after a random odd starting point, one full pipeline run per candidate."""
+    candidate = mpz(random.Random(seed).getrandbits(bits - 1)) | (mpz(1) << (bits - 1)) | 1
+    while True:
+        verdict = prime_numbers.run_primality_pipeline(candidate, parallel=True, use_cache=False)
+        if verdict["verdict"] in ("prime", "probable_prime"):
+            return candidate
+        candidate += 2
+
+
+def measure(generate, bits, count, seed):
+    start = time.perf_counter()
+    for i in range(count):
+        p = generate(bits, seed + i)
+        assert p.bit_length() >= bits and gmpy2.is_prime(p, 10)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+", default=[1024, 2048, 4096])
+    parser.add_argument("--count", type=int, default=5, help="primes per measurement (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--skip-legacy", action="store_true", help="do not measure the old per-candidate loop")
+    args = parser.parse_args()
+
+    verdict_cache.configure_cache(enabled=False)
+    methods = [
+        ("random_prime serial", lambda bits, seed: prime_generation.random_prime(bits, seed=seed, parallel=False)),
+        ("random_prime parallel", lambda bits, seed: prime_generation.random_prime(bits, seed=seed)),
+    ]
+    if not args.skip_legacy:
+        methods.insert(0, ("pipeline per candidate", legacy_random_prime))
+
+    list(worker_pool.as_completed_results(abs, [1] * worker_pool.get_pool_size())) # Start the pool
+    prime_generation.small_primes.primes_up_to(prime_generation.MAX_SIEVE_BOUND) # Build the tables once
+    print(f"{args.count} primes per measurement, {worker_pool.get_pool_size()} workers")
+    print(f"{'bits':>6} {'method':>24} {'primes/s':>10} {'s/prime':>9}")
+    for bits in args.bits:
+        for name, generate in methods:
+            rate = measure(generate, bits, args.count, args.seed)
+            print(f"{bits:>6} {name:>24} {rate:>10.3f} {1 / rate:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
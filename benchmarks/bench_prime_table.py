@@ -0,0 +1,83 @@
+"""
+The memory-mapped prime table (prime_table.py) against computing the same
+answers without it:
+
+  * small_primes.primes_up_to(bound), sieved versus decoded from the table
+    (what every fresh process pays for its filter and ECM prime lists),
+  * is_prime_small(x) versus gmpy2.is_prime(x) for random x in the table,
+  * pi(x) by rank versus prime_count.prime_count(x) (LMO),
+  * the k-th prime by select.
+
+The table is built first at --table (default: a temporary file), unless it
+already exists with a large enough bound.
+
+Usage:
+    python benchmarks/bench_prime_table.py [--bound 2**32] [--table FILE] [--lookups 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import gmpy2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import expression_eval
+import prime_count
+import prime_table
+import small_primes
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bound", default="2**32", help="bound of the table (default: %(default)s)")
+    parser.add_argument("--table", default=os.path.join(tempfile.gettempdir(), "bench_prime_table.bin"))
+    parser.add_argument("--list-bound", type=int, default=5 * 10**7,
+                        help="bound for primes_up_to (default: %(default)s, ECM's largest B2)")
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    bound = int(expression_eval.evaluate_expression(args.bound))
+    prime_table.configure_table("")
+    table = prime_table.PrimeTable(args.table) if os.path.exists(args.table) else None
+    if table is None or table.bound < bound:
+        if table is not None:
+            table.close()
+        count, seconds = timed(prime_table.build_table, args.table, bound)
+        print(f"built the table of {count} primes up to {bound} in {seconds:.1f}s")
+        table = prime_table.PrimeTable(args.table)
+    rng = random.Random(args.seed)
+
+    sieved, sieve_time = timed(small_primes.primes_up_to, args.list_bound)
+    decoded, decode_time = timed(table.primes_up_to, args.list_bound)
+    assert list(sieved) == list(decoded)
+    print(f"primes_up_to({args.list_bound}): sieve {sieve_time:.3f}s, table {decode_time:.3f}s")
+
+    values = [rng.randrange(table.bound + 1) for _ in range(args.lookups)]
+    expected, gmpy2_time = timed(lambda: [bool(gmpy2.is_prime(x)) for x in values])
+    found, table_time = timed(lambda: [table.is_prime_small(x) for x in values])
+    assert found == expected
+    print(f"{args.lookups} lookups: gmpy2.is_prime {args.lookups / gmpy2_time:.0f}/s, "
+          f"is_prime_small {args.lookups / table_time:.0f}/s")
+
+    x = rng.randrange(table.bound // 2, table.bound + 1)
+    counted, lmo_time = timed(prime_count.prime_count, x)
+    ranked, rank_time = timed(table.prime_count, x)
+    assert counted == ranked
+    nth, select_time = timed(table.nth_prime, ranked)
+    assert nth == gmpy2.prev_prime(x + 1)
+    print(f"pi({x}) = {ranked}: LMO {lmo_time:.3f}s, rank {rank_time * 1e6:.0f}us, select {select_time * 1e6:.0f}us")
+    table.close()
+
+
+if __name__ == "__main__":
+    main()
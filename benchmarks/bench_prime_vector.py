@@ -0,0 +1,67 @@
+"""
+Values per second from prime_vector.is_prime_array() on a column of random
+64-bit integers, against testing them one at a time: gmpy2.is_prime() in a
+Python loop (a Python object and a call per value) and, on a small sample,
+run_primality_pipeline() (what check_prime() runs).
+
+The vectorized results are checked against gmpy2.is_prime().
+
+Usage:
+    python benchmarks/bench_prime_vector.py [--count 1000000] [--bits 64] [--pipeline-sample 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gmpy2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_numbers
+import prime_vector
+import verdict_cache
+import worker_pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10**6, help="values in the column (default: %(default)s)")
+    parser.add_argument("--bits", type=int, default=64, help="values are random below 2**bits (default: %(default)s)")
+    parser.add_argument("--pipeline-sample", type=int, default=2000,
+                        help="values sent through run_primality_pipeline (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    verdict_cache.configure_cache(enabled=False)
+    rng = np.random.default_rng(args.seed)
+    values = rng.integers(0, 2**args.bits, size=args.count, dtype=np.uint64, endpoint=False)
+    as_ints = values.tolist()
+    list(worker_pool.as_completed_results(abs, [1] * worker_pool.get_pool_size())) # Start the pool
+    print(f"{args.count} random values below 2**{args.bits}, {worker_pool.get_pool_size()} workers")
+    print(f"{'method':>26} {'values/s':>12} {'seconds':>9}")
+
+    def report(name, count, seconds):
+        print(f"{name:>26} {count / seconds:>12.0f} {seconds:>9.3f}")
+
+    start = time.perf_counter()
+    expected = np.array([gmpy2.is_prime(v) for v in as_ints], dtype=bool)
+    report("gmpy2.is_prime loop", args.count, time.perf_counter() - start)
+
+    sample = as_ints[:args.pipeline_sample]
+    start = time.perf_counter()
+    for v in sample:
+        if v:
+            prime_numbers.run_primality_pipeline(v, parallel=True, use_cache=False)
+    report("run_primality_pipeline", len(sample), time.perf_counter() - start)
+
+    for name, parallel in (("is_prime_array serial", False), ("is_prime_array parallel", True)):
+        start = time.perf_counter()
+        mask = prime_vector.is_prime_array(values, parallel=parallel)
+        report(name, args.count, time.perf_counter() - start)
+        assert np.array_equal(mask, expected), "is_prime_array disagrees with gmpy2.is_prime"
+    print(f"{int(expected.sum())} primes")
+
+
+if __name__ == "__main__":
+    main()
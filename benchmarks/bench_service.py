@@ -0,0 +1,133 @@
+"""
+Load test of the local JSON service (prime_service.py).
+
+Starts the service in-process on a free loopback port, then runs --clients
+concurrent keep-alive clients that send --requests requests in total, a mix
+of /is_prime (half of them for a few shared "hot" numbers, so identical
+requests overlap and are coalesced), /next_prime and /factor. Prints
+throughput, client-side latency percentiles, the status codes seen and the
+service's own /stats. Exits 1 if any request got a 5xx other than the
+expected 503/504, so it can run as a CI check.
+
+Usage:
+    python benchmarks/bench_service.py [--clients 16] [--requests 400] [--bits 1024] [--max-queue 64]
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import gmpy2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import prime_service
+import verdict_cache
+import worker_pool
+
+
+def build_workload(requests, bits, seed):
+    rng = random.Random(seed)
+    state = gmpy2.random_state(seed)
+    hot = [str(gmpy2.next_prime(gmpy2.mpz_urandomb(state, bits) | (1 << (bits - 1)))) for _ in range(4)]
+    workload = []
+    for _ in range(requests):
+        r = rng.random()
+        if r < 0.5:
+            workload.append(("POST", "/is_prime", {"n": rng.choice(hot)}))
+        elif r < 0.75:
+            workload.append(("POST", "/is_prime", {"n": str(gmpy2.mpz_urandomb(state, bits) | 1)}))
+        elif r < 0.9:
+            workload.append(("GET", f"/next_prime?n={gmpy2.mpz_urandomb(state, bits // 2)}", None))
+        else:
+            semiprime = gmpy2.next_prime(rng.getrandbits(40)) * gmpy2.next_prime(rng.getrandbits(40))
+            workload.append(("GET", f"/factor?n={semiprime}&timeout=20", None))
+    return workload
+
+
+async def request(reader, writer, method, target, payload):
+    body = json.dumps(payload).encode() if payload is not None else b""
+    writer.write(f"{method} {target} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                 + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode().partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(port, queue, latencies, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while queue:
+            method, target, payload = queue.popleft()
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, method, target, payload)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run(args):
+    server, _ = await prime_service.start_server(port=0, max_queue=args.max_queue)
+    port = server.sockets[0].getsockname()[1]
+    queue = collections.deque(build_workload(args.requests, args.bits, args.seed))
+    latencies = []
+    statuses = collections.Counter()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, queue, latencies, statuses) for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    _, stats = await request(reader, writer, "GET", "/stats", None)
+    writer.close()
+    await writer.wait_closed()
+    await asyncio.sleep(0.1) # Let the server see the clients hang up
+    server.close()
+    await server.wait_closed()
+    return elapsed, latencies, statuses, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--bits", type=int, default=1024)
+    parser.add_argument("--max-queue", type=int, default=prime_service.DEFAULT_MAX_QUEUE)
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    verdict_cache.configure_cache(enabled=False) # Measure the service, not the cache
+    elapsed, latencies, statuses, stats = asyncio.run(run(args))
+    worker_pool.shutdown_pool()
+
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{len(latencies)} requests from {args.clients} clients in {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:.1f} req/s, {stats['workers']} workers)")
+    print(f"latency ms: p50 {percentile(0.5):.1f}  p90 {percentile(0.9):.1f}  p99 {percentile(0.99):.1f}  "
+          f"mean {statistics.mean(latencies) * 1000:.1f}")
+    print("status codes:", dict(sorted(statuses.items())))
+    print(f"coalesced {stats['coalesced']}, rejected {stats['rejected']}")
+    for path, endpoint in stats["endpoints"].items():
+        print(f"  {path:12} count {endpoint['count']:5}  errors {endpoint['errors']:4}  "
+              f"p50 {endpoint.get('p50', 0) * 1000:8.1f} ms  p99 {endpoint.get('p99', 0) * 1000:8.1f} ms")
+    unexpected = sum(count for status, count in statuses.items() if status >= 500 and status not in (503, 504))
+    return 1 if unexpected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
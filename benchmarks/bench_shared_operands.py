@@ -0,0 +1,91 @@
+"""
+Cost of sending a huge n to the pool workers: pickled into every task (the
+behaviour before worker_pool.shared_operand()) versus published once in
+shared memory with a small handle per task.
+
+Each "request" sends one task per base, like run_euler_tests_parallel, but
+the task only reduces n modulo its base, so the timing is dominated by the
+transfer of n rather than by the exponentiation. Every (mode, size) pair
+runs in a fresh child process with its own pool, so the peak RSS of the
+parent and of the largest worker can be read from getrusage().
+
+Usage:
+    python benchmarks/bench_shared_operands.py [--bits 1000000 4000000 10000000] [--bases 8] [--requests 5]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+import gmpy2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import instrumentation
+import worker_pool
+
+
+def residue_task(args):
+    n, base = args
+    return int(worker_pool.resolve_operand(n) % base)
+
+
+def run_child(mode, bits, bases, requests):
+    """Measures one mode and size in this process; prints the result as JSON."""
+    if mode == "pickled":
+        worker_pool.SHARED_OPERAND_BITS = bits + 1 # Never share: every task carries n
+    n = gmpy2.mpz_urandomb(gmpy2.random_state(2024), bits) | (gmpy2.mpz(1) << (bits - 1)) | 1
+    base_list = [gmpy2.next_prime(1000 + 100 * i) for i in range(bases)]
+    list(worker_pool.as_completed_results(residue_task, [(3, 7)] * worker_pool.get_pool_size())) # Start the workers
+    instrumentation.reset_instrumentation()
+
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        with worker_pool.shared_operand(n) as n_task:
+            results = [result for _, result, _ in
+                       worker_pool.as_completed_results(residue_task, [(n_task, b) for b in base_list])]
+        latencies.append(time.perf_counter() - start)
+        assert sorted(results) == sorted(int(n % b) for b in base_list)
+    counters = instrumentation.counter_totals()
+    worker_pool.shutdown_pool(wait=True) # Reaps the workers, so their peak RSS is in RUSAGE_CHILDREN
+    print(json.dumps({
+        "median": statistics.median(latencies), "min": min(latencies),
+        "pickled_per_request": counters.get("bytes_pickled", 0) / requests,
+        "shared_per_request": counters.get("bytes_shared", 0) / requests,
+        "parent_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "worker_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+", default=[1000000, 4000000, 10000000])
+    parser.add_argument("--bases", type=int, default=8, help="tasks per request (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "BITS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], int(args.child[1]), args.bases, args.requests)
+        return
+
+    print(f"{args.bases} tasks per request, {args.requests} requests, {worker_pool.get_pool_size()} workers")
+    print(f"{'bits':>10} {'mode':>8} {'median ms':>10} {'min ms':>9} {'MB pickled':>11} {'MB shared':>10} "
+          f"{'parent MB':>10} {'worker MB':>10}")
+    for bits in args.bits:
+        for mode in ("pickled", "shared"):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", mode, str(bits),
+                                     "--bases", str(args.bases), "--requests", str(args.requests)],
+                                    check=True, capture_output=True, text=True).stdout
+            r = json.loads(output.strip().splitlines()[-1])
+            print(f"{bits:>10} {mode:>8} {r['median'] * 1000:>10.1f} {r['min'] * 1000:>9.1f} "
+                  f"{r['pickled_per_request'] / 2**20:>11.2f} {r['shared_per_request'] / 2**20:>10.2f} "
+                  f"{r['parent_rss_kb'] / 1024:>10.1f} {r['worker_rss_kb'] / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
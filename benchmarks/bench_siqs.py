@@ -0,0 +1,78 @@
+"""
+Time to factor balanced semiprimes (two primes of half the digits each) with
+the self-initialising quadratic sieve (siqs.siqs() directly, so sizes below
+factorization.SIQS_MIN_DIGITS can be measured), at 20, 24, 30, 40, 60 and 80
+digits by default, against Pollard rho + ECM alone (factorize() with the sieve
+turned off, each stage given at most --ecm-limit seconds). The size from which
+the sieve wins is where SIQS_MIN_DIGITS belongs.
+
+The semiprimes come from a seeded random state, so runs are comparable.
+Expect minutes at 70 digits and hours at 80 on one core; the sieving is
+spread over the worker pool.
+
+Usage:
+    python benchmarks/bench_siqs.py [--digits 20 24 30 40 60 80] [--workers N] [--ecm-limit 60] [--seed 2024]
+"""
+import argparse
+import os
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import factorization
+import instrumentation
+import siqs
+import worker_pool
+
+
+def balanced_semiprime(digits, random_state):
+    """p * q with p and q random primes of about digits / 2 digits each."""
+    while True:
+        bits = int(digits * 3.3219280948873626 / 2) + 1
+        p = gmpy2.next_prime(gmpy2.mpz_urandomb(random_state, bits) | (mpz(1) << (bits - 1)))
+        q = gmpy2.next_prime(gmpy2.mpz_urandomb(random_state, bits) | (mpz(1) << (bits - 1)))
+        if p != q and len(str(p * q)) == digits:
+            return p * q
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--digits", type=int, nargs="+", default=[20, 24, 30, 40, 60, 80])
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    parser.add_argument("--ecm-limit", type=float, default=60.0,
+                        help="seconds for rho + ECM alone per number, 0 to skip (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=2024)
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    random_state = gmpy2.random_state(args.seed)
+    print(f"{worker_pool.get_pool_size()} workers")
+    print(f"{'digits':>6} {'rho+ECM':>10} {'SIQS':>10} {'relations':>10} {'matrix rows':>12}")
+    for digits in args.digits:
+        n = balanced_semiprime(digits, random_state)
+
+        ecm_text = "-"
+        if args.ecm_limit > 0:
+            start = time.perf_counter()
+            try:
+                factorization.factorize(n, rho_time_limit=args.ecm_limit, ecm_time_limit=args.ecm_limit,
+                                        siqs_time_limit=0)
+                ecm_text = f"{time.perf_counter() - start:.1f}s"
+            except factorization.FactorizationIncomplete:
+                ecm_text = f">{args.ecm_limit:.0f}s"
+
+        with instrumentation.start_trace("bench_siqs") as trace:
+            start = time.perf_counter()
+            factor = siqs.siqs(n)
+            seconds = time.perf_counter() - start
+        assert factor is not None and 1 < factor < n and n % factor == 0, factor
+        print(f"{digits:>6} {ecm_text:>10} {seconds:>9.1f}s {trace.counters['siqs_relations']:>10} "
+              f"{trace.counters['siqs_matrix_rows']:>12}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
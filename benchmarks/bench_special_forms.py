@@ -0,0 +1,53 @@
+"""
+The deterministic tests for k*2^n+-1 (special_forms.py) against the generic
+tests the pipeline runs otherwise: one Euler-Jacobi base (a full-size
+gmpy2.powmod) and the Baillie-PSW test, on Mersenne, Riesel, Proth and
+Fermat numbers.
+
+The known prime tables are not consulted, so known Mersenne primes are
+tested like any other input.
+
+Usage:
+    python benchmarks/bench_special_forms.py [--numbers 2**11213-1 3*2**7559-1 3*2**3912+1 2**16384+1]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import expression_eval
+import prime_numbers
+import special_forms
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--numbers", nargs="+",
+                        default=["2**11213-1", "3*2**7559-1", "3*2**3912+1", "2**16384+1"])
+    args = parser.parse_args()
+
+    print(f"{'number':>16} {'bits':>7} {'test':>13} {'verdict':>10} {'special':>9} {'1 EJ base':>10} {'BPSW':>9}")
+    for text in args.numbers:
+        n = expression_eval.evaluate_expression(text)
+        form = special_forms.detect_special_form(n)
+        if form is None:
+            print(f"{text:>16} is not of the form k*2^n+-1 with k < 2^n")
+            continue
+        result, special_time = timed(special_forms.prove_special_form, n, form)
+        euler, euler_time = timed(prime_numbers.run_euler_tests_serial, n, [3])
+        bpsw, bpsw_time = timed(prime_numbers.run_bpsw, n, False)
+        assert result["prime"] == (euler[0][1] and bpsw[0] is None), (text, result, euler, bpsw)
+        verdict = "prime" if result["prime"] else "composite"
+        print(f"{text:>16} {n.bit_length():>7} {result['test']:>13} {verdict:>10} {special_time:>8.2f}s "
+              f"{euler_time:>9.2f}s {bpsw_time:>8.2f}s", flush=True)
+
+
+if __name__ == "__main__":
+    main()
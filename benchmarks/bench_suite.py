@@ -0,0 +1,281 @@
+"""
+Reproducible benchmark suite for the primality and factorization pipelines.
+
+Runs a fixed corpus headless and reports per-stage and end-to-end timings:
+  - prime:     a prime of each --bits size that is not in the known prime
+               tables: random primes up to RANDOM_PRIME_BITS (Euler-Jacobi
+               bases), above that the Proth primes 3*2**n+1 closest in size,
+               which the pipeline proves prime with the Proth test (stage
+               special_form; the largest one has 213k bits, and searching for
+               a random prime that large would take hours)
+  - composite: products of random primes of up to 512 bits, so the small
+               divisor filter passes and an Euler-Jacobi base has to fail
+  - mersenne:  known Mersenne primes (answered from the tables) and composite
+               2**p-1 with prime p near each --bits size, parsed from text
+  - semiprime: p*q of two random primes of each --factor-bits size,
+               factored with decompose_number()
+Every input is generated from --seed, and the random Euler-Jacobi bases are
+reseeded with it before each run (prime_numbers.seed_random_bases), so two
+runs of the same code do the same work. The verdict cache is bypassed.
+
+Each case runs --warmup times untimed and then --repeat times; the min,
+median, mean and standard deviation of every stage (the verdict's timings)
+and of the whole call are written to --output as JSON, together with the
+versions and the commit that were measured.
+
+Compare mode matches two result files case by case and flags every case or
+stage whose median grew by more than --threshold (and by more than
+--min-seconds, to ignore noise in sub-millisecond stages). It exits with
+status 1 if anything regressed.
+
+Usage:
+    python benchmarks/bench_suite.py [--full] [--repeat 3] [--warmup 1] [--workers N] [--output results.json]
+    python benchmarks/bench_suite.py --compare baseline.json results.json [--threshold 0.1]
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import number_decomposition
+import prime_numbers
+import worker_pool
+
+DEFAULT_BITS = [256, 1024, 4096, 16384]
+FULL_BITS = [256, 1024, 4096, 16384, 65536, 262144, 1048576]
+DEFAULT_FACTOR_BITS = [32, 48, 64]
+FULL_FACTOR_BITS = [32, 48, 64, 80, 96]
+CATEGORIES = ("prime", "composite", "mersenne", "semiprime")
+
+RANDOM_PRIME_BITS = 4096 # Larger primes come from PROTH_PRIME_EXPONENTS
+PROTH_PRIME_EXPONENTS = (2208, 20909, 213321) # 3*2**n+1 is prime (OEIS A002253)
+COMPOSITE_FACTOR_BITS = 512
+KNOWN_MERSENNE_CASES = (127, 4423, 86243, 1257787)
+
+
+def random_prime(bits, state):
+    """A random prime with exactly `bits` bits."""
+    return gmpy2.next_prime(gmpy2.mpz_urandomb(state, bits - 1) | (mpz(1) << (bits - 1)))
+
+
+def prime_case(bits, state):
+    if bits <= RANDOM_PRIME_BITS:
+        n = random_prime(bits, state)
+        while n.bit_length() > bits:
+            n = random_prime(bits, state)
+        return n
+    exponent = min(PROTH_PRIME_EXPONENTS, key=lambda e: abs(e + 2 - bits))
+    return 3 * mpz(2)**exponent + 1
+
+
+def composite_case(bits, state):
+    """A product of at least two random primes of at most COMPOSITE_FACTOR_BITS bits, with about `bits` bits."""
+    count = max(2, -(-bits // COMPOSITE_FACTOR_BITS))
+    n = mpz(1)
+    for i in range(count):
+        n *= random_prime(bits // count + (1 if i < bits % count else 0), state)
+    return n
+
+
+def composite_mersenne_exponent(bits):
+    """The largest prime p <= bits for which 2**p-1 is not a known Mersenne prime."""
+    p = int(gmpy2.next_prime(bits))
+    while p > bits or p in prime_numbers.KNOWN_MERSENNE_EXPONENTS:
+        p -= 1
+        while not gmpy2.is_prime(p):
+            p -= 1
+    return p
+
+
+def build_corpus(bits_list, factor_bits_list, categories, seed):
+    """
+    Returns the benchmark cases as dicts with name, category, input
+    (an mpz, or an expression string to be parsed) and expected result.
+    """
+    state = gmpy2.random_state(seed)
+    cases = {}
+
+    def add(category, name, value, expected):
+        cases.setdefault(name, {"name": name, "category": category, "input": value, "expected": expected})
+
+    for bits in bits_list:
+        if "prime" in categories:
+            n = prime_case(bits, state)
+            # The Proth primes above RANDOM_PRIME_BITS are proven, not probable primes
+            add("prime", f"prime-{n.bit_length()}", n, "probable_prime" if bits <= RANDOM_PRIME_BITS else "prime")
+        if "composite" in categories:
+            n = composite_case(bits, state)
+            add("composite", f"composite-{n.bit_length()}", n, "composite")
+        if "mersenne" in categories:
+            p = composite_mersenne_exponent(bits)
+            add("mersenne", f"mersenne-2**{p}-1", f"2**{p}-1", "composite")
+    if "mersenne" in categories:
+        for p in KNOWN_MERSENNE_CASES:
+            add("mersenne", f"mersenne-2**{p}-1", f"2**{p}-1", "prime")
+    if "semiprime" in categories:
+        for bits in factor_bits_list:
+            p, q = sorted((random_prime(bits, state), random_prime(bits, state)))
+            add("semiprime", f"semiprime-{bits}x2", p * q, [(int(p), 1), (int(q), 1)] if p != q else [(int(p), 2)])
+    return list(cases.values())
+
+
+def summarize(samples):
+    return {"min": min(samples), "median": statistics.median(samples), "mean": statistics.mean(samples),
+            "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0, "samples": samples}
+
+
+def run_case(case, repeat, warmup, seed):
+    """
+    Runs one case `warmup` times untimed (to build the cached prime tables
+    and so on), then `repeat` times. Returns its result dict (timings summarized).
+    """
+    total_samples = []
+    stage_samples = {}
+    for run in range(warmup + repeat):
+        prime_numbers.seed_random_bases(seed)
+        stages = {}
+        start = time.perf_counter()
+        if case["category"] == "semiprime":
+            factors = number_decomposition.decompose_number(case["input"], use_cache=False)
+            outcome, stage = [(int(p), e) for p, e in factors], "factorization"
+        else:
+            n = case["input"]
+            if isinstance(n, str):
+                stage_start = time.perf_counter()
+                n = prime_numbers.evaluate_input_expression(n)
+                evaluated_bits = n.bit_length()
+                stages["parse"] = time.perf_counter() - stage_start
+            verdict = prime_numbers.run_primality_pipeline(n, use_cache=False)
+            outcome, stage = verdict["verdict"], verdict["stage"]
+            stages.update(verdict["timings"])
+        elapsed = time.perf_counter() - start
+        if outcome != case["expected"]:
+            raise AssertionError(f"{case['name']}: expected {case['expected']}, got {outcome}")
+        if run < warmup:
+            continue
+        total_samples.append(elapsed)
+        for name, seconds in stages.items():
+            stage_samples.setdefault(name, []).append(seconds)
+
+    bits = evaluated_bits if isinstance(case["input"], str) else case["input"].bit_length()
+    return {"category": case["category"], "bits": int(bits), "stage": stage,
+            "end_to_end": summarize(total_samples),
+            "stages": {name: summarize(samples) for name, samples in stage_samples.items()}}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args):
+    bits_list = args.bits or (FULL_BITS if args.full else DEFAULT_BITS)
+    factor_bits_list = args.factor_bits or (FULL_FACTOR_BITS if args.full else DEFAULT_FACTOR_BITS)
+    worker_pool.configure_pool(args.workers)
+    worker_pool.map_tasks(abs, [0] * worker_pool.get_pool_size()) # start the workers outside the timings
+
+    start = time.perf_counter()
+    corpus = build_corpus(bits_list, factor_bits_list, args.categories, args.seed)
+    print(f"corpus: {len(corpus)} cases built in {time.perf_counter() - start:.1f}s (seed {args.seed}), "
+          f"workers={worker_pool.get_pool_size()} repeat={args.repeat}")
+    print(f"{'case':>24} {'stage':>16} {'median':>10} {'stdev':>9} {'min':>10}")
+
+    results = {}
+    for case in corpus:
+        result = run_case(case, args.repeat, args.warmup, args.seed)
+        results[case["name"]] = result
+        total = result["end_to_end"]
+        print(f"{case['name']:>24} {result['stage']:>16} {total['median']:>9.4f}s {total['stdev']:>8.4f}s "
+              f"{total['min']:>9.4f}s")
+
+    report = {
+        "meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                 "python": platform.python_version(), "gmpy2": gmpy2.version(), "gmp": gmpy2.mp_version(),
+                 "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                 "workers": worker_pool.get_pool_size(), "seed": args.seed, "repeat": args.repeat,
+                 "warmup": args.warmup,
+                 "bits": bits_list, "factor_bits": factor_bits_list},
+        "cases": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"results written to {args.output}")
+
+
+def compare_results(baseline_path, current_path, threshold, min_seconds):
+    """Prints the median timings of both runs side by side. Returns the number of regressions."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    if baseline["meta"].get("seed") != current["meta"].get("seed"):
+        print("warning: the runs used different seeds, so their inputs differ")
+
+    regressions = 0
+    print(f"{'case':>24} {'timing':>16} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, old_case in baseline["cases"].items():
+        new_case = current["cases"].get(name)
+        if new_case is None:
+            print(f"{name:>24} missing from {current_path}")
+            continue
+        rows = [("end_to_end", old_case["end_to_end"], new_case["end_to_end"])]
+        rows += [(stage, summary, new_case["stages"][stage])
+                 for stage, summary in old_case["stages"].items() if stage in new_case["stages"]]
+        for timing, old, new in rows:
+            old_time, new_time = old["median"], new["median"]
+            change = new_time / old_time - 1 if old_time > 0 else 0.0
+            flag = ""
+            if change > threshold and new_time - old_time > min_seconds:
+                flag = "  REGRESSION"
+                regressions += 1
+            elif change < -threshold and old_time - new_time > min_seconds:
+                flag = "  faster"
+            print(f"{name:>24} {timing:>16} {old_time:>9.4f}s {new_time:>9.4f}s {change:>+7.1%}{flag}")
+    for name in current["cases"].keys() - baseline["cases"].keys():
+        print(f"{name:>24} new in {current_path}")
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+", default=None,
+                        help=f"sizes of the primality inputs (default: {DEFAULT_BITS})")
+    parser.add_argument("--factor-bits", type=int, nargs="+", default=None,
+                        help=f"sizes of the two factors of each semiprime (default: {DEFAULT_FACTOR_BITS})")
+    parser.add_argument("--full", action="store_true",
+                        help=f"use the full corpus ({FULL_BITS[-1]} bits, {FULL_FACTOR_BITS[-1]}-bit factors; hours)")
+    parser.add_argument("--categories", nargs="+", choices=CATEGORIES, default=list(CATEGORIES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs of each case before the timed ones")
+    parser.add_argument("--seed", type=int, default=2024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two result files instead of running the suite")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown of a median reported as a regression (default: %(default)s)")
+    parser.add_argument("--min-seconds", type=float, default=0.001,
+                        help="ignore changes smaller than this many seconds (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_results(*args.compare, args.threshold, args.min_seconds) else 0)
+    run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
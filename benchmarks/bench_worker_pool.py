@@ -0,0 +1,75 @@
+"""
+Per-request latency of the shared worker pool versus a fresh
+ProcessPoolExecutor per call (the behaviour before worker_pool.py).
+
+Each "request" runs one Euler residue a^((n-1)/2) mod n per base, exactly
+like run_euler_tests_parallel, for a random odd n of the given bit size.
+
+Usage:
+    python benchmarks/bench_worker_pool.py [--bits 256 1024 4096] [--requests 20] [--bases 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import gmpy2
+from gmpy2 import mpz, powmod
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import worker_pool
+
+
+def euler_residue(args):
+    n_mpz, a_mpz = args
+    return int(a_mpz), powmod(a_mpz, (n_mpz - 1) // 2, n_mpz) in (1, n_mpz - 1)
+
+
+def per_call_pool(args_list):
+    with ProcessPoolExecutor(max_workers=worker_pool.get_pool_size()) as executor:
+        return list(executor.map(euler_residue, args_list))
+
+
+def shared_pool(args_list):
+    return [result for _, result, _ in worker_pool.as_completed_results(euler_residue, args_list)]
+
+
+def measure(run, args_list, requests):
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        run(args_list)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--bases", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    worker_pool.configure_pool(args.workers)
+    state = gmpy2.random_state(12345)
+    print(f"workers={worker_pool.get_pool_size()} requests={args.requests} bases={args.bases}")
+    print(f"{'bits':>6} {'per-call mean':>14} {'per-call p50':>13} {'shared mean':>12} {'shared p50':>11} {'speedup':>8}")
+
+    # Warm the shared pool once so the first measured request is not a cold start
+    shared_pool([(mpz(7), mpz(2))])
+
+    for bits in args.bits:
+        n_mpz = gmpy2.mpz_urandomb(state, bits) | (mpz(1) << (bits - 1)) | 1
+        args_list = [(n_mpz, mpz(2 + i)) for i in range(args.bases)]
+        fresh = measure(per_call_pool, args_list, args.requests)
+        warm = measure(shared_pool, args_list, args.requests)
+        print(f"{bits:>6} {statistics.mean(fresh) * 1000:>12.2f}ms {statistics.median(fresh) * 1000:>11.2f}ms "
+              f"{statistics.mean(warm) * 1000:>10.2f}ms {statistics.median(warm) * 1000:>9.2f}ms "
+              f"{statistics.mean(fresh) / statistics.mean(warm):>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
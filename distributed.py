@@ -0,0 +1,626 @@
+"""
+Coordinator/worker mode: spreads the units of one large job over other machines.
+
+worker_pool.py stops at the cores of one machine. Here a coordinator listens
+on TCP and worker hosts connect to it (python distributed.py worker
+HOST:PORT), one connection per worker process of their local pool. While at
+least one worker is connected, the jobs the pipeline already splits into
+independent tasks go to the workers unit by unit instead of the local pool:
+
+    kind          unit                              split by
+    euler         one Euler-Jacobi base             prime_numbers.run_euler_tests_parallel
+    miller_rabin  one Miller-Rabin guard base       prime_numbers.run_mr_guard
+    ecm           a batch of ECM curves             factorization.ecm (decompose_number)
+    sieve         one sieve segment                 prime_sieve.run_segments
+    trial_factor  a set of k classes and a k-range  mersenne_factoring.trial_factor
+
+A unit is leased to one worker for LEASE_SECONDS, and the worker renews the
+lease with a heartbeat every third of that while the unit runs. A unit whose
+lease runs out (the worker hangs or its machine died) or whose worker
+disconnects goes back to the front of the queue for the next worker; if it
+comes back twice, the first result counts. If the last worker disconnects,
+run_job() raises NoWorkers and the caller reruns the job on its local pool.
+Results are merged as they arrive. One that settles the job (a failing base,
+a factor) stops it: none of its other units is leased any more, and workers
+still running one hear so at their next heartbeat and terminate it (by
+terminating their local pool, as abandon_running_tests() does).
+
+Protocol: one JSON object per line each way, and a reply to every message:
+    {"op": "hello", "token": t}                  -> {"op": "welcome", "lease": seconds}
+    {"op": "lease", "have": [job, ...]}          -> {"op": "unit", "job", "unit", "kind", "args"[, "operand"]}
+                                                    or {"op": "wait", "seconds": s}
+    {"op": "heartbeat", "job": j, "unit": u}     -> {"op": "ok"} or {"op": "cancel"}
+    {"op": "result", "job", "unit", "result"}    -> {"op": "ok"}
+    {"op": "failed", "job", "unit", "error"}     -> {"op": "ok"}
+The operand of a job (the n under test, in hex) only goes with a unit to a
+worker that does not have it yet. Workers are trusted with everything but
+factors, which the callers check before they stop a job. The coordinator
+only listens beyond the loopback interface with a token (--token or
+PRIME_DISTRIBUTED_TOKEN), which every worker must then present.
+
+Usage:
+    python distributed.py coordinator [--host 0.0.0.0 --token SECRET] [--port 8766] [--min-workers 4]
+                                      test N [--bases 16] | factor N | count A B | mersenne P [--depth 60]
+    python distributed.py worker HOST:PORT [--token SECRET] [--workers N]
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from gmpy2 import mpz
+
+import instrumentation
+import worker_pool
+
+DEFAULT_PORT = 8766
+LEASE_SECONDS = 60.0 # A unit goes to another worker if its lease is not renewed within this time
+WAIT_SECONDS = 0.5 # An idle worker asks again for a unit after this long
+MAX_MESSAGE_BYTES = 64 * 2**20 # Longest line, e.g. an operand of 2^28 bits in hex
+MAX_UNIT_FAILURES = 3 # A unit that raised on this many workers fails its job
+CONNECT_TIMEOUT = 30.0 # Seconds a worker keeps trying to reach the coordinator
+OPERANDS_CACHED = 4 # Job operands each worker connection keeps
+TOKEN = os.environ.get("PRIME_DISTRIBUTED_TOKEN")
+
+# results: {unit index: result}, stopped_by: index of the result that stopped the job (or None),
+# complete: True if every unit has a result
+JobResult = collections.namedtuple("JobResult", "results stopped_by complete")
+
+_coordinator = None
+
+
+class UnitFailed(RuntimeError):
+    """Raised by run_job() when a unit raised an exception on MAX_UNIT_FAILURES workers."""
+
+
+class NoWorkers(RuntimeError):
+    """Raised by run_job() when every worker disconnected before the job finished."""
+
+
+# -------------------  UNITS (run on the worker hosts)  -------------------
+
+def euler_unit(n, base):
+    import prime_numbers
+    import prp_checkpoint
+    if prp_checkpoint.use_checkpoints(n):
+        return prp_checkpoint.euler_test_checkpointed((n, mpz(base), None))
+    return prime_numbers.euler_test_single_base((n, mpz(base)))
+
+
+def miller_rabin_unit(n, base):
+    import prime_numbers
+    return prime_numbers.miller_rabin_task((n, mpz(base)))
+
+
+def ecm_unit(n, b1, b2, first_sigma, curves):
+    import factorization
+    return factorization.ecm_curve_batch((n, b1, b2, first_sigma, curves))
+
+
+def sieve_unit(_, lo, hi, count_only):
+    import prime_sieve
+    return prime_sieve.sieve_segment((lo, hi, count_only))
+
+
+def trial_factor_unit(p, classes, k_start, k_stop):
+    import mersenne_factoring
+    return mersenne_factoring.trial_factor_task((int(p), classes, k_start, k_stop))
+
+
+UNIT_KINDS = {"euler": euler_unit, "miller_rabin": miller_rabin_unit, "ecm": ecm_unit,
+              "sieve": sieve_unit, "trial_factor": trial_factor_unit}
+
+
+def run_unit(args):
+    """Pool task on a worker host: args is (kind, operand, unit arguments)."""
+    kind, operand, unit = args
+    return UNIT_KINDS[kind](operand, *unit)
+
+
+def encode(message):
+    return json.dumps(message, default=int, separators=(",", ":")).encode() + b"\n"
+
+
+# -------------------  COORDINATOR  -------------------
+
+class Job:
+    """One job of the coordinator; its state is only changed on the coordinator's event loop."""
+
+    def __init__(self, job_id, kind, operand, units, stop_when):
+        self.id = job_id
+        self.kind = kind
+        self.operand = None if operand is None else format(mpz(operand), "x")
+        self.units = units
+        self.stop_when = stop_when
+        self.pending = collections.deque(range(len(units)))
+        self.leases = {} # unit index -> (connection, expiry)
+        self.failures = collections.Counter()
+        self.results = {}
+        self.stopped_by = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class Coordinator:
+    """
+    Leases the units of the jobs passed to run_job() to the workers connected
+    over TCP. The server runs on an event loop in a thread of its own;
+    run_job() is called from any other thread and blocks until the job is done.
+    """
+
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, token=TOKEN, lease_seconds=LEASE_SECONDS):
+        if not token and not ipaddress.ip_address(host).is_loopback:
+            raise ValueError(f"Listening on {host} needs a token (--token or PRIME_DISTRIBUTED_TOKEN).")
+        self.host = host
+        self.port = port
+        self.token = token
+        self.lease_seconds = lease_seconds
+        self.jobs = collections.OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.connections = set()
+        self.workers = 0
+        self.units_leased = 0
+        self.units_reissued = 0
+        self.loop = None
+        self.server = None
+        self.reclaim_task = None
+        self.thread = None
+        self.address = None
+
+    def start(self):
+        """Starts listening (port 0 picks a free port). Returns the (host, port) listened on."""
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.server = self.loop.run_until_complete(asyncio.start_server(
+                    self.handle_connection, self.host, self.port, limit=MAX_MESSAGE_BYTES))
+            except OSError as e:
+                errors.append(e)
+                ready.set()
+                return
+            self.address = self.server.sockets[0].getsockname()[:2]
+            self.reclaim_task = self.loop.create_task(self.reclaim_expired_leases())
+            ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name="coordinator", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self.address
+
+    def close(self):
+        """Stops the server and drops every worker connection."""
+        if self.loop is None or not self.thread.is_alive():
+            return
+
+        async def shutdown():
+            self.reclaim_task.cancel()
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def worker_count(self):
+        """Number of connected workers (one per worker process of each host)."""
+        return self.workers
+
+    def wait_for_workers(self, count, poll=WAIT_SECONDS):
+        while self.workers < count:
+            time.sleep(poll)
+
+    def run_job(self, kind, operand, units, stop_when=None, timeout=None, progress_callback=None):
+        """
+        Runs units (lists of JSON-serializable arguments, see UNIT_KINDS) of
+        the given kind on the workers, with operand (an integer or None) as
+        their first argument. stop_when(result), if given, is called on each
+        result as it arrives; once it returns True, the job stops.
+        Stops after timeout seconds, if given, with the results so far.
+        progress_callback(fraction) is called as units finish.
+        Raises worker_pool.TaskCancelled if this thread's request is cancelled,
+        UnitFailed if a unit raised on MAX_UNIT_FAILURES workers, and
+        NoWorkers if no worker is left to run the remaining units (the
+        callers then run the job on the local pool).
+        Returns a JobResult.
+        """
+        if not units:
+            return JobResult({}, None, True)
+        job = Job(next(self.job_ids), kind, operand, [list(unit) for unit in units], stop_when)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        reported = 0
+        self.loop.call_soon_threadsafe(self.jobs.__setitem__, job.id, job)
+        try:
+            while not job.done.wait(worker_pool.CANCEL_CHECK_INTERVAL):
+                worker_pool.raise_if_cancelled()
+                if progress_callback and len(job.results) != reported:
+                    reported = len(job.results)
+                    progress_callback(reported / len(units))
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+                if self.workers == 0 and not job.done.is_set():
+                    raise NoWorkers(f"Every worker disconnected during a {kind} job.")
+        finally:
+            self.loop.call_soon_threadsafe(self.jobs.pop, job.id, None)
+        if job.error is not None:
+            raise UnitFailed(job.error)
+        results = dict(job.results)
+        instrumentation.count("distributed_units", len(results))
+        if progress_callback:
+            progress_callback(len(results) / len(units))
+        return JobResult(results, job.stopped_by, len(results) == len(units))
+
+    # The rest runs on the event loop
+
+    async def handle_connection(self, reader, writer):
+        registered = False
+        self.connections.add(writer)
+        try:
+            hello = await self.read_message(reader)
+            if hello is None or hello.get("op") != "hello" or not self.token_matches(hello.get("token")):
+                return
+            registered = True
+            self.workers += 1
+            await self.send(writer, {"op": "welcome", "lease": self.lease_seconds})
+            while True:
+                message = await self.read_message(reader)
+                if message is None:
+                    break
+                op = message.get("op")
+                if op == "lease":
+                    reply = self.lease_unit(writer, set(message.get("have", ())))
+                elif op == "heartbeat":
+                    reply = self.renew_lease(writer, message)
+                elif op == "result":
+                    reply = self.record_result(message)
+                elif op == "failed":
+                    reply = self.record_failure(writer, message)
+                else:
+                    break
+                await self.send(writer, reply)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, KeyError):
+            pass # Malformed message or the worker went away
+        finally:
+            if registered:
+                self.workers -= 1
+            self.connections.discard(writer)
+            self.release_leases(writer)
+            writer.close()
+
+    async def read_message(self, reader):
+        line = await reader.readline()
+        return json.loads(line) if line.strip() else None
+
+    async def send(self, writer, message):
+        writer.write(encode(message))
+        await writer.drain()
+
+    def token_matches(self, token):
+        if not self.token:
+            return True
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def lease_unit(self, connection, have):
+        """The next pending unit of the oldest job that has one, or a wait message."""
+        for job in self.jobs.values():
+            if job.stopped_by is not None or job.error is not None or not job.pending:
+                continue
+            index = job.pending.popleft()
+            job.leases[index] = (connection, time.monotonic() + self.lease_seconds)
+            self.units_leased += 1
+            message = {"op": "unit", "job": job.id, "unit": index, "kind": job.kind, "args": job.units[index]}
+            if job.id not in have:
+                message["operand"] = job.operand
+            return message
+        return {"op": "wait", "seconds": WAIT_SECONDS}
+
+    def renew_lease(self, connection, message):
+        job = self.jobs.get(message["job"])
+        index = message["unit"]
+        if job is None or job.stopped_by is not None or job.error is not None or index in job.results:
+            return {"op": "cancel"}
+        owner, _ = job.leases.get(index, (None, None))
+        if owner is connection:
+            job.leases[index] = (connection, time.monotonic() + self.lease_seconds)
+        return {"op": "ok"}
+
+    def record_result(self, message):
+        job = self.jobs.get(message["job"])
+        index = message["unit"]
+        if job is None or job.done.is_set() or index in job.results:
+            return {"op": "ok"} # Late, duplicate (a reissued unit) or for a stopped job
+        job.results[index] = message["result"]
+        job.leases.pop(index, None)
+        if index in job.pending:
+            job.pending.remove(index)
+        if job.stop_when is not None and job.stop_when(message["result"]):
+            job.stopped_by = index
+            job.done.set()
+        elif len(job.results) == len(job.units):
+            job.done.set()
+        return {"op": "ok"}
+
+    def record_failure(self, connection, message):
+        job = self.jobs.get(message["job"])
+        index = message["unit"]
+        if job is not None and index not in job.results and job.leases.get(index, (None,))[0] is connection:
+            del job.leases[index]
+            job.failures[index] += 1
+            if job.failures[index] >= MAX_UNIT_FAILURES:
+                job.error = f"{job.kind} unit {job.units[index]} failed: {message.get('error')}"
+                job.done.set()
+            else:
+                job.pending.appendleft(index)
+        return {"op": "ok"}
+
+    def release_leases(self, connection):
+        """Puts the units leased over a closed connection back at the front of their queues."""
+        for job in self.jobs.values():
+            for index, (owner, _) in list(job.leases.items()):
+                if owner is connection:
+                    del job.leases[index]
+                    job.pending.appendleft(index)
+                    self.units_reissued += 1
+
+    async def reclaim_expired_leases(self):
+        while True:
+            await asyncio.sleep(min(1.0, self.lease_seconds / 4))
+            now = time.monotonic()
+            for job in self.jobs.values():
+                for index, (_, expiry) in list(job.leases.items()):
+                    if expiry < now:
+                        del job.leases[index]
+                        job.pending.appendleft(index)
+                        self.units_reissued += 1
+
+
+def start_coordinator(host="127.0.0.1", port=DEFAULT_PORT, token=TOKEN, lease_seconds=LEASE_SECONDS):
+    """
+    Starts the coordinator the pipeline sends its units to (see active_coordinator()),
+    replacing one started before. Returns it.
+    """
+    global _coordinator
+    stop_coordinator()
+    coordinator = Coordinator(host, port, token, lease_seconds)
+    coordinator.start()
+    _coordinator = coordinator
+    return coordinator
+
+
+def stop_coordinator():
+    global _coordinator
+    if _coordinator is not None:
+        _coordinator.close()
+        _coordinator = None
+
+
+def active_coordinator():
+    """The coordinator from start_coordinator() if a worker is connected to it, else None."""
+    if _coordinator is not None and _coordinator.worker_count() > 0:
+        return _coordinator
+    return None
+
+
+def run_bases(coordinator, kind, n, bases, stop_on_failure=True, progress_callback=None):
+    """
+    Runs the Euler-Jacobi ("euler") or Miller-Rabin ("miller_rabin") bases of
+    n on the workers, stopping at the first failing base with stop_on_failure.
+    Returns the result tuples of the bases that finished, sorted by base.
+    Raises NoWorkers if every worker disconnected first.
+    """
+    job = coordinator.run_job(kind, n, [[int(b)] for b in bases],
+                              stop_when=(lambda result: not result[1]) if stop_on_failure else None,
+                              progress_callback=progress_callback)
+    return sorted((tuple(result) for result in job.results.values()), key=lambda result: result[0])
+
+
+# -------------------  WORKER  -------------------
+
+class CoordinatorConnection:
+    """A blocking connection of one worker slot to the coordinator."""
+
+    def __init__(self, host, port, token):
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            try:
+                self.socket = socket.create_connection((host, port))
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(WAIT_SECONDS)
+        self.file = self.socket.makefile("rwb")
+        welcome = self.request({"op": "hello", "token": token})
+        if welcome is None or welcome.get("op") != "welcome":
+            self.close()
+            raise ConnectionError(f"The coordinator at {host}:{port} refused the connection (wrong token?).")
+        self.lease_seconds = welcome["lease"]
+
+    def request(self, message):
+        """Sends message and returns the reply, or None once the coordinator has closed the connection."""
+        self.file.write(encode(message))
+        self.file.flush()
+        line = self.file.readline()
+        return json.loads(line) if line else None
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def run_leased_unit(connection, message, operand):
+    """
+    Runs one unit on the local pool, renewing its lease while it runs.
+    Returns (cancelled, result).
+    """
+    task = (message["kind"], operand, message["args"])
+    heartbeat = {"op": "heartbeat", "job": message["job"], "unit": message["unit"]}
+    while True:
+        future = worker_pool.submit(run_unit, task)
+        while not concurrent.futures.wait([future], timeout=connection.lease_seconds / 3).done:
+            reply = connection.request(heartbeat)
+            if reply is None:
+                raise ConnectionError("The coordinator closed the connection.")
+            if reply["op"] == "cancel":
+                worker_pool.terminate_pool() # Stops the unit at once; other slots resubmit theirs
+                return True, None
+        try:
+            return False, future.result()
+        except BrokenProcessPool:
+            continue # The pool was terminated for another slot's cancelled unit
+
+
+def worker_slot(connection):
+    """Serves one connection to the coordinator: leases units and runs them one at a time."""
+    operands = collections.OrderedDict() # job -> operand
+    try:
+        while True:
+            message = connection.request({"op": "lease", "have": list(operands)})
+            if message is None:
+                return
+            if message["op"] == "wait":
+                time.sleep(message["seconds"])
+                continue
+            job = message["job"]
+            if "operand" in message:
+                operands[job] = None if message["operand"] is None else mpz(message["operand"], 16)
+                while len(operands) > OPERANDS_CACHED:
+                    operands.popitem(last=False)
+            try:
+                cancelled, result = run_leased_unit(connection, message, operands.get(job))
+            except (ConnectionError, OSError):
+                raise
+            except Exception as e:
+                reply = connection.request({"op": "failed", "job": job, "unit": message["unit"],
+                                            "error": f"{type(e).__name__}: {e}"})
+            else:
+                if cancelled:
+                    continue
+                reply = connection.request({"op": "result", "job": job, "unit": message["unit"], "result": result})
+            if reply is None:
+                return
+    except (ConnectionError, OSError):
+        return # The coordinator went away
+    finally:
+        connection.close()
+
+
+def run_worker(address, token=TOKEN, slots=None):
+    """
+    Serves the coordinator at address ("host:port") with slots connections
+    (default: the local pool size), each running one unit at a time on the
+    local pool. Returns when the coordinator closes the connections.
+    Raises ConnectionError if the coordinator refuses them.
+    """
+    host, _, port = address.rpartition(":")
+    slots = slots or worker_pool.get_pool_size()
+    connections = [CoordinatorConnection(host.strip("[]"), int(port), token) for _ in range(slots)]
+    threads = [threading.Thread(target=worker_slot, args=(connection,), daemon=True) for connection in connections]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# -------------------  COMMAND LINE  -------------------
+
+def run_command(args):
+    """Runs the job of the coordinator command line and prints its result."""
+    import expression_eval
+    if args.command == "test":
+        import prime_numbers
+        n = expression_eval.evaluate_expression(args.n)
+        start = time.perf_counter()
+        verdict = prime_numbers.run_primality_pipeline(n, args.bases, mode=args.mode, use_cache=False)
+        print(prime_numbers.format_verdict_text(n, verdict, True, time.perf_counter() - start))
+    elif args.command == "factor":
+        import number_decomposition
+        n = expression_eval.evaluate_expression(args.n)
+        factors = number_decomposition.decompose_number(n, use_cache=False)
+        print(" * ".join(f"{p}^{e}" if e > 1 else str(p) for p, e in factors))
+    elif args.command == "count":
+        import prime_sieve
+        a = int(expression_eval.evaluate_expression(args.a))
+        b = int(expression_eval.evaluate_expression(args.b))
+        print(prime_sieve.count_primes_between(a, b))
+    else:
+        import mersenne_factoring
+        p = int(expression_eval.evaluate_expression(args.p))
+        print(mersenne_factoring.format_report_line(p, mersenne_factoring.find_mersenne_factor(p, args.depth)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Spread primality tests, ECM, sieving and Mersenne trial "
+                                                 "factoring over worker hosts connected over TCP.")
+    roles = parser.add_subparsers(dest="role", required=True)
+    coordinator_parser = roles.add_parser("coordinator", help="run one job on the connected workers")
+    coordinator_parser.add_argument("--host", default="127.0.0.1",
+                                    help="address to listen on (default: %(default)s; others need a token)")
+    coordinator_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port (default: %(default)s)")
+    coordinator_parser.add_argument("--token", default=TOKEN, help="shared secret (default: PRIME_DISTRIBUTED_TOKEN)")
+    coordinator_parser.add_argument("--lease", type=float, default=LEASE_SECONDS,
+                                    help="seconds before an unrenewed unit goes to another worker (default: %(default)s)")
+    coordinator_parser.add_argument("--min-workers", type=int, default=1,
+                                    help="connected workers to wait for before starting (default: %(default)s)")
+    commands = coordinator_parser.add_subparsers(dest="command", required=True)
+    test = commands.add_parser("test", help="primality test")
+    test.add_argument("n", help="integer or expression")
+    test.add_argument("--bases", type=int, default=16, help="number of random Euler-Jacobi bases (default: %(default)s)")
+    test.add_argument("--mode", default="euler_jacobi", choices=("euler_jacobi", "bpsw"))
+    factor = commands.add_parser("factor", help="factorization (ECM curves on the workers)")
+    factor.add_argument("n", help="integer or expression")
+    count = commands.add_parser("count", help="number of primes in [a, b] (sieve segments on the workers)")
+    count.add_argument("a")
+    count.add_argument("b")
+    mersenne = commands.add_parser("mersenne", help="trial factoring and P-1 of 2^p - 1 (k-ranges on the workers)")
+    mersenne.add_argument("p", help="prime exponent")
+    mersenne.add_argument("--depth", type=int, default=None, help="bit depth (default: from p)")
+    worker_parser = roles.add_parser("worker", help="serve a coordinator")
+    worker_parser.add_argument("address", help="HOST:PORT of the coordinator")
+    worker_parser.add_argument("--token", default=TOKEN, help="shared secret (default: PRIME_DISTRIBUTED_TOKEN)")
+    worker_parser.add_argument("--workers", type=int, default=None,
+                               help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    if args.role == "worker":
+        worker_pool.configure_pool(args.workers)
+        try:
+            run_worker(args.address, args.token)
+        except (ConnectionError, OSError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        return 0
+
+    coordinator = start_coordinator(args.host, args.port, args.token, args.lease)
+    try:
+        host, port = coordinator.address
+        print(f"Coordinator on {host}:{port}, waiting for {args.min_workers} worker(s)...", file=sys.stderr, flush=True)
+        coordinator.wait_for_workers(args.min_workers)
+        start = time.perf_counter()
+        run_command(args)
+        print(f"{coordinator.units_leased} units leased ({coordinator.units_reissued} reissued) to "
+              f"{coordinator.worker_count()} workers in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    finally:
+        stop_coordinator()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Sandboxed evaluator for the integer expressions typed into the input fields.
+
+sympy.sympify() followed by mpz(str(expr)) converts every result through a
+decimal string (millions of digits for 2**3000000-1), and its only guard was
+a search for substrings such as '__' or 'import'. Here the expression is
+parsed with Python's ast module and evaluated node by node directly in
+gmpy2.mpz, accepting only:
+  - integer literals, unary + and -
+  - the operators + - * / // % ** (and ^ as power, as sympy reads it);
+    / must divide exactly
+  - postfix n! (factorial) and n# (primorial)
+  - the functions pow(b, e[, m]), factorial(n), primorial(n) and fib(n)
+Anything else (names, attributes, strings, floats, ...) is rejected before
+evaluation. The size of every intermediate result is estimated before it is
+computed, so e.g. factorial(10**9) fails at once instead of exhausting memory.
+
+parse_expression() also reports the shape of the expression, such as
+k*b**n+c, so later stages can use it without factoring the value
+(special_forms.detect_special_form() takes it for k*2^n+-1).
+"""
+import ast
+import math
+import sys
+
+import gmpy2
+from gmpy2 import mpz
+
+# Allow str()/int() conversions (and literals) with more than 4300 digits (Python 3.11+)
+if hasattr(sys, "set_int_max_str_digits"):
+    sys.set_int_max_str_digits(0)
+
+MAX_RESULT_BITS = 2**28 # Largest intermediate result (32 MB); M136279841 has 136279841 bits
+MAX_OPERATIONS = 1000 # Largest number of AST nodes in one expression
+
+POSTFIX_FUNCTIONS = {"!": "factorial", "#": "primorial"}
+
+
+class ExpressionError(ValueError):
+    """Raised for expressions that are invalid, unsupported or too large."""
+
+
+def check_result_bits(bits, what):
+    if bits > MAX_RESULT_BITS:
+        raise ExpressionError(f"{what} would have about {int(bits)} bits (limit {MAX_RESULT_BITS}).")
+
+
+def small_argument(value, name):
+    """Checks that the argument of factorial/primorial/fib is a non-negative machine-size integer."""
+    if value < 0:
+        raise ExpressionError(f"{name}() needs a non-negative argument.")
+    if value.bit_length() > 63:
+        raise ExpressionError(f"{name}() argument is too large.")
+    return int(value)
+
+
+def power(base, exponent, modulus=None):
+    if modulus is not None:
+        if modulus == 0:
+            raise ExpressionError("pow() modulus must not be zero.")
+        if exponent < 0:
+            raise ExpressionError("Negative exponents are not supported.")
+        return gmpy2.powmod(base, exponent, modulus)
+    if exponent < 0:
+        raise ExpressionError("Negative exponents are not supported.")
+    if abs(base) > 1 and exponent > 0:
+        check_result_bits(float(gmpy2.log2(abs(base))) * float(exponent), "The power")
+    return base ** int(exponent)
+
+
+def factorial(n):
+    k = small_argument(n, "factorial")
+    check_result_bits(math.lgamma(k + 1) / math.log(2), f"{k}!")
+    return gmpy2.fac(k)
+
+
+def primorial(n):
+    k = small_argument(n, "primorial")
+    check_result_bits(1.45 * k, f"{k}#") # log2(k#) = theta(k) / log(2) < 1.02 * k / log(2)
+    return gmpy2.primorial(k)
+
+
+def fib(n):
+    k = small_argument(n, "fib")
+    check_result_bits(0.7 * k, f"fib({k})") # log2(phi) = 0.694...
+    return gmpy2.fib(k)
+
+
+FUNCTIONS = {"pow": (power, (2, 3)), "factorial": (factorial, (1,)),
+             "primorial": (primorial, (1,)), "fib": (fib, (1,))}
+
+
+def rewrite_postfix_operators(text):
+    """
+    Rewrites postfix n! and n# as factorial(n) and primorial(n), which Python can parse.
+    The operand is the literal, name or parenthesised group right before the operator.
+    """
+    result = ""
+    for position, char in enumerate(text):
+        if char not in POSTFIX_FUNCTIONS or text[position + 1:position + 2] == "=":
+            result += char
+            continue
+        if text[position + 1:position + 2] in POSTFIX_FUNCTIONS:
+            raise ExpressionError("Repeated postfix operators (e.g. n!!) are not supported; use factorial(factorial(n)).")
+        end = len(result.rstrip())
+        start = end
+        if end and result[end - 1] == ")":
+            depth = 0
+            for start in range(end - 1, -1, -1):
+                depth += {")": 1, "(": -1}.get(result[start], 0)
+                if depth == 0:
+                    break
+            if depth:
+                raise ExpressionError("Unbalanced parentheses.")
+        # Include a preceding literal or function name, e.g. 15! or fib(10)!
+        while start and (result[start - 1].isalnum() or result[start - 1] == "_"):
+            start -= 1
+        if start == end:
+            raise ExpressionError(f"'{char}' must follow a number or a parenthesised expression.")
+        result = f"{result[:start]}{POSTFIX_FUNCTIONS[char]}({result[start:end]})"
+    return result
+
+
+# Shapes tracked during evaluation (converted to dicts by parse_expression):
+#   ("const",)             - a plain integer (a literal or arithmetic on literals)
+#   ("power", k, b, n, c)  - k * b**n + c
+#   ("factorial", n, c)    - n! + c
+#   ("primorial", n, c)    - n# + c
+#   None                   - anything else
+CONST = ("const",)
+
+
+def power_shape(base, base_shape, exponent):
+    """Shape of base**exponent."""
+    if base_shape == CONST and abs(base) > 1:
+        return ("power", 1, base, exponent, 0)
+    if base_shape is not None and base_shape[0] == "power" and base_shape[1] == 1 and base_shape[4] == 0:
+        return ("power", 1, base_shape[2], base_shape[3] * exponent, 0) # (b**n)**e
+    return None
+
+
+def add_to_shape(shape, constant):
+    """Shape of (expression with the given shape) + constant."""
+    if shape is None or shape == CONST:
+        return None
+    return shape[:-1] + (shape[-1] + constant,)
+
+
+def combine_shapes(op, left, left_shape, right, right_shape):
+    """Shape of left <op> right, given the values and shapes of both operands."""
+    if isinstance(op, ast.Pow):
+        return power_shape(left, left_shape, right) # Only the value of the exponent matters (2**2**4+1)
+    if left_shape == CONST and right_shape == CONST:
+        return CONST
+    if isinstance(op, ast.Mult):
+        if left_shape == CONST:
+            left, left_shape, right, right_shape = right, right_shape, left, left_shape
+        if right_shape == CONST and left_shape is not None and left_shape[0] == "power" and left_shape[4] == 0:
+            return ("power", left_shape[1] * right, left_shape[2], left_shape[3], 0)
+        return None
+    if isinstance(op, ast.Add):
+        if right_shape == CONST:
+            return add_to_shape(left_shape, right)
+        if left_shape == CONST:
+            return add_to_shape(right_shape, left)
+        return None
+    if isinstance(op, ast.Sub) and right_shape == CONST:
+        return add_to_shape(left_shape, -right)
+    return None
+
+
+def apply_operator(op, left, right):
+    if isinstance(op, ast.Add):
+        check_result_bits(max(left.bit_length(), right.bit_length()) + 1, "The sum")
+        return left + right
+    if isinstance(op, ast.Sub):
+        check_result_bits(max(left.bit_length(), right.bit_length()) + 1, "The difference")
+        return left - right
+    if isinstance(op, ast.Mult):
+        check_result_bits(left.bit_length() + right.bit_length(), "The product")
+        return left * right
+    if isinstance(op, ast.Pow):
+        return power(left, right)
+    if right == 0:
+        raise ExpressionError("Division by zero.")
+    if isinstance(op, ast.Div):
+        quotient, remainder = gmpy2.f_divmod(left, right)
+        if remainder:
+            raise ExpressionError("Division does not give an integer; use // for floor division.")
+        return quotient
+    if isinstance(op, ast.FloorDiv):
+        return left // right
+    if isinstance(op, ast.Mod):
+        return left % right
+    raise ExpressionError(f"Operator {type(op).__name__} is not supported.")
+
+
+BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow)
+
+
+def evaluate_node(node):
+    """Evaluates one AST node. Returns (value, shape)."""
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return mpz(node.value), CONST
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value, shape = evaluate_node(node.operand)
+        if isinstance(node.op, ast.UAdd):
+            return value, shape
+        return -value, CONST if shape == CONST else None
+    if isinstance(node, ast.BinOp) and isinstance(node.op, BINARY_OPERATORS):
+        left, left_shape = evaluate_node(node.left)
+        right, right_shape = evaluate_node(node.right)
+        return (apply_operator(node.op, left, right),
+                combine_shapes(node.op, left, left_shape, right, right_shape))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+        function, arities = FUNCTIONS[node.func.id]
+        if node.keywords or len(node.args) not in arities:
+            raise ExpressionError(f"{node.func.id}() takes {' or '.join(map(str, arities))} positional argument(s).")
+        evaluated = [evaluate_node(argument) for argument in node.args]
+        values = [value for value, _ in evaluated]
+        value = function(*values)
+        if node.func.id == "pow" and len(values) == 2:
+            return value, power_shape(values[0], evaluated[0][1], values[1])
+        if node.func.id in ("factorial", "primorial"):
+            return value, (node.func.id, values[0], 0)
+        return value, None
+    raise ExpressionError(f"'{ast.unparse(node)[:40]}' is not allowed in an expression ({type(node).__name__}).")
+
+
+def parse_expression(text):
+    """
+    Evaluates an integer expression.
+    Returns (value, shape): value is a gmpy2.mpz, shape describes the form of
+    the expression as a dict, or is None for plain numbers and other forms:
+      {"form": "power", "k": k, "b": b, "n": n, "c": c}  for k*b**n+c (e.g. 3*2**100-1)
+      {"form": "factorial", "n": n, "c": c}            for n!+c
+      {"form": "primorial", "n": n, "c": c}            for n#+c
+    Raises ExpressionError (a ValueError) for invalid, unsafe or too large input.
+    """
+    text = text.strip()
+    if not text:
+        raise ExpressionError("Empty expression.")
+    try:
+        # ^ means power, as in sympy (and it must bind like **, so it is replaced before parsing)
+        tree = ast.parse(rewrite_postfix_operators(text.replace("^", "**")), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression: {e.msg}") from None
+    except (RecursionError, MemoryError):
+        raise ExpressionError("Expression is nested too deeply.") from None
+    if sum(1 for _ in ast.walk(tree)) > MAX_OPERATIONS:
+        raise ExpressionError(f"Expression has more than {MAX_OPERATIONS} elements.")
+
+    value, shape = evaluate_node(tree.body)
+    if shape is None or shape == CONST:
+        return value, None
+    if shape[0] == "power":
+        _, k, b, n, c = shape
+        return value, {"form": "power", "k": int(k), "b": int(b), "n": int(n), "c": int(c)}
+    _, n, c = shape
+    return value, {"form": shape[0], "n": int(n), "c": int(c)}
+
+
+def evaluate_expression(text):
+    """Evaluates an integer expression and returns it as gmpy2.mpz (see parse_expression)."""
+    return parse_expression(text)[0]
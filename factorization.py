@@ -0,0 +1,453 @@
+"""
+Tiered factorization engine behind decompose_number().
+
+Stages, each with its own effort and time limits:
+  1. Trial division by all primes up to trial_bound (one gcd against their
+     product, then only the primes that actually divide n are divided out).
+  2. Perfect power detection (n = m^k).
+  3. Pollard rho with Brent's cycle detection; the |x - y| values are
+     multiplied together and the gcd is taken once per batch.
+  4. Lenstra ECM on Montgomery curves (Suyama parametrization) with a
+     stage 1 ladder up to B1 and a prime-by-prime stage 2 up to B2.
+     Batches of curves run in parallel on the shared worker pool (on
+     threads with a free-threaded interpreter, see worker_pool.select_backend()).
+  5. For cofactors of SIQS_MIN_DIGITS to SIQS_MAX_DIGITS digits, the
+     self-initialising quadratic sieve (siqs.py). Rho then only gets
+     SIQS_RHO_TIME_LIMIT and ECM only looks for factors of up to a third of
+     the digits, since the sieve's running time does not depend on the
+     size of the factors. It needs NumPy; without it this stage is skipped.
+Every factor found is pushed back onto the work list, so composite
+cofactors are factored recursively. All arithmetic uses gmpy2.
+
+The result has the same format as decompose_number(): a sorted list of
+(prime, exponent) tuples. If the limits are exhausted before every factor
+is prime, FactorizationIncomplete is raised with the partial result.
+"""
+import concurrent.futures
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+import distributed
+import instrumentation
+import small_primes
+import worker_pool
+
+try:
+    import siqs
+except ImportError: # NumPy is not installed
+    siqs = None
+
+TRIAL_DIVISION_BOUND = 10**5
+RHO_TIME_LIMIT = 5.0 # Seconds per composite
+RHO_MAX_ITERATIONS = 10**7
+RHO_BATCH_SIZE = 128 # Products of |x - y| per gcd
+ECM_TIME_LIMIT = 120.0 # Seconds per composite
+ECM_CURVES_PER_TASK = 4 # Curves run by one worker task before checking back
+
+# (factor digits, B1, number of curves) - the usual GMP-ECM schedule.
+# B2 is taken as 100 * B1, capped at ECM_MAX_B2 to keep the stage 2 prime table small.
+ECM_SCHEDULE = [
+    (15, 2000, 25),
+    (20, 11000, 90),
+    (25, 50000, 300),
+    (30, 250000, 700),
+    (35, 1000000, 1800),
+    (40, 3000000, 5100),
+    (45, 11000000, 10600),
+]
+ECM_MAX_B2 = 5 * 10**7
+SIQS_MIN_DIGITS = 24 # Cofactors of this many digits and more go to the quadratic sieve...
+SIQS_MAX_DIGITS = 100 # ...up to this many
+SIQS_TIME_LIMIT = 3600.0 # Seconds per composite
+SIQS_RHO_TIME_LIMIT = 0.25 # Rho's time limit for cofactors the quadratic sieve will take
+
+
+class FactorizationIncomplete(Exception):
+    """
+    Raised when the configured limits were exhausted before n was fully factored.
+    factors holds the (prime, exponent) pairs found, cofactors the composite
+    parts that could not be split.
+    """
+
+    def __init__(self, factors, cofactors):
+        self.factors = factors
+        self.cofactors = cofactors
+        super().__init__(
+            f"Could not fully factor the number within the configured limits; "
+            f"remaining composite cofactor(s): {', '.join(str(c) for c in cofactors)}")
+
+
+# -------------------  STAGE 1: TRIAL DIVISION  -------------------
+
+def trial_division(n, bound=TRIAL_DIVISION_BOUND):
+    """
+    Divides out every prime p <= bound.
+    Returns (factors, cofactor) where factors is a list of (p, exponent).
+    """
+    n = mpz(n)
+    factors = []
+    if bound < 2 or n < 2:
+        return factors, n
+    primes = small_primes.primes_up_to(bound)
+    common = gmpy2.gcd(n, small_primes.primorial_blocks(bound)[1]) # Cached per process
+    for p in primes:
+        if common == 1:
+            break
+        if common % p == 0:
+            common //= p
+            count = 0
+            while n % p == 0:
+                n //= p
+                count += 1
+            factors.append((int(p), count))
+    return factors, n
+
+
+# -------------------  STAGE 2: PERFECT POWERS  -------------------
+
+def perfect_power(n):
+    """Returns (root, k) with root^k == n and k as large as possible, or None."""
+    if not gmpy2.is_power(n):
+        return None
+    for k in range(n.bit_length(), 1, -1):
+        root, exact = gmpy2.iroot(n, k)
+        if exact:
+            return root, k
+    return None
+
+
+# -------------------  STAGE 3: POLLARD RHO (BRENT)  -------------------
+
+def pollard_rho_brent(n, time_limit=RHO_TIME_LIMIT, max_iterations=RHO_MAX_ITERATIONS,
+                      batch_size=RHO_BATCH_SIZE, seed=1):
+    """
+    Pollard rho with Brent's cycle detection and batched gcds.
+    Returns a nontrivial factor of n or None when the limits are reached.
+    Restarts with a new polynomial x^2 + c if a cycle collapses to n.
+    """
+    n = mpz(n)
+    if n % 2 == 0:
+        return mpz(2)
+    deadline = time.monotonic() + time_limit
+    random_state = gmpy2.random_state(seed)
+    iterations = 0
+
+    while iterations < max_iterations and time.monotonic() < deadline:
+        y = gmpy2.mpz_random(random_state, n)
+        c = gmpy2.mpz_random(random_state, n - 1) + 1
+        g = r = q = mpz(1)
+        x = ys = y
+        while g == 1:
+            x = y
+            for k in range(0, r, batch_size): # r doubles into the millions: check the limits every batch
+                for _ in range(min(batch_size, r - k)):
+                    y = (y * y + c) % n
+                worker_pool.raise_if_cancelled()
+                if time.monotonic() >= deadline:
+                    return None
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(batch_size, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = gmpy2.gcd(q, n)
+                k += batch_size
+                worker_pool.raise_if_cancelled()
+                if g == 1 and time.monotonic() >= deadline:
+                    return None
+            iterations += r
+            r *= 2
+            if iterations >= max_iterations or time.monotonic() >= deadline:
+                break
+        if g == n:
+            # The batch overshot; step back one value at a time from the saved point
+            while True:
+                ys = (ys * ys + c) % n
+                g = gmpy2.gcd(abs(x - ys), n)
+                if g > 1:
+                    break
+        if 1 < g < n:
+            return g
+    return None
+
+
+# -------------------  STAGE 4: ECM  -------------------
+
+def _x_double(x, z, a24, n):
+    """Doubles the point (x:z) on the Montgomery curve with (A + 2) / 4 = a24."""
+    sum_sq = (x + z) ** 2
+    diff_sq = (x - z) ** 2
+    t = sum_sq - diff_sq
+    return sum_sq * diff_sq % n, t * (diff_sq + a24 * t) % n
+
+
+def _x_add(xp, zp, xq, zq, xd, zd, n):
+    """Adds P and Q given their difference D = P - Q (differential addition)."""
+    u = (xp - zp) * (xq + zq)
+    v = (xp + zp) * (xq - zq)
+    return zd * (u + v) ** 2 % n, xd * (u - v) ** 2 % n
+
+
+def _x_multiply(k, x, z, a24, n):
+    """Montgomery ladder: returns k * (x:z)."""
+    if k == 1:
+        return x, z
+    x0, z0 = x, z
+    x1, z1 = _x_double(x, z, a24, n)
+    for bit in bin(k)[3:]:
+        if bit == "1":
+            x0, z0 = _x_add(x1, z1, x0, z0, x, z, n)
+            x1, z1 = _x_double(x1, z1, a24, n)
+        else:
+            x1, z1 = _x_add(x0, z0, x1, z1, x, z, n)
+            x0, z0 = _x_double(x0, z0, a24, n)
+    return x0, z0
+
+
+def ecm_one_curve(n, b1, b2, sigma):
+    """
+    Runs one ECM curve with Suyama parameter sigma.
+    Returns a nontrivial factor of n or None.
+    """
+    u = (sigma * sigma - 5) % n
+    v = 4 * sigma % n
+    x = u ** 3 % n
+    z = v ** 3 % n
+    denominator = 16 * x * v % n
+    g = gmpy2.gcd(denominator, n)
+    if g != 1:
+        return g if g != n else None
+    a24 = (v - u) ** 3 * (3 * u + v) * gmpy2.invert(denominator, n) % n
+
+    # Stage 1: multiply by every prime power <= B1
+    primes = small_primes.primes_up_to(b2)
+    for p in primes:
+        if p > b1:
+            break
+        q = p
+        while q * p <= b1:
+            q *= p
+        x, z = _x_multiply(q, x, z, a24, n)
+    g = gmpy2.gcd(z, n)
+    if g != 1:
+        return g if g != n else None
+
+    # Stage 2: look for one more prime q in (B1, B2] using the standard continuation.
+    # S[d] = 2d * Q for d = 1..D; R walks over r * Q in steps of 2D.
+    D = 105
+    s_x = [None] * (D + 1)
+    s_z = [None] * (D + 1)
+    s_x[1], s_z[1] = _x_double(x, z, a24, n)
+    s_x[2], s_z[2] = _x_double(s_x[1], s_z[1], a24, n)
+    for d in range(3, D + 1):
+        s_x[d], s_z[d] = _x_add(s_x[d - 1], s_z[d - 1], s_x[1], s_z[1], s_x[d - 2], s_z[d - 2], n)
+    beta = [None] + [s_x[d] * s_z[d] % n for d in range(1, D + 1)]
+
+    r = max(b1 - b1 % 2 - 1, 2 * D + 1) # odd, so every prime q = r + 2d
+    r_x, r_z = _x_multiply(r, x, z, a24, n)
+    t_x, t_z = _x_multiply(r - 2 * D, x, z, a24, n)
+    product = mpz(1)
+    prime_index = 0
+    while prime_index < len(primes) and primes[prime_index] <= r:
+        prime_index += 1
+    while r < b2:
+        alpha = r_x * r_z % n
+        while prime_index < len(primes) and primes[prime_index] <= r + 2 * D:
+            delta = (primes[prime_index] - r) // 2
+            # Zero mod p exactly when R = ±S[delta] on the curve mod p
+            product = product * ((r_x - s_x[delta]) * (r_z + s_z[delta]) - alpha + beta[delta]) % n
+            prime_index += 1
+        r_x, r_z, t_x, t_z = (*_x_add(r_x, r_z, s_x[D], s_z[D], t_x, t_z, n), r_x, r_z)
+        r += 2 * D
+    g = gmpy2.gcd(product, n)
+    if 1 < g < n:
+        return g
+    return None
+
+
+def ecm_curve_batch(args):
+    """
+    Worker task: runs `curves` ECM curves with consecutive sigmas.
+    n may be a worker_pool.SharedOperand handle.
+    Returns a nontrivial factor of n or None.
+    """
+    n, b1, b2, first_sigma, curves = args
+    n = worker_pool.resolve_operand(n)
+    for sigma in range(first_sigma, first_sigma + curves):
+        factor = ecm_one_curve(n, b1, b2, mpz(sigma))
+        if factor is not None:
+            return factor
+    return None
+
+
+def ecm(n, time_limit=ECM_TIME_LIMIT, max_digits=None, parallel=True, seed=1):
+    """
+    Runs ECM following ECM_SCHEDULE (up to max_digits-sized factors) until a
+    factor is found or time_limit seconds have passed.
+    With parallel=True, batches of curves run on the shared worker pool and
+    outstanding batches are cancelled as soon as one of them finds a factor.
+    While workers are connected to a coordinator, the batches run on them instead.
+    Returns a nontrivial factor of n or None.
+    """
+    n = mpz(n)
+    coordinator = distributed.active_coordinator() if parallel else None
+    if not parallel or coordinator is not None:
+        return _ecm_schedule(n, time_limit, max_digits, parallel, seed, coordinator)
+    # Large n is published once for all batches (see worker_pool.shared_operand)
+    with worker_pool.shared_operand(n) as n_shared:
+        return _ecm_schedule(n_shared, time_limit, max_digits, parallel, seed)
+
+
+def _ecm_schedule(n_task, time_limit, max_digits, parallel, seed, coordinator=None):
+    """
+    Body of ecm(); n_task is what the curve batches receive for n (n or its
+    shared handle, n itself with a coordinator).
+    """
+    deadline = time.monotonic() + time_limit
+    random_state = gmpy2.random_state(seed)
+
+    for digits, b1, curves in ECM_SCHEDULE:
+        if max_digits is not None and digits > max_digits:
+            break
+        b2 = min(100 * b1, ECM_MAX_B2)
+        small_primes.primes_up_to(b2) # Build the prime table once, before forking work out
+        batches = []
+        for _ in range(0, curves, ECM_CURVES_PER_TASK):
+            first_sigma = int(gmpy2.mpz_random(random_state, 2**63)) + 6
+            batches.append((n_task, b1, b2, first_sigma, ECM_CURVES_PER_TASK))
+
+        if not parallel:
+            for batch in batches:
+                if time.monotonic() >= deadline:
+                    return None
+                factor = ecm_curve_batch(batch)
+                if factor is not None:
+                    return factor
+            continue
+
+        if coordinator is not None:
+            # Factors from the workers are checked before they stop the job
+            try:
+                job = coordinator.run_job("ecm", n_task, [batch[1:] for batch in batches],
+                                          stop_when=lambda factor: factor is not None and 1 < factor < n_task
+                                          and n_task % factor == 0,
+                                          timeout=max(0.0, deadline - time.monotonic()))
+            except distributed.NoWorkers:
+                coordinator = None # Every worker left; this level and the rest run on the local pool
+            else:
+                if job.stopped_by is not None:
+                    return mpz(job.results[job.stopped_by])
+                if not job.complete:
+                    return None
+                continue
+
+        # Curve batches run Python-level loops: processes, unless threads run them in parallel
+        backend = worker_pool.select_backend(gil_bound=True)
+        window = worker_pool.get_pool_size() * 2
+        in_flight = set()
+        batches = iter(batches)
+        try:
+            while True:
+                while len(in_flight) < window:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    in_flight.add(worker_pool.submit(ecm_curve_batch, batch, backend=backend))
+                if not in_flight:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                done, in_flight = concurrent.futures.wait(
+                    in_flight, timeout=min(remaining, worker_pool.CANCEL_CHECK_INTERVAL),
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                worker_pool.raise_if_cancelled()
+                for future in done:
+                    factor = future.result()
+                    if factor is not None:
+                        return factor
+        finally:
+            for future in in_flight:
+                future.cancel()
+    return None
+
+
+# -------------------  DRIVER  -------------------
+
+def factorize(n, trial_bound=TRIAL_DIVISION_BOUND, rho_time_limit=RHO_TIME_LIMIT,
+              rho_max_iterations=RHO_MAX_ITERATIONS, ecm_time_limit=ECM_TIME_LIMIT,
+              ecm_max_digits=None, siqs_time_limit=SIQS_TIME_LIMIT, parallel=True):
+    """
+    Factors n into primes with the tiered engine described above.
+    Returns a sorted list of (prime, exponent) tuples.
+    Raises FactorizationIncomplete if some cofactor could not be split.
+    Setting a stage's time limit (or ecm_max_digits) to 0 skips that stage.
+    """
+    n = mpz(n)
+    if n < 1:
+        raise ValueError("Only positive integers can be factored.")
+
+    exponents = {}
+
+    def add_factor(p, count):
+        exponents[int(p)] = exponents.get(int(p), 0) + count
+
+    with instrumentation.span("trial_division"):
+        small_factors, cofactor = trial_division(n, trial_bound)
+    for p, count in small_factors:
+        add_factor(p, count)
+
+    # Work list of (composite or prime, multiplicity)
+    pending = [(cofactor, 1)] if cofactor > 1 else []
+    unsplit = []
+    while pending:
+        worker_pool.raise_if_cancelled()
+        m, multiplicity = pending.pop()
+        if gmpy2.is_prime(m):
+            add_factor(m, multiplicity)
+            continue
+
+        power = perfect_power(m)
+        if power is not None:
+            root, k = power
+            pending.append((root, multiplicity * k))
+            continue
+
+        digits = len(str(m))
+        use_siqs = siqs is not None and siqs_time_limit > 0 and SIQS_MIN_DIGITS <= digits <= SIQS_MAX_DIGITS
+        rho_limit, ecm_digits = rho_time_limit, ecm_max_digits
+        if use_siqs:
+            rho_limit = min(rho_limit, SIQS_RHO_TIME_LIMIT)
+            ecm_digits = digits // 3 if ecm_digits is None else min(ecm_digits, digits // 3)
+
+        factor = None
+        if rho_limit > 0:
+            with instrumentation.span("pollard_rho"):
+                factor = pollard_rho_brent(m, rho_limit, rho_max_iterations)
+        if factor is None and ecm_time_limit > 0 and ecm_digits != 0:
+            with instrumentation.span("ecm"):
+                factor = ecm(m, ecm_time_limit, ecm_digits, parallel)
+        if factor is None and use_siqs:
+            with instrumentation.span("siqs"):
+                factor = siqs.siqs(m, siqs_time_limit, parallel)
+        if factor is None:
+            unsplit.append(int(m))
+            continue
+
+        # Split m into factor^e * rest, so repeated factors are counted at once
+        factor = mpz(factor)
+        rest, e = m, 0
+        while rest % factor == 0:
+            rest //= factor
+            e += 1
+        pending.append((factor, multiplicity * e))
+        if rest > 1:
+            pending.append((rest, multiplicity))
+
+    factors = sorted(exponents.items())
+    if unsplit:
+        raise FactorizationIncomplete(factors, unsplit)
+    return factors
@@ -0,0 +1,128 @@
+"""
+Background execution of GUI requests for prime_numbers.py and number_decomposition.py.
+
+Both GUIs used to run their tests on the Tk main thread, so the window froze
+during long tests and a test could not be stopped once started. Here each
+request runs on one background thread (the heavy exponentiations still go to
+the shared worker pool). Progress and the result come back through a
+queue.Queue that the mainloop drains every POLL_INTERVAL_MS with root.after(),
+so the widgets see at most one progress update per poll however often the
+request reports.
+
+cancel() sets the request's cancel event: its next pool call (or its next
+progress report) terminates the workers still running for it and ends the
+request with worker_pool.TaskCancelled (see worker_pool.cancellation()).
+Starting a request while another one runs replaces it: the running one is
+cancelled and the new one starts as soon as it has stopped.
+"""
+import concurrent.futures
+import itertools
+import queue
+import threading
+
+import worker_pool
+
+POLL_INTERVAL_MS = 100 # How often the mainloop applies progress and results
+
+
+class BackgroundRunner:
+    """
+    Runs one request at a time for a Tk window. The callbacks are called on
+    the Tk thread:
+      on_progress(percentage, message) - latest progress (message may be None)
+      on_done(result)                  - the request returned result
+      on_error(exception)              - the request raised
+      on_busy(busy)                    - a request started (True) or ended (False)
+    """
+
+    def __init__(self, root, on_progress, on_done, on_error, on_busy=None):
+        self.root = root
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_busy = on_busy
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="gui-request")
+        self.results = queue.Queue()
+        self.request_ids = itertools.count(1)
+        self.current_id = None
+        self.cancel_event = None
+        self.polling = False
+
+    def is_running(self):
+        return self.current_id is not None
+
+    def start(self, fn, *args):
+        """
+        Runs fn(report, *args) in the background, replacing a running request.
+        fn calls report(percentage, message=None) to show progress; report
+        raises worker_pool.TaskCancelled once the request is cancelled.
+        """
+        self.cancel()
+        request_id = self.current_id = next(self.request_ids)
+        cancel_event = self.cancel_event = threading.Event()
+
+        def report(percentage, message=None):
+            if cancel_event.is_set():
+                raise worker_pool.TaskCancelled()
+            self.results.put((request_id, "progress", (percentage, message)))
+
+        def run():
+            with worker_pool.cancellation(cancel_event):
+                try:
+                    worker_pool.raise_if_cancelled() # Replaced before it started
+                    self.results.put((request_id, "done", fn(report, *args)))
+                except worker_pool.TaskCancelled:
+                    pass
+                except Exception as e:
+                    self.results.put((request_id, "error", e))
+
+        self.executor.submit(run)
+        if self.on_busy:
+            self.on_busy(True)
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+
+    def cancel(self):
+        """Cancels the running request (if any); its late results are ignored."""
+        if self.current_id is None:
+            return
+        self.cancel_event.set()
+        self.current_id = None
+        if self.on_busy:
+            self.on_busy(False)
+
+    def poll(self):
+        """Applies the queued progress and result of the current request (runs on the Tk thread)."""
+        progress = None
+        message = None
+        outcome = None
+        while True:
+            try:
+                request_id, kind, payload = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if request_id != self.current_id:
+                continue # From a cancelled or replaced request
+            if kind == "progress":
+                progress = payload[0]
+                message = payload[1] if payload[1] is not None else message
+            else:
+                outcome = (kind, payload)
+
+        if progress is not None:
+            self.on_progress(progress, message)
+        if outcome is not None:
+            self.current_id = None
+            if self.on_busy:
+                self.on_busy(False)
+            kind, payload = outcome
+            if kind == "done":
+                self.on_done(payload)
+            else:
+                self.on_error(payload)
+
+        if self.current_id is not None:
+            self.root.after(POLL_INTERVAL_MS, self.poll)
+        else:
+            self.polling = False
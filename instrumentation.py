@@ -0,0 +1,248 @@
+"""
+Instrumentation for the primality pipeline: spans, counters, per-request
+traces and aggregate histograms.
+
+Each stage of a request runs inside span(name), which times it with the
+monotonic time.perf_counter() clock, and count(name, amount) adds to a
+counter (primes covered by trial division, bases tested, bytes pickled to
+the workers, cache hits, ...). Both report into the trace of the current
+request in this thread, if one was started with start_trace(), and into
+per-process aggregates: a histogram of durations per span name and the
+counter totals.
+
+    with instrumentation.start_trace("check_prime") as trace:
+        with instrumentation.span("parse"):
+            ...
+    trace.as_dict() -> {"name": ..., "duration": ..., "spans": [...], "counters": {...}}
+
+PRIME_INSTRUMENTATION=0 (or configure_instrumentation(False)) selects the
+no-op mode: span() still measures its own duration, since the pipeline reports
+its stage timings from it, but nothing is recorded, count() returns at once
+and start_trace() yields None.
+"""
+import collections
+import contextlib
+import math
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("PRIME_INSTRUMENTATION", "1") != "0"
+RECENT_TRACES = 100 # Finished traces kept for recent_traces()
+HISTOGRAM_RESOLUTION = 1e-6 # Upper bound of the first histogram bucket (seconds)
+HISTOGRAM_BUCKETS = 40 # Bucket i holds durations up to HISTOGRAM_RESOLUTION * 2**i (the last one: longer)
+
+_local = threading.local() # .trace: the trace of the request running in this thread
+_lock = threading.Lock()
+_histograms = {}
+_counter_totals = collections.Counter()
+_recent_traces = collections.deque(maxlen=RECENT_TRACES)
+
+
+def configure_instrumentation(enabled):
+    """Turns recording on or off for this process (off is the no-op mode)."""
+    global ENABLED
+    ENABLED = enabled
+
+
+class Histogram:
+    """Durations of one span name, counted in power-of-two buckets."""
+
+    def __init__(self):
+        self.buckets = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, seconds):
+        index = 0
+        if seconds > HISTOGRAM_RESOLUTION:
+            index = min(math.ceil(math.log2(seconds / HISTOGRAM_RESOLUTION)), HISTOGRAM_BUCKETS - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (at most the largest duration seen)."""
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return min(HISTOGRAM_RESOLUTION * 2**index, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {"count": self.count, "total": self.total, "mean": self.total / self.count,
+                "min": self.min, "max": self.max,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+                "buckets": [[HISTOGRAM_RESOLUTION * 2**index, bucket_count]
+                            for index, bucket_count in enumerate(self.buckets) if bucket_count]}
+
+
+class Trace:
+    """The spans and counters of one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = [] # (start offset, duration, depth, name), appended as spans end
+        self.counters = collections.Counter()
+        self.depth = 0
+
+    def stage_durations(self):
+        """Total duration of each top-level span name, in the order the stages started."""
+        durations = {}
+        for _, duration, depth, name in sorted(self.spans):
+            if depth == 0:
+                durations[name] = durations.get(name, 0.0) + duration
+        return durations
+
+    def as_dict(self):
+        return {"name": self.name, "duration": self.duration,
+                "spans": [{"name": name, "start": start, "duration": duration, "depth": depth}
+                          for start, duration, depth, name in sorted(self.spans)],
+                "counters": dict(self.counters)}
+
+    def summary(self):
+        """One line for the result area, e.g. 'parse 0.0001s, euler_jacobi 1.2000s; bases_tested=5'."""
+        text = ", ".join(f"{name} {seconds:.4f}s" for name, seconds in self.stage_durations().items())
+        if self.counters:
+            text += "; " + ", ".join(f"{name}={value}" for name, value in sorted(self.counters.items()))
+        return text
+
+
+class Span:
+    """Context manager timing one stage; see span()."""
+    __slots__ = ("name", "start", "duration", "depth", "trace")
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = None
+        self.trace = None
+
+    def __enter__(self):
+        if ENABLED:
+            self.trace = getattr(_local, "trace", None)
+            if self.trace is not None:
+                self.depth = self.trace.depth
+                self.trace.depth += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        if self.trace is not None:
+            self.trace.depth -= 1
+            self.trace.spans.append((self.start - self.trace.start, self.duration, self.depth, self.name))
+        if ENABLED:
+            with _lock:
+                histogram = _histograms.get(self.name)
+                if histogram is None:
+                    histogram = _histograms[self.name] = Histogram()
+                histogram.add(self.duration)
+        return False
+
+
+def span(name):
+    """
+    Times the enclosed block as the stage `name`:
+        with span("classical_filter") as stage:
+            ...
+        stage.duration  # seconds
+    """
+    return Span(name)
+
+
+def count(name, amount=1):
+    """Adds amount to the counter `name` of the current trace and of the process totals."""
+    if not ENABLED:
+        return
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.counters[name] += amount
+    with _lock:
+        _counter_totals[name] += amount
+
+
+@contextlib.contextmanager
+def start_trace(name):
+    """
+    Starts the trace of a request in this thread and yields it (None in the
+    no-op mode). If a trace is already running, that one is yielded, so
+    run_primality_pipeline() called from check_prime() adds to the caller's trace.
+    """
+    current = getattr(_local, "trace", None)
+    if current is not None or not ENABLED:
+        yield current
+        return
+    trace = begin_trace(name)
+    try:
+        with activate_trace(trace):
+            yield trace
+    finally:
+        finish_trace(trace)
+
+
+def begin_trace(name):
+    """
+    Creates the trace of a request that runs in more than one thread (the GUIs
+    parse on the Tk thread and test in the background). Each thread records
+    into it inside activate_trace(); finish_trace() ends it. None in the no-op mode.
+    """
+    return Trace(name) if ENABLED else None
+
+
+@contextlib.contextmanager
+def activate_trace(trace):
+    """Makes `trace` (from begin_trace(), may be None) the current trace of this thread for the block."""
+    previous = getattr(_local, "trace", None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def finish_trace(trace):
+    """Ends a trace from begin_trace() and adds it to recent_traces()."""
+    if trace is None:
+        return
+    trace.duration = time.perf_counter() - trace.start
+    with _lock:
+        _recent_traces.append(trace)
+
+
+def current_trace():
+    """The trace running in this thread, or None."""
+    return getattr(_local, "trace", None)
+
+
+def histograms():
+    """Returns {span name: histogram dict} aggregated over this process."""
+    with _lock:
+        return {name: histogram.as_dict() for name, histogram in _histograms.items()}
+
+
+def counter_totals():
+    """Returns {counter name: total} aggregated over this process."""
+    with _lock:
+        return dict(_counter_totals)
+
+
+def recent_traces():
+    """Returns the last RECENT_TRACES finished traces as dicts, oldest first."""
+    with _lock:
+        return [trace.as_dict() for trace in _recent_traces]
+
+
+def reset_instrumentation():
+    """Clears the histograms, counter totals and recent traces."""
+    with _lock:
+        _histograms.clear()
+        _counter_totals.clear()
+        _recent_traces.clear()
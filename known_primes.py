@@ -0,0 +1,158 @@
+"""
+Tables of known special-form primes, looked up by bit length.
+
+Comparing n with 2**p - 1 for every known Mersenne exponent builds every
+known Mersenne prime on each call (M136279841 alone is 17 MB). Instead, every
+table entry is indexed by the bit length of its prime, which is known without
+building the number (M_p has exactly p bits). A lookup costs one dict access;
+only entries with the same bit length as n are checked, with a cheap test on
+the bits of n (n & (n + 1) == 0 for the all-ones Mersenne numbers).
+
+Tables for Fermat, Wagstaff and factorial primes are registered the same way,
+and register_known_primes() adds further tables behind the same lookup.
+"""
+import functools
+import math
+
+import gmpy2
+from gmpy2 import mpz
+
+# List of known exponents p for Mersenne primes (M_p = 2^p - 1)
+# Source: https://www.mersenne.org/primes/ (GIMPS) - as of October 2024
+KNOWN_MERSENNE_EXPONENTS = {
+    2, 3, 5, 7, 13, 17, 19, 31, 61, 89, 107, 127, 521, 607, 1279, 2203, 2281, 3217, 4253, 4423,
+    9689, 9941, 11213, 19937, 21701, 23209, 44497, 86243, 110503, 132049, 216091, 756839,
+    859433, 1257787, 1398269, 2976221, 3021377, 6972593, 13466917, 20996011, 24036583,
+    25964951, 30402457, 32582657, 37156667, 42643801, 43112609, 57885161, 74207281,
+    77232917, 82589933, 136279841
+}
+
+# Exponents k of the Fermat primes F_k = 2^(2^k) + 1 (no others are known)
+KNOWN_FERMAT_INDICES = {0, 1, 2, 3, 4}
+
+# Exponents p of the Wagstaff primes (2^p + 1) / 3 (OEIS A000978).
+# Primality is proven up to WAGSTAFF_PROVEN_LIMIT; the larger ones are probable primes.
+KNOWN_WAGSTAFF_EXPONENTS = {
+    3, 5, 7, 11, 13, 17, 19, 23, 31, 43, 61, 79, 101, 127, 167, 191, 199, 313, 347, 701,
+    1709, 2617, 3539, 5807, 10501, 10691, 11279, 12391, 14479, 42737, 83339, 95369, 117239,
+    127031, 138937, 141079, 267017, 269987, 374321, 986191, 4031399, 13347311, 13372531, 15135397
+}
+WAGSTAFF_PROVEN_LIMIT = 42737
+
+# Values of k for which k! + 1 (OEIS A002981) and k! - 1 (OEIS A002982) are prime.
+# Primality is proven for k up to FACTORIAL_PROVEN_LIMIT; the larger ones are probable primes.
+KNOWN_FACTORIAL_PLUS_ONE = {
+    1, 2, 3, 11, 27, 37, 41, 73, 77, 116, 154, 320, 340, 399, 427, 872, 1477, 6380, 26951,
+    110059, 150209, 288465, 308084, 422429
+}
+KNOWN_FACTORIAL_MINUS_ONE = {
+    3, 4, 6, 7, 12, 14, 30, 32, 33, 38, 94, 166, 324, 379, 469, 546, 974, 1963, 3507, 3610,
+    6917, 21480, 34790, 94550, 103040, 147855, 208003
+}
+FACTORIAL_PROVEN_LIMIT = 1000
+FACTORIAL_EXACT_LIMIT = 1000 # Bit lengths of k! +- 1 below this are computed exactly
+
+# Registered tables: (form, parameters, bit_lengths, matches, expression, is_proven)
+#   bit_lengths(parameter) - bit lengths the prime may have (usually exactly one)
+#   matches(n, parameter)  - True if n is the prime of this form for parameter
+#   expression(parameter)  - the prime written as an expression, e.g. "2**127-1"
+#   is_proven(parameter)   - False if the stored prime is only a probable prime
+KNOWN_PRIME_TABLES = []
+
+
+def register_known_primes(form, parameters, bit_lengths, matches, expression, is_proven=None):
+    """
+    Adds a table of known primes of one form to the lookup.
+    See KNOWN_PRIME_TABLES for the meaning of the arguments; is_proven
+    defaults to every entry being a proven prime.
+    """
+    KNOWN_PRIME_TABLES.append((form, frozenset(parameters), bit_lengths, matches, expression,
+                               is_proven or (lambda parameter: True)))
+    bit_length_index.cache_clear()
+
+
+@functools.lru_cache(maxsize=1)
+def bit_length_index():
+    """
+    Returns {bit_length: [(table, parameter), ...]} over all registered tables.
+    Built once on first use (and again after register_known_primes()).
+    """
+    index = {}
+    for table in KNOWN_PRIME_TABLES:
+        for parameter in table[1]:
+            for bits in table[2](parameter):
+                index.setdefault(bits, []).append((table, parameter))
+    return index
+
+
+def identify_known_prime(n):
+    """
+    Returns a dict describing n if it is one of the tabulated primes, otherwise None:
+      form       - "mersenne", "fermat", "wagstaff", "factorial_plus_one", ...
+      parameter  - p, k, ... of the form (e.g. the exponent p of M_p)
+      expression - the prime as an expression, e.g. "2**127-1"
+      proven     - False if the table only lists it as a probable prime
+    Only the entries with the bit length of n are examined, and none of them is built
+    unless n passes the form's cheap bit test.
+    """
+    n = mpz(n)
+    for table, parameter in bit_length_index().get(n.bit_length(), ()):
+        form, _, _, matches, expression, is_proven = table
+        if matches(n, parameter):
+            return {"form": form, "parameter": parameter, "expression": expression(parameter),
+                    "proven": is_proven(parameter)}
+    return None
+
+
+def is_mersenne_number(n, p):
+    """n == 2**p - 1: n has p bits and all of them are set."""
+    return n.bit_length() == p and n & (n + 1) == 0
+
+
+def is_fermat_number(n, k):
+    """n == 2**(2**k) + 1: only the top bit and the lowest bit are set."""
+    return n.bit_length() == 2**k + 1 and gmpy2.popcount(n) == 2 and n & 1 == 1
+
+
+def is_wagstaff_number(n, p):
+    """n == (2**p + 1) / 3: 3n - 1 is a power of two with exponent p."""
+    m = 3 * n - 1
+    return m.bit_length() == p + 1 and gmpy2.popcount(m) == 1
+
+
+def factorial_bit_lengths(k, sign):
+    """
+    Possible bit lengths of k! + sign. Small factorials are computed exactly;
+    for the others log2(k!) = lgamma(k + 1) / log(2), and both neighbours are
+    returned when it is too close to an integer to trust floating point.
+    """
+    if k < FACTORIAL_EXACT_LIMIT:
+        return ((math.factorial(k) + sign).bit_length(),)
+    log2_factorial = math.lgamma(k + 1) / math.log(2)
+    return {math.floor(log2_factorial + delta) + 1 for delta in (-1e-6, 0.0, 1e-6)}
+
+
+def is_factorial_number(n, k, sign):
+    """
+    n == k! + sign. k! is divisible by exactly 2**(k - popcount(k)) (Legendre),
+    so that is checked on n - sign before k! is built.
+    """
+    if k < 2:
+        return n == 1 + sign
+    m = n - sign
+    return gmpy2.bit_scan1(m) == k - gmpy2.popcount(k) and m == gmpy2.fac(k)
+
+
+register_known_primes("mersenne", KNOWN_MERSENNE_EXPONENTS, lambda p: (p,),
+                      is_mersenne_number, lambda p: f"2**{p}-1")
+register_known_primes("fermat", KNOWN_FERMAT_INDICES, lambda k: (2**k + 1,),
+                      is_fermat_number, lambda k: f"2**{2**k}+1")
+register_known_primes("wagstaff", KNOWN_WAGSTAFF_EXPONENTS, lambda p: (p - 1,),
+                      is_wagstaff_number, lambda p: f"(2**{p}+1)/3",
+                      lambda p: p <= WAGSTAFF_PROVEN_LIMIT)
+register_known_primes("factorial_plus_one", KNOWN_FACTORIAL_PLUS_ONE, lambda k: factorial_bit_lengths(k, 1),
+                      lambda n, k: is_factorial_number(n, k, 1), lambda k: f"{k}!+1",
+                      lambda k: k <= FACTORIAL_PROVEN_LIMIT)
+register_known_primes("factorial_minus_one", KNOWN_FACTORIAL_MINUS_ONE, lambda k: factorial_bit_lengths(k, -1),
+                      lambda n, k: is_factorial_number(n, k, -1), lambda k: f"{k}!-1",
+                      lambda k: k <= FACTORIAL_PROVEN_LIMIT)
@@ -0,0 +1,363 @@
+"""
+Trial factoring and P-1 for Mersenne numbers 2^p - 1 before Lucas-Lehmer.
+
+Every factor q of M_p (p an odd prime) is q = 2kp + 1 with q = +-1 (mod 8),
+so the generic loop of classical_filter (all primes up to 10^6) is the wrong
+search: it misses every factor above 10^6 and tries all the primes that
+cannot divide M_p. Here only q = 2kp + 1 is tried:
+
+  * k is split into the 4620 classes k mod 4 * 3 * 5 * 7 * 11. The residue of
+    q mod 8, 3, 5, 7 and 11 depends on the class alone, so only the 960 classes
+    with q = +-1 (mod 8) and q prime to 3 * 5 * 7 * 11 are kept.
+  * Within a class, q = q_0 + 9240p * j. A batch of j values is sieved in a
+    bytearray against the primes from 13 up (one slice assignment per prime,
+    as in prime_generation.py), and each survivor is tested with
+    powmod(2, p, q) == 1.
+  * The search goes one bit level [2^(b-1), 2^b) at a time with the classes
+    spread over the worker pool, and stops after the first level that holds
+    a factor (the smallest one found is reported).
+
+If trial factoring finds nothing, P-1 follows: stage 1 computes
+x = 3^(2p * E) mod M_p with E the product of the prime powers up to B1
+(2p is included because every q - 1 is a multiple of it), by squarings and
+multiplications by 3 reduced with shift and add (special_forms.py); stage 2
+multiplies x^r - 1 together for the primes B1 < r <= B2 (two products per
+prime, stepping from one prime to the next with a table of x^gap). A gcd
+with M_p after each stage finds any q whose k is B1-smooth apart from at
+most one prime up to B2.
+
+The bit depth and the P-1 bounds follow from p: a bit level is worth trying
+while it costs less than the Lucas-Lehmer test it may save times the chance
+(about 1/b) of a factor of that size, and P-1 gets about PM1_COST_FRACTION
+of a Lucas-Lehmer test.
+
+Usage:
+    python mersenne_factoring.py 1000000 1001000 [--depth 50] [--b1 10000 --b2 200000] [--no-pm1]
+                                 [--output report.txt] [--workers N]
+"""
+import argparse
+import bisect
+import collections
+import itertools
+import math
+import sys
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+import distributed
+import expression_eval
+import instrumentation
+import prime_sieve
+import small_primes
+import special_forms
+import worker_pool
+
+CLASSES = 4620 # k mod 4 * 3 * 5 * 7 * 11
+SIEVE_BOUND = 2**16 # Largest prime sieved out of the candidates q = 2kp + 1
+SIEVE_LENGTH = 2**15 # j values sieved at once within one class
+MIN_K_PER_CLASS = 256 # Bit levels below this many k per class are searched in one go
+MIN_DEPTH = 20 # Bit levels up to 2^MIN_DEPTH are always trial factored
+MAX_DEPTH = 80 # and none above 2^MAX_DEPTH
+# Cost model behind the automatic depth and bounds (seconds, calibrated on one core)
+LL_SECONDS_PER_BIT2 = 2.5e-9 # A Lucas-Lehmer test of M_p takes about this times p^2
+TF_SECONDS_PER_K = 1.2e-7 # Trial factoring, per k (all classes, sieving included)
+PM1_COST_FRACTION = 0.03 # P-1 gets about this fraction of the Lucas-Lehmer squarings
+PM1_B2_MULTIPLIER = 20 # B2 = PM1_B2_MULTIPLIER * B1
+PM1_MIN_B1 = 100 # Smaller B1 are not worth a P-1 run
+CHECK_EVERY = 256 # Squarings between two cancel checks
+
+
+def candidate_classes(p):
+    """The classes k mod CLASSES for which q = 2kp + 1 can divide M_p."""
+    return [c for c in range(CLASSES)
+            if (2 * p * c + 1) % 8 in (1, 7) and all((2 * p * c + 1) % r for r in (3, 5, 7, 11))]
+
+
+def lucas_lehmer_seconds(p):
+    return LL_SECONDS_PER_BIT2 * p * p
+
+
+def trial_factor_depth(p):
+    """
+    The bit depth to trial factor M_p to: the last level [2^(b-1), 2^b) whose
+    k values cost less than lucas_lehmer_seconds(p) / b to try.
+    """
+    budget = lucas_lehmer_seconds(p)
+    depth = MIN_DEPTH
+    while depth < MAX_DEPTH and (2**depth / (2 * p)) * TF_SECONDS_PER_K <= budget / (depth + 1):
+        depth += 1
+    return depth
+
+
+def pm1_bounds(p):
+    """
+    (B1, B2) for P-1 on M_p, or None when B1 would be below PM1_MIN_B1.
+    Stage 1 takes about 1.44 * B1 squarings and stage 2 about 2 * B2 / ln(B2)
+    products, together PM1_COST_FRACTION of the p squarings of Lucas-Lehmer.
+    """
+    b1 = int(PM1_COST_FRACTION * p / (1.44 + 2 * PM1_B2_MULTIPLIER / math.log(PM1_B2_MULTIPLIER * p)))
+    if b1 < PM1_MIN_B1:
+        return None
+    return b1, PM1_B2_MULTIPLIER * b1
+
+
+def bit_levels(p, depth):
+    """
+    Yields (b, k_start, k_stop): the k with 2kp + 1 in [2^(b-1), 2^b), levels
+    with fewer than MIN_K_PER_CLASS k per class merged into the next one.
+    """
+    k_start = 1
+    for b in range((2 * p + 1).bit_length(), depth + 1):
+        k_stop = ((1 << b) - 1) // (2 * p) + 1
+        if k_stop - k_start >= CLASSES * MIN_K_PER_CLASS or b == depth:
+            yield b, k_start, k_stop
+            k_start = k_stop
+
+
+def trial_factor_task(args):
+    """
+    Worker task: tries q = 2kp + 1 for k_start <= k < k_stop in the given
+    classes. args is (p, classes, k_start, k_stop). Returns the factors found
+    (sorted) and the number of powmods run.
+    """
+    p, classes, k_start, k_stop = args
+    step = 2 * CLASSES * p
+    # Sieving primes below 2p + 1 never cross off a factor q that equals the prime itself
+    bound = min(SIEVE_BOUND, 2 * p, max(13, (k_stop - k_start) // CLASSES))
+    sieve_primes = [int(r) for r in small_primes.primes_up_to(bound) if r >= 13 and r != p]
+    step_inverses = [pow(step % r, -1, r) for r in sieve_primes]
+    factors = []
+    tested = 0
+    for c in classes:
+        q0 = 2 * p * c + 1
+        roots = [-q0 * inverse % r for r, inverse in zip(sieve_primes, step_inverses)]
+        j_start = -((c - k_start) // CLASSES) # ceil((k_start - c) / CLASSES)
+        j_stop = -((c - k_stop) // CLASSES)
+        for j0 in range(j_start, j_stop, SIEVE_LENGTH):
+            length = min(SIEVE_LENGTH, j_stop - j0)
+            flags = bytearray(b"\x01") * length
+            for r, root in zip(sieve_primes, roots):
+                start = (root - j0) % r
+                if start < length:
+                    flags[start::r] = bytes(len(range(start, length, r)))
+            for j in itertools.compress(range(j0, j0 + length), flags):
+                tested += 1
+                q = q0 + step * j
+                if gmpy2.powmod(2, p, q) == 1:
+                    factors.append(q)
+    return sorted(factors), tested
+
+
+def run_tasks(task, tasks):
+    """Runs task over tasks on the shared pool with a bounded window, yielding the results."""
+    if len(tasks) <= 1 or worker_pool.get_pool_size() == 1:
+        for args in tasks:
+            worker_pool.raise_if_cancelled()
+            yield task(args)
+        return
+    in_flight = collections.deque()
+    for args in tasks:
+        in_flight.append(worker_pool.submit(task, args))
+        if len(in_flight) >= 2 * worker_pool.get_pool_size():
+            yield in_flight.popleft().result()
+            worker_pool.raise_if_cancelled()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def trial_factor(p, depth=None, parallel=True, progress_callback=None):
+    """
+    Trial factors M_p (p an odd prime) up to 2^depth (default:
+    trial_factor_depth(p)), one bit level at a time.
+    progress_callback(fraction) is called after each level.
+    Returns (factor, depth): the smallest factor in the first level that has
+    one, or None, and the depth searched. While workers are connected to a
+    coordinator, each level is a job for them that stops at the first factor,
+    so the factor is the smallest one of the units that finished.
+    """
+    if depth is None:
+        depth = trial_factor_depth(p)
+    depth = min(depth, p - 1) # A proper factor of M_p is below 2^(p-1)
+    classes = candidate_classes(p)
+    coordinator = distributed.active_coordinator() if parallel else None
+    workers = coordinator.worker_count() if coordinator is not None else worker_pool.get_pool_size()
+    chunks = min(len(classes), 4 * workers) if parallel else 1
+    class_chunks = [classes[i::chunks] for i in range(chunks)]
+    levels = list(bit_levels(p, depth))
+    total_k = levels[-1][2] if levels else 1
+    with instrumentation.span("trial_factoring"):
+        for b, k_start, k_stop in levels:
+            results = None
+            if coordinator is not None:
+                # Factors from the workers are checked before they stop the level
+                try:
+                    results = coordinator.run_job(
+                        "trial_factor", p, [(chunk, k_start, k_stop) for chunk in class_chunks],
+                        stop_when=lambda result: any(gmpy2.powmod(2, p, q) == 1 for q in result[0])).results.values()
+                except distributed.NoWorkers:
+                    coordinator = None # Every worker left; this level and the rest run on the local pool
+            if results is None:
+                results = run_tasks(trial_factor_task, [(p, chunk, k_start, k_stop) for chunk in class_chunks])
+            found = []
+            for factors, tested in results:
+                found.extend(q for q in factors if gmpy2.powmod(2, p, q) == 1)
+                instrumentation.count("trial_factoring_candidates", tested)
+            if progress_callback:
+                progress_callback(k_stop / total_k)
+            if found:
+                return int(min(found)), b
+    return None, depth
+
+
+def mersenne_reducer(p):
+    """x -> x mod M_p by shift and add."""
+    n = (mpz(1) << p) - 1
+    return lambda x: special_forms.reduce_special(x, 1, p, -1, n, n)
+
+
+def prime_power_below(r, bound):
+    """The largest power of the prime r that is at most bound."""
+    power = r
+    while power * r <= bound:
+        power *= r
+    return power
+
+
+def pm1_stage1(p, b1):
+    """
+    3^(2p * E) mod M_p, E the product of the largest powers of the primes
+    up to b1 that are at most b1, by left-to-right binary exponentiation
+    (each set bit is a multiplication by 3).
+    """
+    reduce = mersenne_reducer(p)
+    exponent = 2 * p * small_primes.product_of(prime_power_below(int(r), b1)
+                                                      for r in small_primes.primes_up_to(b1))
+    x = mpz(3)
+    for i, bit in enumerate(bin(exponent)[3:]):
+        x = reduce(x * x)
+        if bit == "1":
+            x = reduce(3 * x)
+        if i % CHECK_EVERY == 0:
+            worker_pool.raise_if_cancelled()
+    return x
+
+
+def pm1_stage2(p, x, b1, b2):
+    """
+    The product of x^r - 1 (mod M_p) over the primes b1 < r <= b2, stepping
+    from prime to prime with a table of x^gap for the even gaps.
+    """
+    reduce = mersenne_reducer(p)
+    primes = small_primes.primes_up_to(b2)
+    primes = primes[bisect.bisect_right(primes, b1):]
+    if not len(primes):
+        return mpz(1)
+    powers = {}
+    x_squared = reduce(x * x)
+    x_power = gmpy2.powmod(x, int(primes[0]), (mpz(1) << p) - 1)
+    product = x_power - 1
+    for i in range(1, len(primes)):
+        gap = int(primes[i] - primes[i - 1])
+        if gap not in powers:
+            powers[gap] = gmpy2.powmod(x_squared, gap // 2, (mpz(1) << p) - 1)
+        x_power = reduce(x_power * powers[gap])
+        product = reduce(product * (x_power - 1))
+        if i % CHECK_EVERY == 0:
+            worker_pool.raise_if_cancelled()
+    return product
+
+
+def p_minus_1(p, b1, b2):
+    """
+    P-1 on M_p with bounds b1 and b2. Returns a factor of M_p (not
+    necessarily prime), or None.
+    """
+    n = (mpz(1) << p) - 1
+    with instrumentation.span("p_minus_1"):
+        x = pm1_stage1(p, b1)
+        factor = gmpy2.gcd(x - 1, n)
+        if 1 < factor < n:
+            return int(factor)
+        if b2 > b1:
+            factor = gmpy2.gcd(pm1_stage2(p, x, b1, b2), n)
+            if 1 < factor < n:
+                return int(factor)
+    return None
+
+
+def find_mersenne_factor(p, depth=None, bounds=None, pm1=True, parallel=True, progress_callback=None):
+    """
+    Trial factoring (to depth, default trial_factor_depth(p)) and then P-1
+    (with bounds (B1, B2), default pm1_bounds(p)) for M_p, p an odd prime.
+    progress_callback(fraction) is called as trial factoring proceeds.
+    Returns a dict:
+      factor - a factor of M_p, or None
+      method - "trial_factoring" or "p-1" when a factor was found, else None
+      depth  - bit depth trial factored to
+      bounds - (B1, B2) of the P-1 run, or None if it did not run
+    """
+    factor, depth = trial_factor(p, depth, parallel, progress_callback)
+    result = {"factor": factor, "method": "trial_factoring" if factor else None, "depth": depth, "bounds": None}
+    if factor is None and pm1:
+        bounds = bounds or pm1_bounds(p)
+        if bounds is not None:
+            factor = p_minus_1(p, *bounds)
+            result.update(factor=factor, method="p-1" if factor else None, bounds=bounds)
+    return result
+
+
+def describe_search(result):
+    """The search that found the factor of a find_mersenne_factor() result, or all searches run."""
+    pm1_text = f"P-1 with B1={result['bounds'][0]}, B2={result['bounds'][1]}" if result["bounds"] else None
+    if result["method"] == "p-1":
+        return pm1_text
+    tf_text = f"trial factoring to 2^{result['depth']}"
+    return f"{tf_text}, {pm1_text}" if pm1_text and result["factor"] is None else tf_text
+
+
+def format_report_line(p, result):
+    if result["factor"] is not None:
+        return f"M{p} has a factor: {result['factor']} (found by {describe_search(result)})"
+    return f"M{p} no factor ({describe_search(result)})"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Trial factor and run P-1 on the Mersenne numbers M_p "
+                                                 "for the prime exponents p in [start, stop).")
+    parser.add_argument("start", help="first exponent (integer or expression)")
+    parser.add_argument("stop", help="end of the exponent range, exclusive (integer or expression)")
+    parser.add_argument("--depth", type=int, default=None, help="bit depth to trial factor to (default: from p)")
+    parser.add_argument("--b1", type=int, default=None, help="P-1 stage 1 bound (default: from p)")
+    parser.add_argument("--b2", type=int, default=None, help="P-1 stage 2 bound (default: 20 * B1)")
+    parser.add_argument("--no-pm1", action="store_true", help="trial factoring only")
+    parser.add_argument("--output", default=None, help="write the report to this file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    start = max(3, int(expression_eval.evaluate_expression(args.start)))
+    stop = int(expression_eval.evaluate_expression(args.stop))
+    worker_pool.configure_pool(args.workers)
+    bounds = (args.b1, args.b2 or PM1_B2_MULTIPLIER * args.b1) if args.b1 else None
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    factored = tested = 0
+    scan_start = time.perf_counter()
+    try:
+        for p in prime_sieve.primes_between(start, stop - 1): # primes_between() includes its end
+            result = find_mersenne_factor(int(p), args.depth, bounds, pm1=not args.no_pm1)
+            tested += 1
+            factored += result["factor"] is not None
+            print(format_report_line(p, result), file=output, flush=True)
+    finally:
+        if args.output:
+            output.close()
+    print(f"{factored} of {tested} exponents in [{start}, {stop}) factored in "
+          f"{time.perf_counter() - scan_start:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+"""
+Headless batch primality testing.
+
+Runs the same pipeline as the 'Check Primality' button (expression parsing,
+known prime lookup, classical_filter, Euler-Jacobi bases and the
+Miller-Rabin guard) on newline-delimited numbers or expressions and streams
+one JSON verdict per line to stdout.
+
+Usage:
+    python -m prime_numbers batch [FILE ...] [--bases 5 | --mode bpsw] [--order input|completion] [--workers N]
+                                  [--no-cache]
+
+Reads from stdin when no file (or '-') is given. Blank lines and lines
+starting with '#' are skipped. Each output line looks like:
+    {"id": 3, "bits": 127, "verdict": "prime", "stage": "mersenne", "witness": null,
+     "factor": null, "cached": null, "timings": {"parse": 0.0001, "known_primes": 0.0002}}
+where id is the line number in the (concatenated) input and cached is "memory"
+or "disk" when the verdict came from the verdict cache (see verdict_cache.py).
+
+Candidates are tested in parallel on the shared worker pool, one candidate
+per task. At most --window candidates are in flight (or waiting to be
+written in input order), so memory use does not grow with input size.
+"""
+import argparse
+import concurrent.futures
+import fileinput
+import json
+import sys
+import time
+
+import prime_numbers
+import worker_pool
+
+
+def parse_bases_argument(bases_str):
+    """
+    Parses --bases: a single number is a count of random bases,
+    a comma-separated list gives explicit bases (like the GUI field).
+    """
+    if ',' in bases_str:
+        bases = [int(b.strip()) for b in bases_str.split(',') if b.strip()]
+        if not bases or any(b <= 1 for b in bases):
+            raise argparse.ArgumentTypeError("bases must be integers greater than 1")
+        return bases
+    count = int(bases_str)
+    if count <= 0:
+        raise argparse.ArgumentTypeError("number of random bases must be a positive integer")
+    return count
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1 (e.g. --window)."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid integer: '{value}'") from None
+    if number <= 0:
+        raise argparse.ArgumentTypeError("must be a positive integer")
+    return number
+
+
+def test_candidate(args):
+    """
+    Worker task: parses and tests one input line.
+    Returns the verdict dict written as one NDJSON line.
+    """
+    line_id, text, bases, mode, use_cache = args
+    timings = {}
+    stage_start = time.perf_counter()
+
+    p_exponent = prime_numbers.match_direct_mersenne_expression(text)
+    if p_exponent is not None:
+        timings["parse"] = time.perf_counter() - stage_start
+        return {"id": line_id, "bits": p_exponent, "verdict": "prime", "stage": "mersenne",
+                "witness": None, "factor": None, "cached": None, "timings": timings}
+
+    try:
+        n_mpz, shape = prime_numbers.parse_input_expression(text)
+        timings["parse"] = time.perf_counter() - stage_start
+        verdict = prime_numbers.run_primality_pipeline(n_mpz, bases, parallel=False, mode=mode, use_cache=use_cache,
+                                                       shape=shape)
+    except worker_pool.TaskCancelled:
+        raise # The request's deadline passed (prime_service.py); not an error in the input
+    except Exception as e:
+        return {"id": line_id, "verdict": "error", "error": str(e), "timings": timings}
+
+    timings.update(verdict["timings"])
+    return {"id": line_id, "bits": int(n_mpz.bit_length()), "verdict": verdict["verdict"],
+            "stage": verdict["stage"], "witness": verdict["witness"], "factor": verdict["factor"],
+            "cached": verdict["cached"], "timings": timings}
+
+
+def read_candidates(files):
+    """Yields (line_id, text) for every non-empty, non-comment input line."""
+    with fileinput.input(files=files or ("-",)) as lines:
+        for line in lines:
+            text = line.strip()
+            if text and not text.startswith("#"):
+                yield fileinput.lineno(), text
+
+
+def run_batch(candidates, bases, ordered, window, out, mode="euler_jacobi", use_cache=True):
+    """
+    Tests candidates on the shared worker pool and writes one JSON line per
+    candidate to out, either in input order or in completion order.
+    Returns the number of candidates processed.
+    """
+    pending = {}      # future -> (sequence number, line id)
+    finished = {}     # sequence number -> result, waiting for earlier ones (ordered mode)
+    written = 0
+    submitted = 0
+    candidates = iter(candidates)
+    exhausted = False
+
+    def write(result):
+        out.write(json.dumps(result, separators=(",", ":")) + "\n")
+
+    while True:
+        # Keep the window full; in ordered mode it also covers results waiting to be written
+        while not exhausted and submitted - written < window:
+            try:
+                line_id, text = next(candidates)
+            except StopIteration:
+                exhausted = True
+                break
+            pending[worker_pool.submit(test_candidate, (line_id, text, bases, mode, use_cache))] = (submitted, line_id)
+            submitted += 1
+
+        if not pending:
+            break
+
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            sequence, line_id = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"id": line_id, "verdict": "error", "error": str(e)}
+            if ordered:
+                finished[sequence] = result
+            else:
+                write(result)
+                written += 1
+
+        # In ordered mode, sequence numbers equal the count of results written before them
+        while written in finished:
+            write(finished.pop(written))
+            written += 1
+        out.flush()
+
+    return submitted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m prime_numbers batch",
+        description="Test newline-delimited numbers or expressions and print NDJSON verdicts.")
+    parser.add_argument("files", nargs="*", help="input files (default: stdin)")
+    parser.add_argument("--bases", type=parse_bases_argument, default=prime_numbers.DEFAULT_NUM_BASES,
+                        help="number of random Euler-Jacobi bases, or a comma-separated list (default: %(default)s)")
+    parser.add_argument("--mode", choices=prime_numbers.PRIMALITY_MODES, default="euler_jacobi",
+                        help="Euler-Jacobi bases (+ MR guard) or Baillie-PSW (default: %(default)s)")
+    parser.add_argument("--order", choices=("input", "completion"), default="input",
+                        help="write verdicts in input order or as soon as they complete (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    parser.add_argument("--window", type=positive_int, default=None,
+                        help="maximum number of candidates in flight (default: 4 per worker)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="neither read nor store verdicts in the verdict cache")
+    args = parser.parse_args(argv)
+
+    worker_pool.configure_pool(args.workers)
+    window = args.window if args.window is not None else worker_pool.get_pool_size() * 4
+    run_batch(read_candidates(args.files), args.bases, args.order == "input", window, sys.stdout, args.mode,
+              not args.no_cache)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,450 @@
+"""
+The prime-counting function pi(x): exact counts with the Lagarias-Miller-Odlyzko
+(LMO) form of the Meissel-Lehmer method, and fast estimates (li(x), Riemann's
+R(x)) with error bounds.
+
+count_primes_between(2, x) sieves all of [2, x], which stops being practical
+somewhere past 10**11. The combinatorial method only sieves up to x/y, with
+y = ALPHA * x**(1/3). With a = pi(y):
+
+    pi(x) = phi(x, a) + a - 1 - P2(x, a)
+
+phi(x, a) counts the n <= x without a prime factor among the first a primes
+p_1 = 2, ..., p_a, and P2(x, a) the n <= x with exactly two prime factors
+greater than p_a:
+
+    P2(x, a) = sum over primes y < p <= sqrt(x) of pi(x/p) - pi(p) + 1
+
+Expanding phi(x, a) with phi(v, b) = phi(v, b-1) - phi(v/p_b, b-1) ends in two
+kinds of leaves:
+
+  * ordinary leaves mu(n) * phi(x/n, c) for the squarefree n <= y whose prime
+    factors are all greater than p_c. phi(., c) for c = PHI_TABLE_PRIMES is
+    read from a table over one period, 2*3*5*7*11*13*17 = 510510 (memoised
+    per process).
+  * special leaves -mu(m) * phi(x/(p_b m), b-1) for c < b < a and the
+    squarefree y/p_b < m <= y whose prime factors are all greater than p_b.
+    For v = x/(p_b m) < p_b**2 the only survivors are 1 and primes, so
+    phi(v, b-1) = max(1, pi(v) - b + 2), a bisection in the primes up to
+    sqrt(x) ("easy" leaves). The others ("hard" leaves, all those with p_b at
+    most x**(1/4)) are counted in a segmented sieve of [0, x/y): a segment is
+    sieved by p_4 = 7, p_5, ... in turn, and just before p_b is crossed off,
+    the leaves of b that fall into the segment are answered by counting the
+    survivors up to v.
+
+The segments then finish sieving with all primes up to sqrt(x/y), and the
+same pass gives the pi(x/p) for P2. A segment is a wheel of 30: 8 bytes per
+row of 30 integers, one for each residue coprime to 30 (as in prime_sieve,
+but interleaved, so counting up to v is a single bytearray.count).
+
+Every segment is an independent task on the shared worker pool: its counts
+are relative to its own start (per b the survivors of the segment and the
+total sign of its leaves), and the parent adds in the counts of the segments
+before it. The easy leaves are split over the pool by ranges of b.
+
+In pure Python on one core of the development machine, pi(10**12) takes 4 s,
+pi(10**13) 20 s and pi(10**14) 100 s, dominated by the bytearray.count calls
+of the hard leaves. The work grows about fivefold per decade, so 10**15 takes
+about 8 minutes and 10**16 about 45 minutes of CPU time, divided over the
+workers.
+
+prime_count_estimate(x) is the fast path: li(x) and R(x), with Dusart's
+unconditional bounds (2010) and Schoenfeld's bound assuming the Riemann
+hypothesis (1976), |pi(x) - li(x)| < sqrt(x) ln(x) / (8 pi) for x >= 2657.
+
+Usage:
+    python prime_count.py 10**13 [--workers N]
+    python prime_count.py 10**24 --estimate
+"""
+import argparse
+import bisect
+import functools
+import itertools
+import math
+import sys
+from array import array
+
+import instrumentation
+import prime_sieve
+import small_primes
+import worker_pool
+
+PHI_TABLE_PRIMES = 7 # phi(v, 7) comes from a table over 2*3*5*7*11*13*17
+PHI_TABLE_PERIOD = 510510
+ALPHA = 3 # y = ALPHA * x**(1/3): a larger y shortens the sieve but adds easy leaves
+DIRECT_COUNT_LIMIT = 10**7 # Below this, pi(x) comes straight from prime_sieve
+SEGMENT_ROWS = 2**18 # Rows of 30 integers per segment: 2 MB of flags
+EASY_TASKS_PER_WORKER = 4
+WHEEL = prime_sieve.WHEEL
+WHEEL_RESIDUES = prime_sieve.WHEEL_RESIDUES
+WHEEL_RANK = tuple(sum(r <= t for r in WHEEL_RESIDUES) for t in range(WHEEL)) # Residues <= t
+# x/L (1 + 1/L + 2/L^2) <= pi(x) <= x/L (1 + 1/L + 2.51/L^2) (L = ln x) from here on
+DUSART_MIN_X = 355991
+EULER_GAMMA = 0.5772156649015329
+
+
+@functools.lru_cache(maxsize=1)
+def phi_table():
+    """table[r] = phi(r, PHI_TABLE_PRIMES) for 0 <= r < PHI_TABLE_PERIOD."""
+    flags = bytearray(b"\x01") * PHI_TABLE_PERIOD
+    for p in small_primes.primes_up_to(17)[:PHI_TABLE_PRIMES]:
+        flags[::p] = bytes(len(range(0, PHI_TABLE_PERIOD, p)))
+    return array('L', itertools.accumulate(flags))
+
+
+def phi_small(v):
+    """phi(v, PHI_TABLE_PRIMES): the n <= v with no prime factor up to 17."""
+    table = phi_table()
+    q, r = divmod(v, PHI_TABLE_PERIOD)
+    return q * table[-1] + table[r]
+
+
+def choose_y(x):
+    """
+    y between x**(1/3) (so that no n <= x has three prime factors above y) and
+    x**0.4 (so that every special leaf with a composite m is a hard one).
+    """
+    cube_root = round(x ** (1 / 3))
+    while cube_root ** 3 > x:
+        cube_root -= 1
+    return max(cube_root, min(int(ALPHA * x ** (1 / 3)), int(x ** 0.4)))
+
+
+@functools.lru_cache(maxsize=1)
+def factor_tables(y):
+    """(lpf, mu) for 0..y: the least prime factor (0 for 1) and the Moebius function."""
+    lpf = [0] * (y + 1)
+    for p in reversed(small_primes.primes_up_to(y)):
+        lpf[p::p] = [p] * len(range(p, y + 1, p))
+    mu = [0] * (y + 1)
+    mu[1] = 1
+    for m in range(2, y + 1):
+        p = lpf[m]
+        rest = m // p
+        mu[m] = 0 if lpf[rest] == p else -mu[rest]
+    return lpf, mu
+
+
+@functools.lru_cache(maxsize=1)
+def special_leaf_plan(x, y):
+    """
+    The hard special leaves, one entry per prime p_b from p_4 = 7 up to the
+    last one that has any: (p, x // p, ms, mus, first, last, v_limit). The
+    leaves of b are m = ms[first:last] (ascending), with mu(m) = mus[i], or
+    -1 for all of them when mus is None (m prime). Entries up to
+    PHI_TABLE_PRIMES have no leaves; their primes are only sieved out.
+    v_limit is the largest leaf v of this or any later entry, so a segment
+    starting above it can skip the entry and everything after it.
+    """
+    primes = small_primes.primes_up_to(math.isqrt(x))
+    a = bisect.bisect_right(primes, y)
+    composite_end = bisect.bisect_right(primes, math.isqrt(y)) # b up to here: m may be composite
+    if composite_end > PHI_TABLE_PRIMES:
+        lpf, mu = factor_tables(y)
+        by_lpf = sorted((m for m in range(2, y + 1) if mu[m]), key=lpf.__getitem__, reverse=True)
+        lpf_keys = [-lpf[m] for m in by_lpf]
+
+    plan = []
+    for b in range(4, a):
+        p = primes[b - 1]
+        if b <= PHI_TABLE_PRIMES:
+            plan.append((p, x // p, (), None, 0, 0, 0))
+        elif b <= composite_end:
+            candidates = by_lpf[:bisect.bisect_left(lpf_keys, -p)] # lpf(m) > p
+            ms = array('L', sorted(m for m in candidates if m > y // p))
+            plan.append((p, x // p, ms, array('b', (mu[m] for m in ms)), 0, len(ms), x // (p * ms[0]) if ms else 0))
+        else:
+            # m = q prime, p < q <= y; hard while v = x/(pq) >= p^2
+            last = bisect.bisect_right(primes, min(y, x // p**3), b, a)
+            if last <= b:
+                break
+            plan.append((p, x // p, primes, None, b, last, x // (p * primes[b])))
+
+    v_limit = 0
+    for i in range(len(plan) - 1, -1, -1):
+        v_limit = max(v_limit, plan[i][6])
+        plan[i] = plan[i][:6] + (v_limit,)
+    while plan and not plan[-1][6]:
+        plan.pop()
+    return plan
+
+
+def cross_off(flags, lo, p, inverse, from_square=False, count=True):
+    """
+    Crosses off the multiples of p in the segment of flags starting at lo
+    (from p*p on if from_square, so that p itself survives). Returns how many
+    of them were still set if count is set.
+    """
+    crossed = 0
+    size = len(flags)
+    step = 8 * p
+    for index, residue in enumerate(WHEEL_RESIDUES):
+        # Row k holds lo + 30k + residue; it is a multiple of p for k = -(lo + residue) / 30 mod p
+        offset = lo + residue
+        k = (-offset * inverse) % p
+        if from_square and offset + WHEEL * k < p * p:
+            k += -(-(p * p - offset - WHEEL * k) // (WHEEL * p)) * p
+        start = 8 * k + index
+        if start < size:
+            if count:
+                crossed += flags[start::step].count(1)
+            flags[start::step] = bytes((size - 1 - start) // step + 1)
+    return crossed
+
+
+def special_leaf_segment(args):
+    """
+    Worker task: sieves the segment [lo, lo + 30*SEGMENT_ROWS) of [0, x/y).
+    Returns (leaf_sum, signs, survivors, p2_sum, p2_terms, primes_found):
+      * leaf_sum: the hard special leaves in the segment, each phi value counted
+        from the start of the segment
+      * signs[j], survivors[j] for plan entry j: the total sign of its leaves
+        here, and the numbers of the segment left after sieving by the primes
+        before it
+      * p2_sum, p2_terms: the sum of pi(x/p) counted from the start of the
+        segment, and the number of primes y < p <= sqrt(x) with x/p in it
+      * primes_found: the primes >= 7 in the segment
+    """
+    x, y, lo = args
+    size = 8 * SEGMENT_ROWS
+    hi = lo + WHEEL * SEGMENT_ROWS
+    plan = special_leaf_plan(x, y)
+    primes = small_primes.primes_up_to(math.isqrt(x))
+    sieving, inverses = prime_sieve.sieving_primes(math.isqrt(x // y + 1))
+    flags = bytearray(b"\x01") * size
+    remaining = size
+
+    active = len(plan)
+    while active and plan[active - 1][6] < lo:
+        active -= 1
+    leaf_sum = 0
+    signs, survivors = [], []
+    for j in range(active):
+        p, xp, ms, mus, first, last, _ = plan[j]
+        if last > first:
+            # Leaves with lo <= v = xp // m < hi, in order of increasing v
+            i0 = bisect.bisect_right(ms, xp // hi, first, last)
+            i1 = bisect.bisect_right(ms, xp // lo, first, last) if lo else last
+            running = position = 0
+            if mus is None:
+                for i in range(i1 - 1, i0 - 1, -1):
+                    t = xp // ms[i] - lo
+                    end = 8 * (t // WHEEL) + WHEEL_RANK[t % WHEEL]
+                    running += flags.count(1, position, end)
+                    position = end
+                    leaf_sum += running
+                signs.append(i1 - i0)
+            else:
+                sign_total = 0
+                for i in range(i1 - 1, i0 - 1, -1):
+                    t = xp // ms[i] - lo
+                    end = 8 * (t // WHEEL) + WHEEL_RANK[t % WHEEL]
+                    running += flags.count(1, position, end)
+                    position = end
+                    leaf_sum -= mus[i] * running
+                    sign_total -= mus[i]
+                signs.append(sign_total)
+        else:
+            signs.append(0)
+        survivors.append(remaining)
+        remaining -= cross_off(flags, lo, p, inverses[j])
+
+    # Finish the sieve for P2: survivors are then exactly the primes >= 7
+    if lo == 0:
+        flags[0] = 0 # The number 1
+        for p in sieving[:active]:
+            flags[8 * (p // WHEEL) + WHEEL_RANK[p % WHEEL] - 1] = 1
+    for j in range(active, len(sieving)):
+        p = sieving[j]
+        if p * p >= hi:
+            break
+        cross_off(flags, lo, p, inverses[j], from_square=True, count=False)
+
+    a = bisect.bisect_right(primes, y)
+    i0 = max(a, bisect.bisect_right(primes, x // hi))
+    i1 = bisect.bisect_right(primes, x // lo) if lo else len(primes)
+    p2_sum = running = position = 0
+    for i in range(i1 - 1, i0 - 1, -1):
+        t = x // primes[i] - lo
+        end = 8 * (t // WHEEL) + WHEEL_RANK[t % WHEEL]
+        running += flags.count(1, position, end)
+        position = end
+        p2_sum += running
+    return leaf_sum, signs, survivors, p2_sum, max(0, i1 - i0), flags.count(1)
+
+
+def easy_leaves(args):
+    """
+    Worker task: the sum of the special leaves of p_first, ..., p_(last-1)
+    that are not hard (m = q prime, v = x/(p_b q) < p_b^2), where
+    phi(v, b-1) = pi(v) - b + 2, or 1 once v < p_b.
+    """
+    x, y, first, last = args
+    primes = small_primes.primes_up_to(math.isqrt(x))
+    a = bisect.bisect_right(primes, y)
+    total = 0
+    for b in range(first, last):
+        p = primes[b - 1]
+        easy_start = bisect.bisect_right(primes, x // p**3, b, a)
+        trivial_start = bisect.bisect_right(primes, x // (p * p), easy_start, a)
+        values = map((x // p).__floordiv__, primes[easy_start:trivial_start])
+        total += sum(map(bisect.bisect_right, itertools.repeat(primes), values))
+        total -= (b - 2) * (trivial_start - easy_start)
+        total += a - trivial_start
+    return total
+
+
+def run_tasks(fn, tasks, parallel):
+    """Runs fn over the tasks (on the pool if parallel) and returns the results in task order."""
+    if not parallel or worker_pool.get_pool_size() == 1 or len(tasks) == 1:
+        results = []
+        for task in tasks:
+            results.append(fn(task))
+            worker_pool.raise_if_cancelled()
+        return results
+    results = {}
+    for task, result, error in worker_pool.as_completed_results(fn, tasks):
+        if error is not None:
+            raise error
+        results[task] = result
+    return [results[task] for task in tasks]
+
+
+def prime_count(x, parallel=True):
+    """Returns pi(x), the number of primes <= x: a rank lookup if the prime table reaches x, else as described above."""
+    x = int(x)
+    table = small_primes.covering_table(x)
+    if table is not None:
+        return table.prime_count(x)
+    if x < DIRECT_COUNT_LIMIT:
+        return prime_sieve.count_primes_between(2, x) if x >= 2 else 0
+
+    y = choose_y(x)
+    primes = small_primes.primes_up_to(math.isqrt(x))
+    a = bisect.bisect_right(primes, y)
+
+    with instrumentation.span("ordinary_leaves"):
+        lpf, mu = factor_tables(y)
+        p_c = primes[PHI_TABLE_PRIMES - 1]
+        ordinary = phi_small(x) + sum(mu[n] * phi_small(x // n) for n in range(2, y + 1)
+                                      if lpf[n] > p_c and mu[n])
+
+    with instrumentation.span("easy_leaves"):
+        first = max(PHI_TABLE_PRIMES, bisect.bisect_right(primes, math.isqrt(y))) + 1
+        # About a - b leaves per b: split [first, a) into ranges of equal work
+        pieces = EASY_TASKS_PER_WORKER * (worker_pool.get_pool_size() if parallel else 1)
+        target = (a - first) * (a - first + 1) / (2 * pieces)
+        bounds = [first]
+        work = 0
+        for b in range(first, a):
+            work += a - b
+            if work >= target:
+                bounds.append(b + 1)
+                work = 0
+        bounds.append(a)
+        tasks = [(x, y, lo, hi) for lo, hi in zip(bounds, bounds[1:]) if hi > lo]
+        easy = sum(run_tasks(easy_leaves, tasks, parallel))
+
+    with instrumentation.span("special_leaf_sieve"):
+        tasks = [(x, y, lo) for lo in range(0, x // y + 1, WHEEL * SEGMENT_ROWS)]
+        hard = p2_sum = 0
+        offsets = []
+        found = 3 # 2, 3 and 5
+        for leaf_sum, signs, survivors, segment_p2, p2_terms, primes_found in \
+                run_tasks(special_leaf_segment, tasks, parallel):
+            hard += leaf_sum + sum(s * o for s, o in zip(signs, offsets))
+            offsets.extend([0] * (len(survivors) - len(offsets)))
+            for j, count in enumerate(survivors):
+                offsets[j] += count
+            p2_sum += segment_p2 + p2_terms * found
+            found += primes_found
+        instrumentation.count("special_leaf_segments", len(tasks))
+
+    # P2 = sum of pi(x/p) - pi(p) + 1 over the primes y < p <= sqrt(x); pi(primes[i]) - 1 = i
+    n = len(primes)
+    p2 = p2_sum - (n * (n - 1) - a * (a - 1)) // 2
+    return ordinary + hard + easy + a - 1 - p2
+
+
+def li(x):
+    """The logarithmic integral li(x) for x > 1: gamma + ln ln x + sum of (ln x)^k / (k k!)."""
+    log_x = math.log(x)
+    total = EULER_GAMMA + math.log(log_x)
+    term = 1.0
+    for k in itertools.count(1):
+        term *= log_x / k
+        total += term / k
+        if term / k < 1e-17 * total:
+            return total
+
+
+def zeta(s):
+    """Riemann zeta(s) for real s >= 2 (Euler-Maclaurin after ten terms)."""
+    n = 10
+    return (sum(k ** -s for k in range(1, n)) + n ** (1 - s) / (s - 1) + n ** -s / 2
+            + s * n ** (-s - 1) / 12 - s * (s + 1) * (s + 2) * n ** (-s - 3) / 720)
+
+
+def riemann_r(x):
+    """Riemann's R(x) = 1 + sum of (ln x)^k / (k k! zeta(k+1)) (Gram's series), for x > 1."""
+    log_x = math.log(x)
+    total = 1.0
+    term = 1.0
+    for k in itertools.count(1):
+        term *= log_x / k
+        total += term / (k * zeta(k + 1))
+        if term / k < 1e-17 * total:
+            return total
+
+
+def prime_count_estimate(x):
+    """
+    Fast approximations of pi(x) for x >= 2 (x up to about 10**300): a dict with
+    li and riemann_r (R(x) is usually the closer one), lower/upper (bounds that
+    always hold) and rh_lower/rh_upper (tighter, if the Riemann hypothesis is true).
+    Below DUSART_MIN_X the bounds are the exact count.
+    """
+    x = int(x)
+    if x < 2:
+        raise ValueError("x must be at least 2.")
+    estimate = {"x": x, "li": li(x), "riemann_r": riemann_r(x)}
+    if x < DUSART_MIN_X:
+        exact = prime_sieve.count_primes_between(2, x)
+        estimate.update(lower=exact, upper=exact, rh_lower=exact, rh_upper=exact)
+        return estimate
+    log_x = math.log(x)
+    lower = math.ceil(x / log_x * (1 + 1 / log_x + 2 / log_x**2))
+    upper = math.floor(x / log_x * (1 + 1 / log_x + 2.51 / log_x**2))
+    rh_error = math.sqrt(x) * log_x / (8 * math.pi)
+    estimate.update(lower=lower, upper=upper,
+                    rh_lower=max(lower, math.ceil(estimate["li"] - rh_error)),
+                    rh_upper=min(upper, math.floor(estimate["li"] + rh_error)))
+    return estimate
+
+
+def main(argv=None):
+    import prime_numbers
+
+    parser = argparse.ArgumentParser(description="Count the primes up to x (Lagarias-Miller-Odlyzko).")
+    parser.add_argument("x", help="upper bound (integer or expression, e.g. 10**13)")
+    parser.add_argument("--estimate", action="store_true",
+                        help="only print the li(x) and R(x) approximations with their error bounds")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    x = int(prime_numbers.evaluate_input_expression(args.x))
+    if args.estimate:
+        estimate = prime_count_estimate(x)
+        print(f"li(x) = {estimate['li']:.0f}")
+        print(f"R(x)  = {estimate['riemann_r']:.0f}")
+        print(f"{estimate['lower']} <= pi(x) <= {estimate['upper']}")
+        print(f"{estimate['rh_lower']} <= pi(x) <= {estimate['rh_upper']} (assuming the Riemann hypothesis)")
+        return 0
+    worker_pool.configure_pool(args.workers)
+    print(prime_count(x))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
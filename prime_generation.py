@@ -0,0 +1,242 @@
+"""
+next_prime(n), prev_prime(n) and random_prime(bits) for large primes.
+
+Calling check_prime() on n+1, n+2, ... runs the primorial gcd of the
+classical filter and a round of pool tasks for every candidate. Here the
+candidates are handled a window at a time: a window of consecutive odd
+numbers is sieved in one pass against the primes up to a bound that grows
+with the size of n (one n % p per prime, then a slice assignment crosses
+off every multiple of p in the window). Only the survivors get the cheap
+test, a strong probable-prime test to base 2, and only a candidate that
+passes it gets the full check: run_primality_pipeline() with the chosen mode
+and bases (without the cache), or deterministic Miller-Rabin for numbers
+below prime_sieve.DETERMINISTIC_MR_LIMIT.
+
+Windows are spread over the shared worker pool, one per worker. next_prime
+and prev_prime take the windows in order, so the answer is always the
+nearest prime; random_prime starts every window at an independent random
+point and keeps the first prime any of them finds.
+
+Usage:
+    python prime_generation.py next 2**1024
+    python prime_generation.py prev 10**300
+    python prime_generation.py random 2048 [--count 10] [--seed 1]
+"""
+import argparse
+import bisect
+import concurrent.futures
+import random
+import secrets
+import sys
+
+import gmpy2
+from gmpy2 import mpz
+
+import instrumentation
+import prime_numbers
+import prime_sieve
+import small_primes
+import worker_pool
+
+# Sieve bound by bit length: deeper sieving pays off once the base-2 test gets expensive
+SIEVE_BOUNDS = ((512, 2**14), (1024, 2**15), (2048, 2**18), (4096, 2**22))
+MAX_SIEVE_BOUND = 2**23
+MIN_WINDOW = 256 # Odd candidates per window (at least; otherwise one per bit of n)
+SMALL_PRIME_LIMIT = 2**16 # Below this, primes are looked up in the prime table
+
+
+def sieve_bound_for(bits):
+    for max_bits, bound in SIEVE_BOUNDS:
+        if bits <= max_bits:
+            return bound
+    return MAX_SIEVE_BOUND
+
+
+def window_size_for(bits):
+    """Odd candidates per window, about 0.7 times ln(n): most windows hold a prime."""
+    return max(MIN_WINDOW, bits)
+
+
+def sieve_window(start, size, bound):
+    """
+    Sieves the odd numbers start, start + 2, ..., start + 2*(size - 1) (start odd
+    and greater than bound) by the odd primes up to bound.
+    Returns a bytearray with 1 for every candidate without such a factor.
+    """
+    flags = bytearray(b"\x01") * size
+    start = mpz(start)
+    for p in small_primes.primes_up_to(bound)[1:]:
+        # start + 2i is a multiple of p for i = -start / 2 mod p
+        i = (-(start % p) * ((p + 1) >> 1)) % p
+        if i < size:
+            flags[i::p] = bytes((size - 1 - i) // p + 1)
+    return flags
+
+
+def is_full_probable_prime(n, mode, bases):
+    """The full check for a candidate that passed the base-2 test."""
+    if n < prime_sieve.DETERMINISTIC_MR_LIMIT:
+        return prime_sieve.is_prime_verified(n)
+    verdict = prime_numbers.run_primality_pipeline(n, bases, parallel=False, mode=mode, use_cache=False)
+    return verdict["verdict"] in ("prime", "probable_prime")
+
+
+def search_window(args):
+    """
+    Worker task: sieves one window and tests its survivors in ascending order
+    (descending if `descending`), stopping at the first probable prime.
+    Returns (prime or None, survivors tested).
+    """
+    start, size, descending, mode, bases = args
+    start = mpz(start)
+    with instrumentation.span("window_sieve"):
+        flags = sieve_window(start, size, sieve_bound_for(start.bit_length()))
+    offsets = range(size - 1, -1, -1) if descending else range(size)
+    tested = 0
+    for i in offsets:
+        if not flags[i]:
+            continue
+        candidate = start + 2 * i
+        tested += 1
+        worker_pool.raise_if_cancelled() # E.g. the deadline of a prime_service.py request
+        if gmpy2.is_strong_prp(candidate, 2) and is_full_probable_prime(candidate, mode, bases):
+            instrumentation.count("window_candidates_tested", tested)
+            return candidate, tested
+    instrumentation.count("window_candidates_tested", tested)
+    return None, tested
+
+
+def run_windows(windows, in_order, parallel):
+    """
+    Searches the windows (a possibly infinite iterator of search_window()
+    arguments) and returns the first prime found: the first one in window
+    order when in_order is set, otherwise whichever window finds one first.
+    With parallel=True, up to one window per pool worker runs at a time.
+    """
+    if not parallel or worker_pool.get_pool_size() == 1:
+        for window in windows:
+            prime, _ = search_window(window)
+            if prime is not None:
+                return prime
+            worker_pool.raise_if_cancelled()
+        return None
+
+    in_flight = [] # futures in window order
+    try:
+        while True:
+            while len(in_flight) < worker_pool.get_pool_size():
+                window = next(windows, None)
+                if window is None:
+                    break
+                in_flight.append(worker_pool.submit(search_window, window))
+            if not in_flight:
+                return None
+            waiting_for = in_flight[:1] if in_order else in_flight
+            done, _ = concurrent.futures.wait(waiting_for, timeout=worker_pool.CANCEL_CHECK_INTERVAL,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            worker_pool.raise_if_cancelled()
+            for future in done:
+                in_flight.remove(future)
+                prime, _ = future.result()
+                if prime is not None:
+                    return prime
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def next_prime(n, mode="euler_jacobi", bases=prime_numbers.DEFAULT_NUM_BASES, parallel=True):
+    """Returns the smallest probable prime greater than n."""
+    n = mpz(n)
+    table = small_primes.primes_up_to(SMALL_PRIME_LIMIT)
+    if n < table[-1]:
+        return mpz(table[bisect.bisect_right(table, max(int(n), 1))])
+    size = window_size_for(n.bit_length())
+    first = n + 1 if n % 2 == 0 else n + 2
+
+    def windows():
+        start = first
+        while True:
+            yield (start, size, False, mode, bases)
+            start += 2 * size
+
+    return run_windows(windows(), True, parallel)
+
+
+def prev_prime(n, mode="euler_jacobi", bases=prime_numbers.DEFAULT_NUM_BASES, parallel=True):
+    """Returns the largest probable prime less than n. Raises ValueError if n <= 2."""
+    n = mpz(n)
+    if n <= 2:
+        raise ValueError("There is no prime below 2.")
+    size = window_size_for(n.bit_length())
+    last = n - 1 if n % 2 == 0 else n - 2 # Largest odd number below n
+
+    def windows():
+        top = last
+        while top > SMALL_PRIME_LIMIT:
+            low = max(top - 2 * (size - 1), SMALL_PRIME_LIMIT + 1)
+            yield (low, (top - low) // 2 + 1, True, mode, bases)
+            top = low - 2
+
+    if last > SMALL_PRIME_LIMIT:
+        prime = run_windows(windows(), True, parallel)
+        if prime is not None:
+            return prime
+    # The rest lies in the range of the prime table
+    table = small_primes.primes_up_to(SMALL_PRIME_LIMIT)
+    return mpz(table[bisect.bisect_left(table, min(int(n), SMALL_PRIME_LIMIT)) - 1])
+
+
+def random_prime(bits, mode="euler_jacobi", bases=prime_numbers.DEFAULT_NUM_BASES, parallel=True, seed=None):
+    """
+    Returns a random probable prime of exactly `bits` bits: the first prime
+    after a random odd starting point with the top bit set. The starting
+    points come from the secrets module, or from random.Random(seed) for
+    repeatable test vectors (then the windows are taken in order, so the
+    result does not depend on which worker finishes first).
+    """
+    if bits < 2:
+        raise ValueError("A prime has at least 2 bits.")
+    if bits < SMALL_PRIME_LIMIT.bit_length():
+        table = small_primes.primes_up_to(SMALL_PRIME_LIMIT)
+        choices = table[bisect.bisect_left(table, 1 << (bits - 1)):bisect.bisect_left(table, 1 << bits)]
+        return mpz((random.Random(seed) if seed is not None else secrets.SystemRandom()).choice(choices))
+    randbits = random.Random(seed).getrandbits if seed is not None else secrets.randbits
+    size = window_size_for(bits)
+    top = mpz(1) << bits
+
+    def windows():
+        while True:
+            start = mpz(randbits(bits - 1)) | (top >> 1) | 1
+            if start + 2 * (size - 1) < top:
+                yield (start, size, False, mode, bases)
+
+    return run_windows(windows(), seed is not None, parallel)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Find the next or previous prime, or random primes of a given size.")
+    parser.add_argument("command", choices=("next", "prev", "random"))
+    parser.add_argument("value", help="n for next/prev (integer or expression), the bit length for random")
+    parser.add_argument("--count", type=int, default=1, help="number of random primes (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for repeatable random primes")
+    parser.add_argument("--mode", choices=prime_numbers.PRIMALITY_MODES, default="euler_jacobi",
+                        help="full check after the base-2 test (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    worker_pool.configure_pool(args.workers)
+    value = prime_numbers.evaluate_input_expression(args.value)
+    if args.command == "next":
+        print(next_prime(value, args.mode))
+    elif args.command == "prev":
+        print(prev_prime(value, args.mode))
+    else:
+        for i in range(args.count):
+            print(random_prime(int(value), args.mode, seed=None if args.seed is None else args.seed + i))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
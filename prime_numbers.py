@@ -1,41 +1,63 @@
 import tkinter as tk
 from tkinter import messagebox
-import sympy
 import math
-import multiprocessing
+import os
 import gmpy2
-from gmpy2 import mpz, powmod, log2, is_prime
-from concurrent.futures import ProcessPoolExecutor
+from gmpy2 import mpz, powmod
 import random
 import time
-import concurrent.futures
 from tkinter import ttk
-
-# Initialize gmpy2 random state for better randomness across runs
-gmpy2.random_state(int(time.time()))
-
-# List of known exponents p for Mersenne primes (M_p = 2^p - 1)
-# Source: https://www.mersenne.org/primes/ (GIMPS) - as of October 2024
-KNOWN_MERSENNE_EXPONENTS = {
-    2, 3, 5, 7, 13, 17, 19, 31, 61, 89, 107, 127, 521, 607, 1279, 2203, 2281, 3217, 4253, 4423,
-    9689, 9941, 11213, 19937, 21701, 23209, 44497, 86243, 110503, 132049, 216091, 756839,
-    859433, 1257787, 1398269, 2976221, 3021377, 6972593, 13466917, 20996011, 24036583,
-    25964951, 30402457, 32582657, 37156667, 42643801, 43112609, 57885161, 74207281,
-    77232917, 82589933, 136279841
-}
+import sys
+import worker_pool
+import distributed
+import prp_checkpoint
+import small_primes
+import known_primes
+import special_forms
+import mersenne_factoring
+import expression_eval
+import verdict_cache
+import instrumentation
+import gui_tasks
+from known_primes import KNOWN_MERSENNE_EXPONENTS
+
+# Allow str()/int() conversions of numbers with more than 4300 digits (Python 3.11+)
+if hasattr(sys, "set_int_max_str_digits"):
+    sys.set_int_max_str_digits(0)
+
+# Random bases are drawn from this state. gmpy2.random_state() without a seed
+# always starts from the same fixed seed, so the state is seeded explicitly:
+# with a fresh random seed per process, or by seed_random_bases(seed) to make
+# runs (e.g. benchmarks) reproducible.
+random_bases_state = None
+random_bases_pid = None
 
 PROGRESS_BAR_MAX = 100 # Define a global variable for the progress bar maximum
 
+IS_PRIME_THRESHOLD = 10**6 # Below this, gmpy2.is_prime() decides directly
+DEFAULT_NUM_BASES = 5 # Default number of random Euler-Jacobi bases (same as the GUI entry)
+DEFAULT_SMALL_PRIME_BASES = [2, 3, 5, 7, 11, 13, 17] # Fallback bases if none could be generated
+MR_GUARD_BASES = 5 # Number of Miller-Rabin guard bases for suspicious Euler-Jacobi profiles
+# Once one base proves n composite, exponentiations still running for other bases
+# are stopped by terminating the pool workers if n has at least this many bits
+# (for smaller n, letting them finish is cheaper than restarting the pool).
+TERMINATE_RUNNING_BITS = 20000
+PRIMALITY_MODES = ("euler_jacobi", "bpsw") # Probable-prime tests run after the classical filter
+VERDICT_CACHE_MIN_SECONDS = 0.01 # Verdicts that took less time than this are not worth a cache write
+
 # Helper function to update the result_text_area (defined later, but declared here for clarity if needed or move definition up)
 # This will be defined near the GUI section later.
 # def update_result_text(new_text): pass 
 
 # -------------------  LOGIC  -------------------
 
-# New function to check for a direct text expression of a Mersenne prime
-def check_direct_mersenne_expression(input_str_raw, start_time_check, root_widget, progress_bar_widget):
+def match_direct_mersenne_expression(input_str_raw):
+    """
+    Returns the exponent p if the input text is literally 2**p-1 or pow(2,p)-1
+    for a known Mersenne exponent p, otherwise None.
+    The number itself is never built.
+    """
     cleaned_input_str = input_str_raw.replace(" ", "").lower() # Remove spaces and convert to lowercase
-    P_EXPONENT_THRESHOLD_FOR_DISPLAY = 127 # Threshold for p above which we don't print the full M_p value
 
     for p_exponent in KNOWN_MERSENNE_EXPONENTS:
         expected_forms = [
@@ -43,171 +65,869 @@ def check_direct_mersenne_expression(input_str_raw, start_time_check, root_widge
             f"pow(2,{p_exponent})-1"
         ]
         if cleaned_input_str in expected_forms:
-            end_time_check = time.time()
-            if p_exponent > P_EXPONENT_THRESHOLD_FOR_DISPLAY:
-                result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent}.\nThis is a known Mersenne Prime."
-            else:
-                try:
-                    mersenne_value_mpz = mpz(2)**p_exponent - 1
-                    result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent} = {mersenne_value_mpz}.\nThis is a known Mersenne Prime."
-                except OverflowError:
-                    result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent}.\nThis is a known Mersenne Prime (value calculation issue)."
-            
-            update_result_text(f"{result_text_direct}\n(Verified by direct expression match in {end_time_check - start_time_check:.4f} seconds)") # MODIFIED: Use helper
-            if progress_bar_widget:
-                progress_bar_widget['value'] = PROGRESS_BAR_MAX
-            root_widget.update_idletasks()
-            return True
-    return False
+            return p_exponent
+    return None
+
+# New function to check for a direct text expression of a Mersenne prime
+def check_direct_mersenne_expression(input_str_raw, start_time_check, root_widget, progress_bar_widget):
+    P_EXPONENT_THRESHOLD_FOR_DISPLAY = 127 # Threshold for p above which we don't print the full M_p value
+
+    p_exponent = match_direct_mersenne_expression(input_str_raw)
+    if p_exponent is None:
+        return False
+
+    end_time_check = time.perf_counter()
+    if p_exponent > P_EXPONENT_THRESHOLD_FOR_DISPLAY:
+        result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent}.\nThis is a known Mersenne Prime."
+    else:
+        try:
+            mersenne_value_mpz = mpz(2)**p_exponent - 1
+            result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent} = {mersenne_value_mpz}.\nThis is a known Mersenne Prime."
+        except OverflowError:
+            result_text_direct = f"Input expression '{input_str_raw}' corresponds to M_{p_exponent}.\nThis is a known Mersenne Prime (value calculation issue)."
+
+    update_result_text(f"{result_text_direct}\n(Verified by direct expression match in {end_time_check - start_time_check:.4f} seconds)") # MODIFIED: Use helper
+    if progress_bar_widget:
+        progress_bar_widget['value'] = PROGRESS_BAR_MAX
+    root_widget.update_idletasks()
+    return True
 
 big_num = 10**20
 basic_field = [2, 3, 5, 7, 11, 13]
 big_num2 = 10**12
+# Upper bound for small divisors tried by classical_filter: primes up to sqrt(big_num2),
+# including the last 6k+1 candidate (10**6 + 3) that the original trial division reached.
+# Can be raised (e.g. to 10**7 or 10**8) to remove more composites before the Euler-Jacobi stage.
+FILTER_BOUND = round(math.sqrt(big_num2)) + 3
+
+def find_known_mersenne_exponent(n_mpz):
+    """
+    Returns p if n_mpz equals a known Mersenne prime M_p = 2^p - 1, otherwise None.
+    n_mpz is expected to be gmpy2.mpz.
+    The lookup is indexed by bit length (see known_primes.py), so no M_p is built.
+    """
+    known = known_primes.identify_known_prime(n_mpz)
+    if known is None or known["form"] != "mersenne":
+        return None
+    return known["parameter"]
 
 def check_known_mersenne_primes(n_mpz, start_time_check, root_widget, progress_bar_widget):
     """
-    Checks if the given number n_mpz is a known Mersenne prime
-    by direct comparison with M_p = 2^p - 1 for known exponents p.
+    Checks if the given number n_mpz is a known Mersenne prime M_p = 2^p - 1
+    (looked up by bit length, see find_known_mersenne_exponent).
     If yes, updates the GUI and returns True. Otherwise returns False.
     n_mpz is expected to be gmpy2.mpz.
     root_widget is the main window for update_idletasks.
     progress_bar_widget is the progress bar widget.
     """
-    if n_mpz <= 7: 
+    p_exponent = find_known_mersenne_exponent(n_mpz)
+    if p_exponent is None:
         return False
 
-    for p_exponent in KNOWN_MERSENNE_EXPONENTS: 
-        try:
-            power_of_2 = mpz(2)**p_exponent
-            mersenne_candidate = power_of_2 - 1
-        except OverflowError: 
-            continue 
-
-        if n_mpz == mersenne_candidate:
-            end_time_check = time.time()
-            update_result_text(f"{n_mpz} is a known Mersenne Prime (M{p_exponent}).\n(Verified in {end_time_check - start_time_check:.4f} seconds)") # MODIFIED: Use helper
-            if progress_bar_widget: 
-                progress_bar_widget['value'] = PROGRESS_BAR_MAX
-            root_widget.update_idletasks()
-            return True
-    return False
+    end_time_check = time.time()
+    update_result_text(f"{n_mpz} is a known Mersenne Prime (M{p_exponent}).\n(Verified in {end_time_check - start_time_check:.4f} seconds)") # MODIFIED: Use helper
+    if progress_bar_widget:
+        progress_bar_widget['value'] = PROGRESS_BAR_MAX
+    root_widget.update_idletasks()
+    return True
+
+def classical_filter_divisor(n, bound=None):
+    """
+    Checks divisibility by the small primes in basic_field and by all primes
+    up to bound (default FILTER_BOUND, just above sqrt(big_num2)).
+    Instead of trial-dividing by every 6k±1 candidate, n is checked with one
+    gcd against the cached primorial of the bound (see small_primes.py).
+    Returns the smallest divisor found (other than n itself), or None.
+    """
+    for trial_divisions, divisor in enumerate(basic_field, 1):
+        if n % divisor == 0 and n != divisor:
+            instrumentation.count("trial_divisions", trial_divisions)
+            return divisor
+    instrumentation.count("trial_divisions", len(basic_field))
+    return small_primes.smallest_prime_divisor(n, FILTER_BOUND if bound is None else bound)
 
 def classical_filter(n):
     """
     A simple filtering function: checks divisibility by the small primes
-    in basic_field and looks for divisors of the form 6k±1 up to sqrt(big_num2).
+    in basic_field and by all primes up to sqrt(big_num2).
     If a divisor is found, returns a string indicating the divisor.
     Otherwise, returns None.
     """
-    for divisor in basic_field:
-        if n % divisor == 0 and n != divisor:
-            return f"Number is composite, divisible by {divisor}"
-    k = 1
-    end = round(math.sqrt(big_num2)) + 1
-    while True:
-        divisor1 = 6 * k - 1
-        divisor2 = 6 * k + 1
-        if divisor1 > end:
-            break
-        if n % divisor1 == 0 and n != divisor1:
-            return f"Number is composite, divisible by {divisor1}"
-        if n % divisor2 == 0 and n != divisor2:
-            return f"Number is composite, divisible by {divisor2}"
-        k += 1
+    divisor = classical_filter_divisor(n)
+    if divisor is not None:
+        return f"Number is composite, divisible by {divisor}"
     return None
 
 def euler_test_single_base(args):
     """
-    Performs an Euler-based primality test for a given number n and base a.
-    Checks if a^((n-1)/2) % n is 1 or n-1 (Euler's criterion).
-    Returns (base, True) if the condition holds, (base, False) otherwise.
-    n_mpz and a_mpz are expected to be gmpy2.mpz objects.
+    Performs an Euler-Jacobi (Solovay-Strassen style) test for a given number n and base a.
+    Checks whether a^((n-1)/2) % n matches the Jacobi symbol (a/n) modulo n.
+    Returns (base, passed_bool, residue_sign), where residue_sign is:
+      1  -> residue was +1
+     -1  -> residue was -1 (n-1)
+      0  -> other / invalid / failure path
+    n_mpz and a_mpz are expected to be gmpy2.mpz objects (n_mpz may also be
+    a worker_pool.SharedOperand handle).
     """
     n_mpz, a_mpz = args
+    n_mpz = worker_pool.resolve_operand(n_mpz)
 
-    # Euler's criterion applies to odd n. n=2 is prime and handled earlier.
+    # Euler-Jacobi applies to odd n. n=2 is prime and handled earlier.
     # Base a must be > 1 and < n, and gcd(a,n) must be 1.
     if n_mpz <= 2 or n_mpz % 2 == 0:
-        return (int(a_mpz), False) 
+        return (int(a_mpz), False, 0)
     if not (1 < a_mpz < n_mpz):
-        return (int(a_mpz), False) 
+        return (int(a_mpz), False, 0)
     if gmpy2.gcd(a_mpz, n_mpz) != 1:
-        return (int(a_mpz), False) # n is composite if a shares a factor (and a < n)
+        return (int(a_mpz), False, 0) # n is composite if a shares a factor (and a < n)
 
     exponent = (n_mpz - 1) // 2
     try:
         x = powmod(a_mpz, exponent, n_mpz)
     except ValueError: # Should be very rare given the checks above
-        return (int(a_mpz), False)
+        return (int(a_mpz), False, 0)
 
-    # Check if x is 1 or n-1 (which is congruent to -1 mod n_mpz)
-    if x == 1 or x == (n_mpz - 1):
-        return (int(a_mpz), True)
-    else:
-        return (int(a_mpz), False)
+    jacobi_symbol = gmpy2.jacobi(a_mpz, n_mpz)
+    if jacobi_symbol == 0:
+        return (int(a_mpz), False, 0)
+
+    jacobi_mod_n = n_mpz - 1 if jacobi_symbol == -1 else mpz(jacobi_symbol)
+    residue_sign = 1 if x == 1 else (-1 if x == (n_mpz - 1) else 0)
+    return (int(a_mpz), x == jacobi_mod_n, residue_sign)
+
+def miller_rabin_test_single_base(n_mpz, a_mpz):
+    """
+    Miller-Rabin strong probable-prime test for one base.
+    Returns True if n_mpz passes for this base, False if it is definitely composite.
+    """
+    if n_mpz == 2:
+        return True
+    if n_mpz <= 1 or n_mpz % 2 == 0:
+        return False
+    if not (1 < a_mpz < n_mpz):
+        return False
+    if gmpy2.gcd(a_mpz, n_mpz) != 1:
+        return False
+    # a^d and the up to s-1 squarings of n - 1 = d * 2^s run in C; calling powmod
+    # once per squaring was slow for n with a large s (e.g. k*2^n+1)
+    return gmpy2.is_strong_prp(n_mpz, a_mpz)
 
-def run_euler_tests_parallel(n_mpz, bases_int_list, progress_bar_widget, root_widget, start_percentage):
+def seed_random_bases(seed=None):
+    """
+    Reseeds the generator of random bases for this process.
+    seed=None picks a fresh random seed; an integer makes the bases repeatable.
+    """
+    global random_bases_state, random_bases_pid
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    random_bases_state = gmpy2.random_state(seed)
+    random_bases_pid = os.getpid()
+
+def get_random_bases_state():
+    """The gmpy2 random state for bases; a forked worker gets its own fresh seed."""
+    if random_bases_pid != os.getpid():
+        seed_random_bases()
+    return random_bases_state
+
+def generate_random_guard_bases(n_mpz, requested_count, excluded_bases=None):
     """
-    Runs the Euler-based primality test in parallel for multiple bases.
+    Generates random unique bases in [2, n-2] for additional guard checks.
+    """
+    if requested_count <= 0 or n_mpz <= 3:
+        return []
+
+    excluded_set = set()
+    if excluded_bases:
+        excluded_set = {int(b) for b in excluded_bases if 1 < b < n_mpz}
+
+    generated = []
+    random_state_obj = get_random_bases_state()
+    attempts = 0
+    max_attempts = requested_count * 200
+
+    while len(generated) < requested_count and attempts < max_attempts:
+        candidate = int(gmpy2.mpz_random(random_state_obj, n_mpz - 3) + mpz(2))
+        if candidate not in excluded_set:
+            excluded_set.add(candidate)
+            generated.append(candidate)
+        attempts += 1
+
+    return generated
+
+def is_random_base_mode(bases_input_str):
+    """
+    True when bases were selected as random count (empty input or single integer count).
+    False when user provided an explicit comma-separated list.
+    """
+    if not bases_input_str:
+        return True
+    if ',' in bases_input_str:
+        return False
+    try:
+        int(bases_input_str)
+        return True
+    except ValueError:
+        return False
+
+def should_run_mr_guard(random_mode, passed_count, plus_one_count, minus_one_count):
+    """
+    Run MR guard only on suspicious Euler-Jacobi profiles to limit overhead.
+    random_mode is True when the Euler-Jacobi bases were chosen at random.
+    """
+    if passed_count <= 0:
+        return False
+    if not random_mode:
+        return False
+    if passed_count < 4:
+        return True
+
+    dominant = max(plus_one_count, minus_one_count)
+    return dominant == passed_count or (dominant / passed_count) >= 0.90
+
+def abandon_running_tests(n_mpz):
+    """
+    Called once the answer is known while other bases are still running.
+    For large n the running exponentiations are stopped by terminating the
+    pool workers, since waiting for them would cost more than restarting the
+    pool; the caller then closes its result stream, which cancels the bases
+    that have not started.
+    """
+    if n_mpz.bit_length() >= TERMINATE_RUNNING_BITS:
+        worker_pool.terminate_pool()
+
+def run_euler_tests_parallel(n_mpz, bases_int_list, progress_bar_widget, root_widget, start_percentage, progress_callback=None, stop_on_failure=True):
+    """
+    Runs the Euler-Jacobi primality test in parallel for multiple bases, on
+    the worker pool backend worker_pool.select_backend() picks for n.
     n_mpz: The number to test (gmpy2.mpz).
     bases_int_list: A list of integer bases to test.
-    Updates a progress bar during execution.
-    Returns a list of (base, pass/fail) tuples.
+    Updates a progress bar (or calls progress_callback(percentage)) during execution.
+    Results are processed as they complete. With stop_on_failure, the first
+    base that fails (Euler-Jacobi mismatch or nontrivial gcd) proves n composite,
+    so the remaining bases are cancelled and the results so far are returned.
+    When prp_checkpoint.use_checkpoints(n) (opt-in), each base runs on the
+    checkpointed engine and the progress within the bases is shown as well.
+    While workers are connected to a coordinator, the bases run on them instead.
+    Returns a list of (base, pass/fail, residue_sign) tuples.
+    """
+    coordinator = distributed.active_coordinator()
+    if coordinator is not None:
+        def report(fraction):
+            current_progress = start_percentage + int(fraction * (PROGRESS_BAR_MAX - start_percentage))
+            if progress_callback:
+                progress_callback(current_progress)
+        try:
+            return distributed.run_bases(coordinator, "euler", n_mpz, [b for b in bases_int_list if 1 < b < n_mpz],
+                                         stop_on_failure, report)
+        except distributed.NoWorkers:
+            pass # Every worker left; run the bases on the local pool
+
+    # n is published once for all bases (a shared memory handle for large n)
+    with worker_pool.shared_operand(n_mpz) as n_shared:
+        if not prp_checkpoint.use_checkpoints(n_mpz):
+            return run_euler_tests_on_pool(n_mpz, n_shared, None, bases_int_list, progress_bar_widget, root_widget,
+                                           start_percentage, progress_callback, stop_on_failure)
+        prp_checkpoint.save_euler_bases(n_mpz, bases_int_list) # So that a rerun resumes the same bases
+        with worker_pool.progress_board(len(bases_int_list)) as board:
+            results = run_euler_tests_on_pool(n_mpz, n_shared, board, bases_int_list, progress_bar_widget,
+                                              root_widget, start_percentage, progress_callback, stop_on_failure)
+        prp_checkpoint.discard_euler_checkpoints(n_mpz, bases_int_list) # Left by abandoned bases
+        return results
+
+def run_euler_tests_on_pool(n_mpz, n_shared, board, bases_int_list, progress_bar_widget, root_widget,
+                            start_percentage, progress_callback, stop_on_failure):
+    """
+    Body of run_euler_tests_parallel; n_shared is what the tasks receive for n.
+    With a progress board, the bases run on prp_checkpoint.euler_test_checkpointed.
     """
     # Prepare arguments for the pool, ensuring bases are valid for the test with n_mpz
     args_for_pool = []
     for b_int in bases_int_list:
         if 1 < b_int < n_mpz: # Base must be > 1 and < n
-            # Further check: gcd(b_int, n_mpz) == 1 for Euler's criterion
-            # This is handled inside euler_test_single_base now, so we can pass it.
-            args_for_pool.append((n_mpz, mpz(b_int)))
-    
+            # Further check: gcd(b_int, n_mpz) is handled inside euler_test_single_base.
+            if board is None:
+                args_for_pool.append((n_shared, mpz(b_int)))
+            else:
+                args_for_pool.append((n_shared, mpz(b_int), board.slot(len(args_for_pool))))
+
     results_from_pool = []
-    if not args_for_pool: 
+    if not args_for_pool:
         # This can happen if n_mpz is very small (e.g., 3) and all default_bases are >= n_mpz
         # Or if the user_provided base is also unsuitable.
         # The check_prime function should handle very small n before calling this.
-        return results_from_pool 
-        
+        return results_from_pool
+
     num_bases = len(args_for_pool)
     bases_processed = 0
     progress_range = PROGRESS_BAR_MAX - start_percentage
-
-    with ProcessPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-        future_to_base_arg = {executor.submit(euler_test_single_base, arg_pair): arg_pair for arg_pair in args_for_pool}
-        
-        for future in concurrent.futures.as_completed(future_to_base_arg):
-            original_arg_pair = future_to_base_arg[future]
-            # base_tested_mpz = original_arg_pair[1] # This is the mpz version of the base
-            try:
-                result_tuple = future.result() # (int_base, bool_passed)
-                results_from_pool.append(result_tuple) 
-            except Exception as exc:
-                # print(f"Error in Euler test worker for base {int(base_tested_mpz)}: {exc}")
-                # If a worker process dies or has an unhandled error, record failure for that base.
-                results_from_pool.append((int(original_arg_pair[1]), False)) # Use the original base for reporting
-            
-            bases_processed += 1
-            if num_bases > 0:
-                 current_progress = start_percentage + int((bases_processed / num_bases) * progress_range)
-                 if progress_bar_widget:
-                     progress_bar_widget['value'] = current_progress
-            if root_widget:
-                 root_widget.update_idletasks()
+    finished_slots = set()
+
+    def show_progress():
+        bases_done = bases_processed
+        if board is not None and bases_processed < num_bases:
+            # Add the part of the running bases done so far
+            bases_done += sum(fraction for slot, fraction in enumerate(board.fractions()[:num_bases])
+                              if slot not in finished_slots)
+        current_progress = start_percentage + int((bases_done / num_bases) * progress_range)
+        if progress_bar_widget:
+            progress_bar_widget['value'] = current_progress
+        if progress_callback:
+            progress_callback(current_progress)
+
+    # Reuse the shared, long-lived worker pool instead of spawning a new one per test
+    # (or threads, or this thread, for operands too small to be worth a process)
+    backend = worker_pool.select_backend(n_mpz.bit_length())
+    if board is None:
+        results_stream = worker_pool.as_completed_results(euler_test_single_base, args_for_pool, backend=backend)
+    else:
+        results_stream = worker_pool.as_completed_results(prp_checkpoint.euler_test_checkpointed, args_for_pool,
+                                                          poll=show_progress, backend=backend)
+    for arg_pair, result_tuple, exc in results_stream:
+        if isinstance(exc, prp_checkpoint.GerbiczCheckFailed):
+            raise exc # An arithmetic error that would not go away; not evidence that n is composite
+        if exc is not None:
+            # The worker died (e.g. another request terminated the pool); rerun this base here
+            # rather than report a composite. An error that persists propagates from here.
+            if board is None:
+                result_tuple = euler_test_single_base((n_mpz, arg_pair[1]))
+            else:
+                result_tuple = prp_checkpoint.euler_test_checkpointed((n_mpz, arg_pair[1], None))
+        results_from_pool.append(result_tuple) # (int_base, bool_passed, residue_sign)
+
+        bases_processed += 1
+        if board is not None:
+            finished_slots.add(arg_pair[2][1])
+        if not result_tuple[1] and stop_on_failure and bases_processed < num_bases:
+            abandon_running_tests(n_mpz)
+            results_stream.close() # Cancels the bases that have not started yet
+            bases_processed = num_bases
+
+        show_progress()
+        if root_widget:
+             root_widget.update_idletasks()
+        if bases_processed == num_bases:
+            break
 
     return sorted(results_from_pool, key=lambda x: x[0])
 
+def run_euler_tests_serial(n_mpz, bases_int_list, stop_on_failure=True):
+    """
+    Same as run_euler_tests_parallel, but runs every base in the calling process.
+    Used where the caller is itself a pool worker (e.g. batch mode).
+    """
+    results = []
+    checkpointed = prp_checkpoint.use_checkpoints(n_mpz)
+    if checkpointed:
+        prp_checkpoint.save_euler_bases(n_mpz, bases_int_list)
+    for b_int in bases_int_list:
+        if 1 < b_int < n_mpz:
+            worker_pool.raise_if_cancelled() # E.g. the deadline of a prime_service.py request
+            if checkpointed:
+                results.append(prp_checkpoint.euler_test_checkpointed((n_mpz, mpz(b_int), None)))
+            else:
+                results.append(euler_test_single_base((n_mpz, mpz(b_int))))
+            if stop_on_failure and not results[-1][1]:
+                break
+    if checkpointed:
+        prp_checkpoint.discard_euler_checkpoints(n_mpz, bases_int_list)
+    return sorted(results, key=lambda x: x[0])
+
+def miller_rabin_task(args):
+    """Pool wrapper for miller_rabin_test_single_base: returns (base, passed)."""
+    n_mpz, a_mpz = args
+    return (int(a_mpz), miller_rabin_test_single_base(worker_pool.resolve_operand(n_mpz), a_mpz))
+
+def run_mr_guard(n_mpz, guard_bases, parallel=True):
+    """
+    Runs the Miller-Rabin guard bases (in parallel on the shared pool, or serially).
+    Returns the first base that proves n composite, or None if all bases pass.
+    As with the Euler-Jacobi bases, the remaining work is cancelled as soon
+    as one base fails.
+    """
+    if not parallel:
+        for b in guard_bases:
+            base, passed = miller_rabin_task((n_mpz, mpz(b)))
+            instrumentation.count("guard_bases_tested")
+            if not passed:
+                return base
+        return None
+
+    coordinator = distributed.active_coordinator()
+    if coordinator is not None:
+        try:
+            results = distributed.run_bases(coordinator, "miller_rabin", n_mpz, guard_bases)
+        except distributed.NoWorkers:
+            pass # Every worker left; run the bases on the local pool
+        else:
+            instrumentation.count("guard_bases_tested", len(results))
+            return next((base for base, passed in results if not passed), None)
+
+    with worker_pool.shared_operand(n_mpz) as n_shared:
+        args_list = [(n_shared, mpz(b)) for b in guard_bases]
+        results_stream = worker_pool.as_completed_results(miller_rabin_task, args_list,
+                                                          backend=worker_pool.select_backend(n_mpz.bit_length()))
+        for arg_pair, result_tuple, exc in results_stream:
+            instrumentation.count("guard_bases_tested")
+            if exc is not None:
+                result_tuple = miller_rabin_task((n_mpz, arg_pair[1])) # The worker died; rerun the base here
+            if not result_tuple[1]:
+                if len(args_list) > 1:
+                    abandon_running_tests(n_mpz)
+                results_stream.close()
+                return result_tuple[0]
+    return None
+
+def selfridge_parameters(n_mpz):
+    """
+    Selfridge's method A for the strong Lucas test: the first D in 5, -7, 9, -11, ...
+    with Jacobi(D/n) = -1, and P = 1, Q = (1 - D) / 4.
+    Only Jacobi symbols are computed, no exponentiations.
+    Returns (P, Q), or a nontrivial factor of n (int) if some D shares one with n.
+    n_mpz must be odd and not a perfect square (otherwise no such D exists).
+    """
+    D = 5
+    while True:
+        jacobi_symbol = gmpy2.jacobi(D, n_mpz)
+        if jacobi_symbol == -1:
+            return 1, (1 - D) // 4
+        if jacobi_symbol == 0 and abs(D) != n_mpz:
+            return int(gmpy2.gcd(abs(D), n_mpz))
+        D = -D - 2 if D > 0 else -D + 2
+
+def lucas_v_ladder(n_mpz, P, Q, k):
+    """
+    Returns (V_k, V_(k+1), Q^k) modulo n for the Lucas sequence V with parameters P, Q,
+    by a ladder over the bits of k (V_2j = V_j^2 - 2Q^j, V_(2j+1) = V_j V_(j+1) - P Q^j).
+    For Q = +-1, Q^j is kept as +-1, which saves a full-size product per bit.
+    """
+    v_low, v_high, q_power = mpz(2), mpz(P) % n_mpz, mpz(1)
+    small_q = Q in (1, -1)
+    for bit in bin(k)[2:]:
+        if bit == '1':
+            v_low = (v_low * v_high - P * q_power) % n_mpz
+            v_high = (v_high * v_high - 2 * q_power * Q) % n_mpz
+            q_power = q_power * q_power * Q
+        else:
+            v_high = (v_low * v_high - P * q_power) % n_mpz
+            v_low = (v_low * v_low - 2 * q_power) % n_mpz
+            q_power = q_power * q_power
+        if not small_q:
+            q_power %= n_mpz
+    return v_low, v_high, q_power % n_mpz
+
+def strong_lucas_test(n_mpz):
+    """
+    Strong Lucas probable-prime test with Selfridge parameters.
+    Writes n + 1 = d * 2^s with d odd; n passes if U_d = 0 or V_(d*2^r) = 0
+    (mod n) for some 0 <= r < s. U_d is recovered from the ladder's V_d and
+    V_(d+1) as (2 V_(d+1) - P V_d) / D.
+    Returns (passed, (P, Q), factor): factor is a nontrivial factor of n when
+    the parameter search found one (then passed is False and (P, Q) is None).
+    """
+    if gmpy2.is_square(n_mpz):
+        return False, None, int(gmpy2.isqrt(n_mpz))
+    parameters = selfridge_parameters(n_mpz)
+    if not isinstance(parameters, tuple):
+        return False, None, parameters
+    P, Q = parameters
+    D = P * P - 4 * Q
+    common_divisor = gmpy2.gcd(n_mpz, 2 * Q * D)
+    if common_divisor != 1:
+        return False, parameters, int(common_divisor) if common_divisor < n_mpz else None
+
+    d = n_mpz + 1
+    s = gmpy2.bit_scan1(d)
+    d >>= s
+    v, v_next, q_power = lucas_v_ladder(n_mpz, P, Q, d)
+    if (2 * v_next - P * v) * gmpy2.invert(D, n_mpz) % n_mpz == 0: # U_d == 0
+        return True, parameters, None
+    for _ in range(s):
+        if v == 0:
+            return True, parameters, None
+        v = (v * v - 2 * q_power) % n_mpz
+        q_power = q_power * q_power % n_mpz
+    return False, parameters, None
+
+def bpsw_task(args):
+    """
+    Pool wrapper for one half of the Baillie-PSW test.
+    args is (n_mpz, test) with test "strong_base_2" or "strong_lucas".
+    Returns (test, passed, lucas_parameters, factor).
+    """
+    n_mpz, test = args
+    n_mpz = worker_pool.resolve_operand(n_mpz)
+    if test == "strong_base_2":
+        return (test, miller_rabin_test_single_base(n_mpz, mpz(2)), None, None)
+    passed, parameters, factor = strong_lucas_test(n_mpz)
+    return (test, passed, parameters, factor)
+
+def run_bpsw(n_mpz, parallel=True, progress_callback=None):
+    """
+    Baillie-PSW test: a strong probable-prime test to base 2 plus a strong Lucas
+    test with Selfridge parameters (about three modular exponentiations of work;
+    no composite is known to pass both). With parallel=True both halves run at
+    once on the shared pool and the other half is abandoned as soon as one fails;
+    otherwise the cheaper base-2 test runs first.
+    progress_callback(fraction) is called after each half.
+    Returns (failed_test, lucas_parameters, factor): failed_test is None if n is
+    a BPSW probable prime, else "strong_base_2" or "strong_lucas".
+    """
+    tasks = [(n_mpz, "strong_base_2"), (n_mpz, "strong_lucas")]
+    lucas_parameters = None
+
+    if not parallel:
+        for done, task in enumerate(tasks, 1):
+            test, passed, parameters, factor = bpsw_task(task)
+            instrumentation.count("bpsw_tests")
+            lucas_parameters = parameters or lucas_parameters
+            if progress_callback:
+                progress_callback(done / len(tasks))
+            if not passed:
+                return test, lucas_parameters, factor
+        return None, lucas_parameters, None
+
+    with worker_pool.shared_operand(n_mpz) as n_shared:
+        results_stream = worker_pool.as_completed_results(bpsw_task, [(n_shared, test) for _, test in tasks],
+                                                          backend=worker_pool.select_backend(n_mpz.bit_length(),
+                                                                                             gil_bound=True))
+        done = 0
+        for task, result_tuple, exc in results_stream:
+            done += 1
+            if exc is not None:
+                # The worker died; rerun this half here rather than report a composite
+                result_tuple = bpsw_task((n_mpz, task[1]))
+            test, passed, parameters, factor = result_tuple
+            instrumentation.count("bpsw_tests")
+            lucas_parameters = parameters or lucas_parameters
+            if progress_callback:
+                progress_callback(done / len(tasks))
+            if not passed:
+                if done < len(tasks):
+                    abandon_running_tests(n_mpz)
+                results_stream.close()
+                return test, lucas_parameters, factor
+    return None, lucas_parameters, None
+
+def select_bases(n_mpz, bases):
+    """
+    Turns the bases argument of run_primality_pipeline into a list of bases.
+    bases is either a count of random bases or an explicit list of bases.
+    Falls back to small prime bases if nothing suitable could be generated.
+    """
+    if isinstance(bases, int):
+        # The bases of an interrupted checkpointed test, so that its checkpoints resume
+        selected = prp_checkpoint.resumable_bases(n_mpz, bases) or sorted(generate_random_guard_bases(n_mpz, bases))
+    else:
+        selected = [int(b) for b in bases]
+    if not selected and n_mpz > 3:
+        selected = [b for b in DEFAULT_SMALL_PRIME_BASES if b < n_mpz]
+    return selected
+
+def run_primality_pipeline(n_mpz, bases=DEFAULT_NUM_BASES, random_mode=None, parallel=True, progress_callback=None,
+                           mode="euler_jacobi", use_cache=True, shape=None):
+    """
+    Headless core of check_prime(): small number check, known prime lookup,
+    classical filter, then either the Euler-Jacobi bases and the Miller-Rabin
+    guard (mode "euler_jacobi") or the Baillie-PSW test (mode "bpsw").
+    Numbers of the form k*2^n+-1 with k < 2^n (Mersenne, Fermat, Proth and
+    Riesel numbers) get the deterministic test of special_forms.py instead,
+    in either mode; shape, the form parse_input_expression() reported for
+    the input, saves reading it from the bits of n.
+    bases is either a count of random bases or an explicit list of bases
+    (ignored in BPSW mode).
+    The MR guard only runs for random bases; random_mode overrides whether
+    an explicit list should be treated as randomly generated (as the GUI does).
+    parallel=False runs the probable-prime tests in the calling process.
+    progress_callback(percentage, message) is called between stages.
+    Verdicts for n >= IS_PRIME_THRESHOLD are looked up in and stored to the
+    verdict cache (verdict_cache.py), keyed on n, mode and bases (random bases
+    by their count); use_cache=False bypasses it.
+    Returns a verdict dict with the keys:
+      verdict           - "prime", "probable_prime", "composite" or "neither"
+      stage             - stage that decided the verdict ("small", "mersenne", "known_prime",
+                          "classical_filter", "mersenne_factoring", "special_form",
+                          "euler_jacobi", "mr_guard" or "bpsw")
+      witness           - base that proved compositeness, or None
+      failed_test       - in BPSW mode, the half that proved n composite
+                          ("strong_base_2" or "strong_lucas"), or None
+      lucas_parameters  - in BPSW mode, the Selfridge parameters (P, Q) used
+      factor            - nontrivial factor found, or None
+      bases             - Euler-Jacobi bases that passed
+      guard_bases       - Miller-Rabin guard bases that were run
+      mersenne_exponent - p when n is the known Mersenne prime M_p
+      known_form        - n as an expression when it is a tabulated prime, e.g. "2**127-1"
+      special_form      - the result of special_forms.prove_special_form() when that
+                          decided the verdict (test, parameter, form, k, e, c, expression),
+                          or of mersenne_factoring.find_mersenne_factor() (method, depth, bounds)
+      cached            - "memory" or "disk" if the verdict came from the cache, else None
+      timings           - seconds spent in each stage that ran
+    """
+    n_mpz = mpz(n_mpz)
+    if n_mpz <= 0:
+        raise ValueError("The number must be a positive integer greater than 0 for primality testing.")
+    if mode not in PRIMALITY_MODES:
+        raise ValueError(f"Unknown primality test mode '{mode}' (expected one of {', '.join(PRIMALITY_MODES)}).")
+
+    use_cache = use_cache and verdict_cache.ENABLED and n_mpz >= IS_PRIME_THRESHOLD
+    if mode == "bpsw":
+        cache_bases = None
+    elif random_mode and not isinstance(bases, int):
+        cache_bases = len(bases) # The GUI passes its random bases as a list
+    else:
+        cache_bases = bases
+    with instrumentation.start_trace("run_primality_pipeline"):
+        if use_cache:
+            with instrumentation.span("cache") as stage:
+                cached, tier = verdict_cache.lookup("verdict", n_mpz, mode, cache_bases)
+            if cached is not None:
+                cached.update(cached=tier, timings={"cache": stage.duration})
+                return cached
+
+        pipeline_start = time.perf_counter()
+        verdict = compute_primality_verdict(n_mpz, bases, random_mode, parallel, progress_callback, mode, shape)
+        if use_cache and time.perf_counter() - pipeline_start >= VERDICT_CACHE_MIN_SECONDS:
+            verdict_cache.store("verdict", n_mpz, verdict, mode, cache_bases)
+        return verdict
+
+def compute_primality_verdict(n_mpz, bases, random_mode, parallel, progress_callback, mode, shape=None):
+    """The stages of run_primality_pipeline(), without the cache."""
+    verdict = {
+        "verdict": None, "stage": None, "witness": None, "factor": None,
+        "bases": [], "guard_bases": [], "mersenne_exponent": None, "known_form": None,
+        "special_form": None, "failed_test": None, "lucas_parameters": None, "cached": None, "timings": {},
+    }
+    timings = verdict["timings"]
+
+    def report(percentage, message=None):
+        if progress_callback:
+            progress_callback(percentage, message)
+
+    if n_mpz == 1:
+        verdict.update(verdict="neither", stage="small")
+        return verdict
+
+    report(5)
+
+    # Step 0: Direct check with gmpy2.is_prime() for small numbers
+    if n_mpz < IS_PRIME_THRESHOLD:
+        with instrumentation.span("small") as stage:
+            verdict.update(verdict="prime" if gmpy2.is_prime(n_mpz) else "composite", stage="small")
+            for small_prime in (2, 3, 5, 7):
+                if n_mpz % small_prime == 0 and n_mpz > small_prime:
+                    verdict.update(verdict="composite", factor=small_prime)
+                    break
+        timings["small"] = stage.duration
+        return verdict
+
+    # Step 0.5: Check against the tables of known Mersenne (and other special-form) primes
+    with instrumentation.span("known_primes") as stage:
+        known = known_primes.identify_known_prime(n_mpz)
+    timings["known_primes"] = stage.duration
+    if known is not None:
+        verdict.update(verdict="prime" if known["proven"] else "probable_prime", known_form=known["expression"])
+        if known["form"] == "mersenne":
+            verdict.update(stage="mersenne", mersenne_exponent=known["parameter"])
+        else:
+            verdict.update(stage="known_prime")
+        return verdict
+    report(10)
+
+    # Step 0.75: k*2^n+-1 (Mersenne, Fermat, Proth, Riesel), from the typed expression or the bits of n
+    special_form = special_forms.detect_special_form(n_mpz, shape)
+
+    # Step 1: Classical Filter (for Mersenne numbers with a prime exponent p, whose divisors
+    # are all 2kp+1, trial factoring over those and P-1 instead)
+    if special_form is not None and special_form["form"] == "mersenne" and gmpy2.is_prime(special_form["e"]):
+        report(10, f"Trial factoring {special_form['expression']}...")
+        with instrumentation.span("mersenne_factoring") as stage:
+            factoring = mersenne_factoring.find_mersenne_factor(
+                special_form["e"], parallel=parallel, progress_callback=lambda fraction: report(10 + int(fraction * 10)))
+        timings["mersenne_factoring"] = stage.duration
+        if factoring["factor"] is not None:
+            verdict.update(verdict="composite", stage="mersenne_factoring", factor=factoring["factor"],
+                           special_form=dict(special_form, **factoring))
+            return verdict
+    else:
+        with instrumentation.span("classical_filter") as stage:
+            divisor = classical_filter_divisor(n_mpz)
+        timings["classical_filter"] = stage.duration
+        if divisor is not None:
+            verdict.update(verdict="composite", stage="classical_filter", factor=int(divisor))
+            return verdict
+    report(25)
+
+    # Step 2 (special forms): Lucas-Lehmer, Pepin, Proth or Lucas-Lehmer-Riesel proves the verdict
+    if special_form is not None:
+        report(25, f"Testing {special_form['expression']} with a deterministic test for its form...")
+        with instrumentation.span("special_form") as stage:
+            result = special_forms.prove_special_form(
+                n_mpz, special_form, progress_callback=lambda fraction: report(25 + int(fraction * 75)))
+        timings["special_form"] = stage.duration
+        if result is not None:
+            verdict.update(verdict="prime" if result["prime"] else "composite", stage="special_form",
+                           special_form=result, factor=result["factor"])
+            return verdict
+
+    # Step 2 (BPSW mode): strong base-2 test + strong Lucas-Selfridge test
+    if mode == "bpsw":
+        report(25, "Testing with Baillie-PSW (strong base 2 + strong Lucas)...")
+        with instrumentation.span("bpsw") as stage:
+            failed_test, lucas_parameters, factor = run_bpsw(
+                n_mpz, parallel, progress_callback=lambda fraction: report(25 + int(fraction * 75)))
+        timings["bpsw"] = stage.duration
+        verdict.update(stage="bpsw", failed_test=failed_test, lucas_parameters=lucas_parameters, factor=factor)
+        if failed_test is None:
+            verdict["verdict"] = "probable_prime"
+        else:
+            verdict.update(verdict="composite", witness=2 if failed_test == "strong_base_2" else None)
+        return verdict
+
+    # Step 2: Euler-Jacobi probabilistic primality test
+    if random_mode is None:
+        random_mode = isinstance(bases, int)
+    selected_bases = select_bases(n_mpz, bases)
+    if not selected_bases:
+        raise ValueError("No suitable bases were provided or could be determined.")
+    report(25, f"Testing with Euler-Jacobi using bases: {selected_bases}...")
+
+    with instrumentation.span("euler_jacobi") as stage:
+        if parallel:
+            euler_results = run_euler_tests_parallel(n_mpz, selected_bases, None, None, 25,
+                                                     progress_callback=lambda percentage: report(percentage))
+        else:
+            euler_results = run_euler_tests_serial(n_mpz, selected_bases)
+    timings["euler_jacobi"] = stage.duration
+    instrumentation.count("bases_tested", len(euler_results))
+
+    plus_one_count = 0
+    minus_one_count = 0
+    for base, passed_test, residue_sign in euler_results:
+        if not passed_test:
+            # Either Euler's criterion failed or gcd(base, n) != 1; both prove n composite
+            common_divisor = gmpy2.gcd(mpz(base), n_mpz)
+            factor = int(common_divisor) if 1 < common_divisor < n_mpz else None
+            verdict.update(verdict="composite", stage="euler_jacobi", witness=base, factor=factor)
+            return verdict
+        verdict["bases"].append(base)
+        if residue_sign == 1:
+            plus_one_count += 1
+        elif residue_sign == -1:
+            minus_one_count += 1
+
+    # Step 3: Miller-Rabin guard for suspicious Euler-Jacobi profiles
+    if should_run_mr_guard(random_mode, len(verdict["bases"]), plus_one_count, minus_one_count):
+        with instrumentation.span("mr_guard") as stage:
+            guard_bases = generate_random_guard_bases(n_mpz, MR_GUARD_BASES, selected_bases)
+            verdict["guard_bases"] = guard_bases
+            failed_guard_base = run_mr_guard(n_mpz, guard_bases, parallel)
+        timings["mr_guard"] = stage.duration
+        if failed_guard_base is not None:
+            verdict.update(verdict="composite", stage="mr_guard", witness=failed_guard_base)
+            return verdict
+
+    verdict.update(verdict="probable_prime", stage="mr_guard" if verdict["guard_bases"] else "euler_jacobi")
+    return verdict
+
+def format_verdict_text(n_mpz, verdict, random_mode, total_time):
+    """
+    Formats a verdict from run_primality_pipeline as the text shown in the result area,
+    noting when it came from the verdict cache.
+    """
+    text = format_verdict_body(n_mpz, verdict, random_mode, total_time)
+    if verdict.get("cached"):
+        text += f"\n(Verdict from the {verdict['cached']} cache.)"
+    return text
+
+def format_verdict_body(n_mpz, verdict, random_mode, total_time):
+    """The text of format_verdict_text() without the cache note."""
+    stage = verdict["stage"]
+    if verdict["verdict"] == "neither":
+        return "1 is neither prime nor composite (by definition)."
+    if stage == "small":
+        result_str = verdict["verdict"]
+        if verdict["factor"] is not None:
+            result_str = f"composite, divisible by {verdict['factor']}"
+        return f"The number is {result_str}.\n(Verified by gmpy2.is_prime() in {total_time:.4f} seconds)"
+    if stage == "mersenne":
+        return f"{n_mpz} is a known Mersenne Prime (M{verdict['mersenne_exponent']}).\n(Verified in {total_time:.4f} seconds)"
+    if stage == "known_prime":
+        kind = "a known prime" if verdict["verdict"] == "prime" else "a known probable prime"
+        return f"{n_mpz} is {kind} ({verdict['known_form']}).\n(Verified in {total_time:.4f} seconds)"
+    if stage == "classical_filter":
+        return f"Number is composite, divisible by {verdict['factor']}.\n(Verified by classical filter in {total_time:.4f} seconds)"
+    if stage == "mersenne_factoring":
+        special = verdict["special_form"]
+        return (f"The number {special['expression']} is composite, divisible by {verdict['factor']}.\n"
+                f"(Found by {mersenne_factoring.describe_search(special)} in {total_time:.4f} seconds)")
+    if stage == "special_form":
+        special = verdict["special_form"]
+        test_name = special_forms.TEST_NAMES[special["test"]]
+        if special["parameter"] is not None:
+            test_name += f" with {'a' if special['c'] == 1 else 'P'}={special['parameter']}"
+        if verdict["verdict"] == "prime":
+            return f"The number {special['expression']} is prime (proven by the {test_name}).\nTested in {total_time:.4f} seconds."
+        if verdict["factor"] is not None:
+            return (f"The number {special['expression']} is composite, divisible by {verdict['factor']}.\n"
+                    f"(Found by the {test_name} in {total_time:.4f} seconds)")
+        return f"The number {special['expression']} is composite.\nFailed the {test_name}.\nTested in {total_time:.4f} seconds."
+
+    if stage == "bpsw":
+        if verdict["verdict"] == "composite":
+            failed = "strong probable-prime test to base 2" if verdict["failed_test"] == "strong_base_2" \
+                else f"strong Lucas test (P, Q = {verdict['lucas_parameters']})"
+            found = f" (found factor {verdict['factor']})" if verdict["factor"] is not None else ""
+            return f"The number is composite.\nFailed the {failed}{found}.\nTested in {total_time:.4f} seconds."
+        P, Q = verdict["lucas_parameters"]
+        return (
+            f"The number is likely prime (Baillie-PSW probable prime).\n"
+            f"Passed the strong test to base 2 and the strong Lucas test with P={P}, Q={Q}.\n"
+            f"Tested in {total_time:.4f} seconds."
+        )
+
+    if verdict["verdict"] == "composite":
+        if stage == "mr_guard":
+            return (
+                f"The number is composite.\n"
+                f"Failed Miller-Rabin guard for base {verdict['witness']} after passing Euler-Jacobi.\n"
+                f"Tested in {total_time:.4f} seconds."
+            )
+        if verdict["factor"] is not None:
+            return f"The number is composite.\nFailed Euler-Jacobi test for base {verdict['witness']} (found factor {verdict['factor']}).\nTested in {total_time:.4f} seconds."
+        return f"The number is composite.\nFailed Euler-Jacobi test for base {verdict['witness']}.\nTested in {total_time:.4f} seconds."
+
+    passed_bases = verdict["bases"]
+    guard_bases = verdict["guard_bases"]
+    MAX_BASES_TO_LIST_DETAIL = 7  # Max number of bases to show in a list explicitly
+    MAX_VALUE_OF_BASE_TO_LIST_DETAIL = 100000 # If any base is larger than this, summarize
+
+    # Summarize instead of listing when there are too many bases or any base is too large
+    if len(passed_bases) > MAX_BASES_TO_LIST_DETAIL or \
+       any(b > MAX_VALUE_OF_BASE_TO_LIST_DETAIL for b in passed_bases):
+        if random_mode:
+            bases_display_string_part = f"all {len(passed_bases)} randomly generated base(s)"
+        else:
+            bases_display_string_part = f"all {len(passed_bases)} specified/selected base(s)"
+    else: # List them if they are few and small
+        bases_display_string_part = f"bases: {passed_bases}"
+
+    guard_text = (
+        f" and {len(guard_bases)} Miller-Rabin guard base(s)"
+        if guard_bases else
+        " and no Miller-Rabin guard (profile not suspicious)"
+    )
+    return (
+        f"The number is likely prime "
+        f"(passed Euler-Jacobi for {bases_display_string_part}{guard_text}).\n"
+        f"Tested in {total_time:.4f} seconds."
+    )
+
 def parse_input_to_int(input_str):
     """
-    Parses an input string (number or mathematical expression) using sympy.
+    Parses an input string (number or mathematical expression) with expression_eval.
     Returns an integer or None on error (and shows a messagebox).
     """
     try:
-        number_expr = sympy.sympify(input_str)
-        if not number_expr.is_number:
-            messagebox.showerror("Input Error", f"Expression '{input_str}' did not evaluate to a number.")
-            return None
-        number_int = int(number_expr) 
+        number_int = int(evaluate_input_expression(input_str))
     except Exception as e:
         messagebox.showerror("Input Error", f"Could not parse '{input_str}'. Please insert a valid integer or mathematical expression.\nDetails: {e}")
         return None
@@ -216,7 +936,7 @@ def parse_input_to_int(input_str):
 def get_input(): 
     """
     Reads a number (or mathematical expression) from the text field
-    and attempts to parse it with sympy. Returns an integer or None on error.
+    and attempts to parse it. Returns an integer or None on error.
     """
     input_string = text_number.get("1.0", tk.END).strip()
     return parse_input_to_int(input_string)
@@ -263,6 +983,10 @@ def parse_bases_input(bases_input_str, n_mpz_for_random_generation):
 
     # Generate random bases if num_random_bases_to_generate is set
     if num_random_bases_to_generate > 0:
+        if n_mpz_for_random_generation is not None:
+            resumed_bases = prp_checkpoint.resumable_bases(n_mpz_for_random_generation, num_random_bases_to_generate)
+            if resumed_bases:
+                return resumed_bases # The bases of an interrupted checkpointed test, which resume
         if n_mpz_for_random_generation is None or n_mpz_for_random_generation <= 3:
             # Not enough range for random bases or n is too small for meaningful test with random bases
             # Fallback to a sensible default if possible, or indicate an issue.
@@ -304,7 +1028,7 @@ def parse_bases_input(bases_input_str, n_mpz_for_random_generation):
             MAX_GENERATION_ATTEMPTS = actual_bases_to_generate * 100 
 
             # Get the current random state object ONCE before the loop
-            current_random_state = gmpy2.random_state()
+            current_random_state = get_random_bases_state()
 
             while len(generated_bases_set) < actual_bases_to_generate and attempts < MAX_GENERATION_ATTEMPTS:
                 # Generate random base in [2, n-2]
@@ -343,238 +1067,166 @@ def parse_bases_input(bases_input_str, n_mpz_for_random_generation):
 
 def check_prime():
     """
-    Main function triggered by the 'Check Prime' button.
-    Obtains the number n, decides on the testing method, and displays the result.
+    Main function triggered by the 'Check Primality' button.
+    Reads and parses n on the Tk thread, then runs run_primality_pipeline() on
+    the background runner (gui_tasks.py), so the window stays responsive;
+    show_verdict() displays the result. Starting a test while another one
+    runs replaces it. Every stage is timed in the request's trace (see instrumentation.py).
+    """
+    trace = instrumentation.begin_trace("check_prime")
+    with instrumentation.activate_trace(trace):
+        request = prepare_check_prime()
+    if request is None:
+        instrumentation.finish_trace(trace)
+        return
+    runner.start(run_check_prime_request, trace, *request)
+
+def prepare_check_prime():
+    """
+    The part of check_prime() that runs on the Tk thread: reads the input,
+    answers direct Mersenne expressions, parses n and the bases.
+    Returns (n_mpz, shape, bases, mode, random_mode, start_time) for the background
+    test, or None if there is nothing to test (a message is already shown).
     """
     input_string_n = text_number.get("1.0", tk.END).strip()
 
     if not input_string_n:
-        return
+        return None
     if input_string_n == "0":
+        runner.cancel()
         root.quit()
-        return
+        return None
 
-    start_time_overall = time.time()
+    start_time_overall = time.perf_counter()
 
     # Update progress bar immediately for responsiveness
     if progress_bar:
         progress_bar['value'] = 0
     root.update_idletasks()
 
-    if check_direct_mersenne_expression(input_string_n, start_time_overall, root, progress_bar):
-        return
+    with instrumentation.span("mersenne_scan"):
+        if check_direct_mersenne_expression(input_string_n, start_time_overall, root, progress_bar):
+            runner.cancel() # The direct answer replaces a test still running
+            return None
 
-    n_mpz = parse_input_to_mpz(input_string_n) # Changed from parse_input_to_int to get mpz directly
+    with instrumentation.span("parse"):
+        n_mpz, shape = parse_input_to_mpz(input_string_n)
 
     if n_mpz is None:
         if progress_bar: progress_bar['value'] = 0
-        return # Error already shown by parse_input_to_mpz
+        return None # Error already shown by parse_input_to_mpz
 
     # Handle n=0, n=1, n=negative (already handled by parse_input_to_mpz if it returns None for these)
     # but if parse_input_to_mpz is lenient:
     if n_mpz <= 0:
         update_result_text(f"The number must be a positive integer greater than 0 for primality testing.")
         if progress_bar: progress_bar['value'] = 0
-        return
+        return None
     if n_mpz == 1:
         update_result_text("1 is neither prime nor composite (by definition).")
         if progress_bar: progress_bar['value'] = 0
-        return
-        
-    # Initial progress update
-    current_progress_val = 5
-    if progress_bar:
-        progress_bar['value'] = current_progress_val
-    root.update_idletasks()
-
-    # Step 0: Direct check with gmpy2.is_prime() for small numbers or as a quick path
-    # For very large numbers, is_prime() itself can be slow as it's deterministic.
-    # Let's use it for smaller numbers for speed and accuracy.
-    # Threshold can be adjusted. For numbers > IS_PRIME_THRESHOLD, use our probabilistic method.
-    IS_PRIME_THRESHOLD = 10**6 # Example threshold
-    
-    if n_mpz < IS_PRIME_THRESHOLD:
-        is_prime_gmpy_result = gmpy2.is_prime(n_mpz)
-        end_time_check = time.time()
-        result_str = "prime" if is_prime_gmpy_result else "composite"
-        method_str = "gmpy2.is_prime()"
-        if n_mpz == 2 or n_mpz == 3 or n_mpz == 5 or n_mpz == 7: # Smallest primes
-             result_str = "prime" # Ensure they are marked prime
-        elif n_mpz % 2 == 0 and n_mpz > 2:
-            result_str = "composite, divisible by 2"
-        elif n_mpz % 3 == 0 and n_mpz > 3:
-            result_str = "composite, divisible by 3"
-        elif n_mpz % 5 == 0 and n_mpz > 5:
-             result_str = "composite, divisible by 5"
-        elif n_mpz % 7 == 0 and n_mpz > 7:
-             result_str = "composite, divisible by 7"
-             
-        update_result_text(f"The number is {result_str}.\n(Verified by {method_str} in {end_time_check - start_time_overall:.4f} seconds)")
-        if progress_bar: progress_bar['value'] = PROGRESS_BAR_MAX
-        return
-
-    # Step 0.5: Check against known Mersenne primes by value (if not caught by direct expression)
-    if check_known_mersenne_primes(n_mpz, start_time_overall, root, progress_bar):
-        return
-        
-    current_progress_val = 10
-    if progress_bar: progress_bar['value'] = current_progress_val
-    root.update_idletasks()
-
-    # Step 1: Classical Filter
-    filter_result = classical_filter(n_mpz) # classical_filter expects mpz
-    if filter_result:
-        end_time_check = time.time()
-        update_result_text(f"{filter_result}.\n(Verified by classical filter in {end_time_check - start_time_overall:.4f} seconds)")
-        if progress_bar: progress_bar['value'] = PROGRESS_BAR_MAX
-        return
+        return None
 
-    current_progress_val = 25
-    if progress_bar: progress_bar['value'] = current_progress_val
-    root.update_idletasks()
-    
-    # Step 2: Parse bases for Euler Test
+    # Parse bases for the Euler-Jacobi test (only needed above the gmpy2.is_prime() threshold)
+    mode = test_mode.get()
     bases_input_str = entry_a.get().strip()
-    # Pass n_mpz to parse_bases_input for random generation range.
-    selected_bases_int_list = parse_bases_input(bases_input_str, n_mpz)
-
-    if selected_bases_int_list is None: # Error in parsing bases
-        if progress_bar: progress_bar['value'] = 0 # Reset progress
-        # Error message already shown by parse_bases_input
-        return
-
-    # If parse_bases_input returned empty (e.g. couldn't generate randoms for small n),
-    # and we still want to proceed, we might use a default set of small primes.
-    # This logic can be refined. For now, if it's empty, let's try small primes.
-    if not selected_bases_int_list and n_mpz > 3 : # n_mpz > 3 ensures there's at least base 2 to test
-        # Fallback to a few small prime bases if random generation failed or wasn't requested robustly for small n
-        # This ensures we at least try something if input was e.g. "1" random base for n=4
-        # Default small primes
-        default_small_primes_bases = [2, 3, 5, 7, 11, 13, 17]
-        # Filter them to be < n_mpz
-        selected_bases_int_list = [b for b in default_small_primes_bases if b < n_mpz]
-        if not selected_bases_int_list and n_mpz == mpz(3): # Special case for n=3, only base 2
-             selected_bases_int_list = [2]
-        elif not selected_bases_int_list and n_mpz > 3: # if all defaults are too large
-             # This case should be rare if n is reasonably large.
-             # If n is e.g. 5, [2,3] would be selected.
-             # If no bases can be selected, the test will effectively be skipped.
-             messagebox.showwarning("Bases Warning", f"Could not determine suitable bases for n={n_mpz}. Using defaults if possible, or no bases.")
-
-
-    if not selected_bases_int_list:
-        # This means no bases were specified, random generation failed/wasn't applicable, AND fallback defaults are also unsuitable (e.g. n is too small like 2)
-        # Or if n=3 and [2] was selected, this block is skipped.
-        # For n=2, it's already handled by is_prime or direct check.
-        # If we reach here with no bases for a larger n, it's an issue.
-        # However, gmpy2.is_prime likely caught n=2.
-        # If n=3, selected_bases_int_list should be [2].
-        # This block is more a safeguard.
-        if n_mpz > 2: # Only show warning if n is something that should have been testable
-             update_result_text(f"Could not perform Euler test as no suitable bases were provided or could be determined (e.g., number is too small for chosen/default bases, or random generation failed).")
-        # If n_mpz was 2, it's prime, already handled.
-        # If n_mpz was 1, also handled.
-        if progress_bar: progress_bar['value'] = 0
-        return
+    random_mode = is_random_base_mode(bases_input_str)
+    selected_bases_int_list = []
+    if n_mpz >= IS_PRIME_THRESHOLD and mode == "euler_jacobi":
+        # Pass n_mpz to parse_bases_input for random generation range.
+        with instrumentation.span("bases"):
+            selected_bases_int_list = parse_bases_input(bases_input_str, n_mpz)
+        if selected_bases_int_list is None: # Error in parsing bases
+            if progress_bar: progress_bar['value'] = 0 # Reset progress
+            # Error message already shown by parse_bases_input
+            return None
 
-    # Step 3: Euler Probabilistic Primality Test (Parallel)
-    update_result_text(f"Testing with Euler test using bases: {selected_bases_int_list}...")
-    root.update_idletasks()
+    update_result_text("Testing, please wait...")
+    return n_mpz, shape, selected_bases_int_list, mode, random_mode, start_time_overall
 
-    euler_results = run_euler_tests_parallel(n_mpz, selected_bases_int_list, progress_bar, root, current_progress_val)
+def run_check_prime_request(report, trace, n_mpz, shape, bases, mode, random_mode, start_time):
+    """
+    Runs on the background thread: the pipeline, inside the request's trace.
+    report(percentage, message) queues progress for the Tk thread.
+    Returns what show_verdict() needs.
+    """
+    try:
+        with instrumentation.activate_trace(trace):
+            verdict = run_primality_pipeline(n_mpz, bases, random_mode=random_mode, progress_callback=report, mode=mode,
+                                             shape=shape)
+    finally:
+        instrumentation.finish_trace(trace)
+    return n_mpz, verdict, random_mode, time.perf_counter() - start_time, trace
+
+def show_progress(percentage, message=None):
+    """Progress of the background test (called on the Tk thread, at most once per poll)."""
+    if progress_bar:
+        progress_bar['value'] = percentage
+    if message:
+        update_result_text(message)
+
+def show_verdict(result):
+    """Displays the result of a finished background test."""
+    n_mpz, verdict, random_mode, total_time, trace = result
+    result_text = format_verdict_text(n_mpz, verdict, random_mode, total_time)
+    if trace is not None:
+        result_text += f"\nStages: {trace.summary()}"
+    update_result_text(result_text)
+    if progress_bar: progress_bar['value'] = PROGRESS_BAR_MAX
 
-    end_time_overall = time.time()
-    total_time = end_time_overall - start_time_overall
+def show_test_error(error):
+    """Displays an exception raised by the background test."""
+    update_result_text(f"Could not perform the primality test: {error}")
+    if progress_bar: progress_bar['value'] = 0
 
-    all_passed = True
-    failed_bases = []
-    passed_bases = []
+def cancel_test():
+    """Triggered by the 'Cancel' button: stops the running test and its workers."""
+    if runner.is_running():
+        runner.cancel()
+        update_result_text("Test cancelled.")
+        if progress_bar: progress_bar['value'] = 0
 
-    for base, passed_test in euler_results:
-        if passed_test:
-            passed_bases.append(base)
-        else:
-            all_passed = False
-            failed_bases.append(base)
-            # If any base fails, n is definitely composite (if gcd(base,n)=1 was met in worker)
-            # Or the base was unsuitable (e.g. gcd(base,n)!=1), which also implies composite if base < n.
-            # The worker function euler_test_single_base returns (base, False) if gcd(a,n)!=1.
-            # So, a False here means either Euler's criterion failed OR gcd(a,n)!=1 was found.
-            # If gcd(a,n)!=1 and a < n, then n is composite.
-            
-            # Check if the failure was due to gcd(a,n) != 1
-            # We need to re-check gcd here as the worker doesn't explicitly return this info, only pass/fail.
-            # This is a bit redundant but useful for a more informative message.
-            # Alternatively, the worker could return a more detailed status.
-            factor_found_with_base = None
-            if mpz(base) < n_mpz : # only makes sense if base < n
-                common_divisor = gmpy2.gcd(mpz(base), n_mpz)
-                if common_divisor != 1:
-                    factor_found_with_base = common_divisor
-
-            if factor_found_with_base and factor_found_with_base != n_mpz : # Ensure factor is not n itself
-                update_result_text(f"The number is composite.\nFailed Euler test for base {base} (found factor {factor_found_with_base}).\nTested in {total_time:.4f} seconds.")
-            else:
-                update_result_text(f"The number is composite.\nFailed Euler test for base {base}.\nTested in {total_time:.4f} seconds.")
-            
-            if progress_bar: progress_bar['value'] = PROGRESS_BAR_MAX
-            return # Stop on first failure
+def set_busy(busy):
+    """Enables the Cancel button while a test runs."""
+    cancel_button.config(state="normal" if busy else "disabled")
 
-    if all_passed:
-        # If all selected bases passed the Euler test
-        if not euler_results: # Should not happen if selected_bases_int_list was not empty
-             update_result_text(f"No Euler tests were performed. Result inconclusive. (Time: {total_time:.4f}s)")
-        else:
-            update_result_text(f"The number is likely prime (passed Euler test for bases: {passed_bases}).\nTested in {total_time:.4f} seconds.")
-    
-    if progress_bar: progress_bar['value'] = PROGRESS_BAR_MAX
+def parse_input_expression(input_str):
+    """
+    Evaluates an input string (number or mathematical expression) directly
+    in gmpy2.mpz with the sandboxed evaluator in expression_eval.py
+    (operators + - * / // % ** ^, n!, n#, pow, factorial, primorial, fib).
+    Returns (n, shape), shape being the form of the expression reported by
+    expression_eval.parse_expression() (None for plain numbers).
+    Raises ValueError if the input is unsafe, too large or not an integer.
+    Used by parse_input_to_mpz() and by the headless batch mode.
+    """
+    input_str = input_str.strip()
+    # Try direct int conversion first for simple large numbers
+    if input_str.isdigit() or (input_str.startswith('-') and input_str[1:].isdigit()):
+        return mpz(input_str), None
+    return expression_eval.parse_expression(input_str)
 
+def evaluate_input_expression(input_str):
+    """The value of parse_input_expression(input_str)."""
+    return parse_input_expression(input_str)[0]
 
 def parse_input_to_mpz(input_str):
     """
-    Parses an input string (number or mathematical expression) using sympy
+    Parses an input string (number or mathematical expression)
     and converts it to a gmpy2.mpz object.
-    Returns an mpz object or None on error (and shows a messagebox).
+    Returns (n_mpz, shape) as parse_input_expression() does, or (None, None)
+    on error (and shows a messagebox).
     """
     try:
-        # Allow evaluation of expressions like 2**127-1
-        # For very large numbers from expressions, sympy might be slow or hit limits.
-        # We might need to be careful here.
-        # Using a timeout or direct gmpy2 parsing if possible for simple integers.
-        
-        # Try direct int conversion first for simple large numbers
-        try:
-            if input_str.isdigit() or (input_str.startswith('-') and input_str[1:].isdigit()):
-                 n_mpz = mpz(input_str)
-                 if n_mpz <= 0: # Primality typically for > 1
-                     messagebox.showerror("Input Error", f"Number {input_str} must be a positive integer greater than 1 for primality testing.")
-                     return None
-                 return n_mpz
-        except ValueError:
-            pass # Not a simple integer string, try sympy
-
-        # If not a simple integer string, try sympy for expressions
-        # Check for potential harmful expressions before sympify - basic check
-        if any(kw in input_str for kw in ['import', 'eval', 'exec', 'lambda', '__']):
-            messagebox.showerror("Input Error", "Input contains potentially unsafe expressions.")
-            return None
-
-        number_expr = sympy.sympify(input_str)
-        if not number_expr.is_number:
-            messagebox.showerror("Input Error", f"Expression '{input_str}' did not evaluate to a number.")
-            return None
-        
-        # Convert to string then to mpz to handle potentially huge numbers from sympy
-        n_mpz = mpz(str(number_expr))
-
-        if n_mpz <= 0: # Primality typically for > 1
-             messagebox.showerror("Input Error", f"Evaluated number {n_mpz} must be a positive integer greater than 1 for primality testing.")
-             return None
-        return n_mpz
-        
+        n_mpz, shape = parse_input_expression(input_str)
     except Exception as e:
-        messagebox.showerror("Input Error", f"Could not parse '{input_str}'. Please insert a valid integer or mathematical expression.\\nDetails: {e}")
-        return None
+        messagebox.showerror("Input Error", f"Could not parse '{input_str}'. Please insert a valid integer or mathematical expression.\nDetails: {e}")
+        return None, None
+
+    if n_mpz <= 0: # Primality typically for > 1
+        messagebox.showerror("Input Error", f"Evaluated number {n_mpz} must be a positive integer greater than 1 for primality testing.")
+        return None, None
+    return n_mpz, shape
 
 # -------------------  IMPROVED GUI DESIGN  -------------------
 
@@ -588,168 +1240,205 @@ def center_window(window, width=700, height=700):
     y = (screen_height - height) // 2
     window.geometry(f"{width}x{height}+{x}+{y}")
 
-# Create the main window
-root = tk.Tk()
-root.title("Prime Number Test")
-center_window(root, 750, 780)  # Slightly enlarged window for more space
-
-# --- Professional Look: Colors and Fonts ---
-BG_COLOR = "#2C3E50"         # Dark blue
-INPUT_BG_COLOR = "#34495E"   # Slightly lighter dark blue
-TEXT_COLOR = "#ECF0F1"       # Very light gray / almost white
-TITLE_TEXT_COLOR = "#FFFFFF"   # White
-BUTTON_BG_COLOR = "#E67E22"   # Orange
-BUTTON_FG_COLOR = "#FFFFFF"   # White
-BUTTON_ACTIVE_BG_COLOR = "#F39C12" # Lighter orange
-BORDER_COLOR = "#233140"      # Darker shade of blue for borders
-SCROLLBAR_BG_COLOR = "#34495E"
-
-root.configure(bg=BG_COLOR)
-
-# Fonts
-try:
-    # Attempt to use more modern fonts if available
-    TITLE_FONT = ("Segoe UI", 16, "bold")
-    LABELFRAME_TITLE_FONT = ("Segoe UI", 13, "bold") # New font for LabelFrame titles
-    LABEL_FONT = ("Segoe UI", 12)
-    INSTRUCTION_TEXT_FONT = ("Segoe UI", 10)      # Smaller font for instruction text
-    BUTTON_FONT = ("Segoe UI", 13, "bold")
-    RESULT_FONT = ("Segoe UI", 12)
-except tk.TclError:
-    # Fallback to Helvetica if preferred fonts are not available
-    TITLE_FONT = ("Helvetica", 14, "bold") 
-    LABELFRAME_TITLE_FONT = ("Helvetica", 12, "bold") # New font for LabelFrame titles
-    LABEL_FONT = ("Helvetica", 11)         
-    INSTRUCTION_TEXT_FONT = ("Helvetica", 9)       # Smaller font for instruction text
-    BUTTON_FONT = ("Helvetica", 12, "bold")
-    RESULT_FONT = ("Helvetica", 11)        
-
-# Label frame for instructions
-instructions_frame = tk.LabelFrame(
-    root, text="Instructions", bg=BG_COLOR, fg=TITLE_TEXT_COLOR,
-    font=LABELFRAME_TITLE_FONT, bd=2, relief="solid", borderwidth=1, highlightbackground=BORDER_COLOR # Used new font
-)
-instructions_frame.pack(fill="x", padx=20, pady=(15,5)) # Slightly adjusted padding
-
-instruction_text = (
-    "This program uses sympy.isprime for numbers less than 10^20.\n"
-    "For larger numbers, it first applies a classical filter (trial division by small primes\n"
-    "and numbers of the form 6k±1). If the number passes this filter, an Euler-based test (a^((N-1)/2) % N == ±1) \n"
-    "is then used with multiple bases.\n\n"
-    "A 'likely prime' result from the Euler-based test indicates a high probability\n"
-    "that the number is prime.\n\n"
-    "Pseudoprimes are non-genuine primes. For enhanced results, several bases (e.g., 2, 3, 5, 7, 11, 13)\n"
-    "will be tested concurrently using multiprocessing.\n\n"
-    "Note: You can also input mathematical expressions. Example: 2**13-1, 15!-1\n"    
-)
-
-instructions_label = tk.Label(
-    instructions_frame, text=instruction_text, bg=BG_COLOR, fg=TEXT_COLOR,
-    font=INSTRUCTION_TEXT_FONT, justify="left", wraplength=680 # Used new smaller font
-)
-instructions_label.pack(padx=15, pady=(5,10)) # Slightly adjusted padding
-
-# Frame for input fields
-input_frame = tk.Frame(root, bg=BG_COLOR)
-input_frame.pack(padx=20, pady=10, fill="x")
-
-# Input Number + Scrollbar
-tk.Label(
-    input_frame, text="Enter the number (or expression):", bg=BG_COLOR, fg=TEXT_COLOR,
-    font=LABEL_FONT
-).grid(row=0, column=0, sticky="w", padx=5, pady=(5,0))
-
-# Frame for the text area and scrollbar
-text_area_frame = tk.Frame(input_frame, bg=INPUT_BG_COLOR, relief="solid", borderwidth=1, highlightthickness=1, highlightbackground=BORDER_COLOR)
-text_area_frame.grid(row=1, column=0, columnspan=2, padx=5, pady=(0,10), sticky="ew")
-
-text_number = tk.Text(
-    text_area_frame, height=3, width=38, bg=INPUT_BG_COLOR, fg=TITLE_TEXT_COLOR,
-    insertbackground=TITLE_TEXT_COLOR, font=LABEL_FONT, relief="flat", borderwidth=0, highlightthickness=0
-)
-text_number.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-
-scrollbar_y = tk.Scrollbar(text_area_frame, command=text_number.yview, relief="flat", bg=SCROLLBAR_BG_COLOR, troughcolor=INPUT_BG_COLOR, activerelief="flat")
-scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
-
-text_number.config(yscrollcommand=scrollbar_y.set)
-
-# Input Base 'a'
-tk.Label(
-    input_frame, text="Bases 'a' (e.g., 5 for 5 random bases, or 2,3,7 for specific bases):", bg=BG_COLOR, fg=TEXT_COLOR,
-    font=LABEL_FONT
-).grid(row=2, column=0, sticky="w", padx=5, pady=(5,0))
-
-entry_a = tk.Entry(
-    input_frame, width=60, bg=INPUT_BG_COLOR, fg=TITLE_TEXT_COLOR, # A bit wider
-    insertbackground=TITLE_TEXT_COLOR, font=LABEL_FONT, relief="solid", borderwidth=1, highlightthickness=1, highlightbackground=BORDER_COLOR
-)
-entry_a.insert(0, "5")
-entry_a.grid(row=3, column=0, padx=5, pady=(0,10), sticky="w")
-
-# Configure grid column weights for input_frame to make text_number and entry_a expandable if needed
-input_frame.grid_columnconfigure(0, weight=1)
-
-
-# Frame for the "Check Prime" button
-button_frame = tk.Frame(root, bg=BG_COLOR)
-button_frame.pack(pady=15)
-
-check_button = tk.Button(
-    button_frame, text="Check Primality", command=check_prime,
-    bg=BUTTON_BG_COLOR, fg=BUTTON_FG_COLOR, font=BUTTON_FONT, 
-    relief="raised", bd=2, padx=20, pady=5, # Larger button
-    activebackground=BUTTON_ACTIVE_BG_COLOR, activeforeground=BUTTON_FG_COLOR
-)
-check_button.pack()
-
-# Frame for the Progress Bar
-progress_frame = tk.Frame(root, bg=BG_COLOR)
-progress_frame.pack(fill="x", padx=20, pady=(5, 5)) # Smaller padding around the progress bar
-
-progress_bar = ttk.Progressbar(
-    progress_frame, 
-    orient="horizontal", 
-    length=300, 
-    mode='determinate'
-    # maximum will be set later if needed, default is 100
-)
-progress_bar.pack(fill="x", expand=True, padx=5, pady=5)
-
-# Label frame for results
-result_frame = tk.LabelFrame(
-    root, text="Result", bg=BG_COLOR, fg=TITLE_TEXT_COLOR,
-    font=LABELFRAME_TITLE_FONT, bd=2, relief="solid", borderwidth=1, highlightbackground=BORDER_COLOR # Use LabelFrame Title Font
-)
-result_frame.pack(fill="both", expand=True, padx=20, pady=(10,20)) # Larger padding
-
-# Make the result_frame's content area (where text area will go) expand
-result_frame.grid_rowconfigure(0, weight=1)
-result_frame.grid_columnconfigure(0, weight=1)
-
-# Create a Text widget for results with a Scrollbar
-result_text_area = tk.Text(
-    result_frame, 
-    wrap=tk.WORD, # Wrap text at word boundaries
-    bg=BG_COLOR, 
-    fg=TEXT_COLOR, 
-    font=RESULT_FONT,
-    relief="flat", # Flat relief to blend with the frame
-    borderwidth=0,
-    highlightthickness=0,
-    padx=10, # Padding inside the text area
-    pady=10
-)
-result_text_area.grid(row=0, column=0, sticky="nsew") # Use grid to place it
-
-result_scrollbar = ttk.Scrollbar( # Use ttk.Scrollbar for better styling
-    result_frame, 
-    orient="vertical", 
-    command=result_text_area.yview
-)
-result_scrollbar.grid(row=0, column=1, sticky="ns") # Place scrollbar next to text area
-
-result_text_area.config(yscrollcommand=result_scrollbar.set, state="disabled") # Link scrollbar and set initial state to disabled
+def build_gui():
+    """
+    Creates the main window and its widgets.
+    Only called when the script is started as the GUI, so the logic above
+    can be imported (e.g. by batch mode or worker processes) without a display.
+    """
+    global root, text_number, entry_a, test_mode, progress_bar, result_text_area, cancel_button, runner
+
+    # Create the main window
+    root = tk.Tk()
+    root.title("Prime Number Test")
+    center_window(root, 750, 780)  # Slightly enlarged window for more space
+
+    # --- Professional Look: Colors and Fonts ---
+    BG_COLOR = "#2C3E50"         # Dark blue
+    INPUT_BG_COLOR = "#34495E"   # Slightly lighter dark blue
+    TEXT_COLOR = "#ECF0F1"       # Very light gray / almost white
+    TITLE_TEXT_COLOR = "#FFFFFF"   # White
+    BUTTON_BG_COLOR = "#E67E22"   # Orange
+    BUTTON_FG_COLOR = "#FFFFFF"   # White
+    BUTTON_ACTIVE_BG_COLOR = "#F39C12" # Lighter orange
+    BORDER_COLOR = "#233140"      # Darker shade of blue for borders
+    SCROLLBAR_BG_COLOR = "#34495E"
+
+    root.configure(bg=BG_COLOR)
+
+    # Fonts
+    try:
+        # Attempt to use more modern fonts if available
+        TITLE_FONT = ("Segoe UI", 16, "bold")
+        LABELFRAME_TITLE_FONT = ("Segoe UI", 13, "bold") # New font for LabelFrame titles
+        LABEL_FONT = ("Segoe UI", 12)
+        INSTRUCTION_TEXT_FONT = ("Segoe UI", 10)      # Smaller font for instruction text
+        BUTTON_FONT = ("Segoe UI", 13, "bold")
+        RESULT_FONT = ("Segoe UI", 12)
+    except tk.TclError:
+        # Fallback to Helvetica if preferred fonts are not available
+        TITLE_FONT = ("Helvetica", 14, "bold") 
+        LABELFRAME_TITLE_FONT = ("Helvetica", 12, "bold") # New font for LabelFrame titles
+        LABEL_FONT = ("Helvetica", 11)         
+        INSTRUCTION_TEXT_FONT = ("Helvetica", 9)       # Smaller font for instruction text
+        BUTTON_FONT = ("Helvetica", 12, "bold")
+        RESULT_FONT = ("Helvetica", 11)        
+
+    # Label frame for instructions
+    instructions_frame = tk.LabelFrame(
+        root, text="Instructions", bg=BG_COLOR, fg=TITLE_TEXT_COLOR,
+        font=LABELFRAME_TITLE_FONT, bd=2, relief="solid", borderwidth=1, highlightbackground=BORDER_COLOR # Used new font
+    )
+    instructions_frame.pack(fill="x", padx=20, pady=(15,5)) # Slightly adjusted padding
+
+    instruction_text = (
+        "This program uses sympy.isprime for numbers less than 10^20.\n"
+        "For larger numbers, it first applies a classical filter (trial division by small primes\n"
+        "and numbers of the form 6k±1). If the number passes this filter, an Euler-Jacobi test is used\n"
+        "with multiple bases. A Miller-Rabin guard phase is triggered only for suspicious profiles.\n"
+        "Alternatively, the Baillie-PSW mode runs one strong base-2 test and one strong Lucas test.\n\n"
+        "A 'likely prime' result from these probabilistic tests indicates a high probability\n"
+        "that the number is prime.\n\n"
+        "Pseudoprimes are non-genuine primes. For enhanced results, several bases (e.g., 2, 3, 5, 7, 11, 13)\n"
+        "will be tested concurrently using multiprocessing.\n\n"
+        "Note: You can also input mathematical expressions. Example: 2**13-1, 15!-1\n"    
+    )
+
+    instructions_label = tk.Label(
+        instructions_frame, text=instruction_text, bg=BG_COLOR, fg=TEXT_COLOR,
+        font=INSTRUCTION_TEXT_FONT, justify="left", wraplength=680 # Used new smaller font
+    )
+    instructions_label.pack(padx=15, pady=(5,10)) # Slightly adjusted padding
+
+    # Frame for input fields
+    input_frame = tk.Frame(root, bg=BG_COLOR)
+    input_frame.pack(padx=20, pady=10, fill="x")
+
+    # Input Number + Scrollbar
+    tk.Label(
+        input_frame, text="Enter the number (or expression):", bg=BG_COLOR, fg=TEXT_COLOR,
+        font=LABEL_FONT
+    ).grid(row=0, column=0, sticky="w", padx=5, pady=(5,0))
+
+    # Frame for the text area and scrollbar
+    text_area_frame = tk.Frame(input_frame, bg=INPUT_BG_COLOR, relief="solid", borderwidth=1, highlightthickness=1, highlightbackground=BORDER_COLOR)
+    text_area_frame.grid(row=1, column=0, columnspan=2, padx=5, pady=(0,10), sticky="ew")
+
+    text_number = tk.Text(
+        text_area_frame, height=3, width=38, bg=INPUT_BG_COLOR, fg=TITLE_TEXT_COLOR,
+        insertbackground=TITLE_TEXT_COLOR, font=LABEL_FONT, relief="flat", borderwidth=0, highlightthickness=0
+    )
+    text_number.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+    scrollbar_y = tk.Scrollbar(text_area_frame, command=text_number.yview, relief="flat", bg=SCROLLBAR_BG_COLOR, troughcolor=INPUT_BG_COLOR, activerelief="flat")
+    scrollbar_y.pack(side=tk.RIGHT, fill=tk.Y)
+
+    text_number.config(yscrollcommand=scrollbar_y.set)
+
+    # Input Base 'a'
+    tk.Label(
+        input_frame, text="Bases 'a' (e.g., 5 for 5 random bases, or 2,3,7 for specific bases):", bg=BG_COLOR, fg=TEXT_COLOR,
+        font=LABEL_FONT
+    ).grid(row=2, column=0, sticky="w", padx=5, pady=(5,0))
+
+    entry_a = tk.Entry(
+        input_frame, width=60, bg=INPUT_BG_COLOR, fg=TITLE_TEXT_COLOR, # A bit wider
+        insertbackground=TITLE_TEXT_COLOR, font=LABEL_FONT, relief="solid", borderwidth=1, highlightthickness=1, highlightbackground=BORDER_COLOR
+    )
+    entry_a.insert(0, "5")
+    entry_a.grid(row=3, column=0, padx=5, pady=(0,10), sticky="w")
+
+    # Test mode: random/explicit Euler-Jacobi bases or Baillie-PSW (which ignores the bases field)
+    mode_frame = tk.Frame(input_frame, bg=BG_COLOR)
+    mode_frame.grid(row=4, column=0, padx=5, pady=(0,5), sticky="w")
+    test_mode = tk.StringVar(value="euler_jacobi")
+    for mode_value, mode_label in (("euler_jacobi", "Euler-Jacobi bases"), ("bpsw", "Baillie-PSW (bases not used)")):
+        tk.Radiobutton(
+            mode_frame, text=mode_label, variable=test_mode, value=mode_value,
+            bg=BG_COLOR, fg=TEXT_COLOR, selectcolor=INPUT_BG_COLOR, activebackground=BG_COLOR,
+            activeforeground=TEXT_COLOR, font=LABEL_FONT
+        ).pack(side=tk.LEFT, padx=(0, 15))
+
+    # Configure grid column weights for input_frame to make text_number and entry_a expandable if needed
+    input_frame.grid_columnconfigure(0, weight=1)
+
+
+    # Frame for the "Check Prime" button
+    button_frame = tk.Frame(root, bg=BG_COLOR)
+    button_frame.pack(pady=15)
+
+    check_button = tk.Button(
+        button_frame, text="Check Primality", command=check_prime,
+        bg=BUTTON_BG_COLOR, fg=BUTTON_FG_COLOR, font=BUTTON_FONT, 
+        relief="raised", bd=2, padx=20, pady=5, # Larger button
+        activebackground=BUTTON_ACTIVE_BG_COLOR, activeforeground=BUTTON_FG_COLOR
+    )
+    check_button.pack(side=tk.LEFT, padx=(0, 10))
+
+    cancel_button = tk.Button(
+        button_frame, text="Cancel", command=cancel_test, state="disabled",
+        bg=INPUT_BG_COLOR, fg=BUTTON_FG_COLOR, font=BUTTON_FONT,
+        relief="raised", bd=2, padx=20, pady=5,
+        activebackground=BORDER_COLOR, activeforeground=BUTTON_FG_COLOR
+    )
+    cancel_button.pack(side=tk.LEFT)
+
+    # Frame for the Progress Bar
+    progress_frame = tk.Frame(root, bg=BG_COLOR)
+    progress_frame.pack(fill="x", padx=20, pady=(5, 5)) # Smaller padding around the progress bar
+
+    progress_bar = ttk.Progressbar(
+        progress_frame, 
+        orient="horizontal", 
+        length=300, 
+        mode='determinate'
+        # maximum will be set later if needed, default is 100
+    )
+    progress_bar.pack(fill="x", expand=True, padx=5, pady=5)
+
+    # Label frame for results
+    result_frame = tk.LabelFrame(
+        root, text="Result", bg=BG_COLOR, fg=TITLE_TEXT_COLOR,
+        font=LABELFRAME_TITLE_FONT, bd=2, relief="solid", borderwidth=1, highlightbackground=BORDER_COLOR # Use LabelFrame Title Font
+    )
+    result_frame.pack(fill="both", expand=True, padx=20, pady=(10,20)) # Larger padding
+
+    # Make the result_frame's content area (where text area will go) expand
+    result_frame.grid_rowconfigure(0, weight=1)
+    result_frame.grid_columnconfigure(0, weight=1)
+
+    # Create a Text widget for results with a Scrollbar
+    result_text_area = tk.Text(
+        result_frame, 
+        wrap=tk.WORD, # Wrap text at word boundaries
+        bg=BG_COLOR, 
+        fg=TEXT_COLOR, 
+        font=RESULT_FONT,
+        relief="flat", # Flat relief to blend with the frame
+        borderwidth=0,
+        highlightthickness=0,
+        padx=10, # Padding inside the text area
+        pady=10
+    )
+    result_text_area.grid(row=0, column=0, sticky="nsew") # Use grid to place it
+
+    result_scrollbar = ttk.Scrollbar( # Use ttk.Scrollbar for better styling
+        result_frame, 
+        orient="vertical", 
+        command=result_text_area.yview
+    )
+    result_scrollbar.grid(row=0, column=1, sticky="ns") # Place scrollbar next to text area
+
+    result_text_area.config(yscrollcommand=result_scrollbar.set, state="disabled") # Link scrollbar and set initial state to disabled
+
+    # Tests run in the background; closing the window stops a running one
+    runner = gui_tasks.BackgroundRunner(root, show_progress, show_verdict, show_test_error, set_busy)
+
+    def close_window():
+        runner.cancel()
+        root.destroy()
+    root.protocol("WM_DELETE_WINDOW", close_window)
+
 
 # Helper function to update the result_text_area
 def update_result_text(new_text):
@@ -759,5 +1448,12 @@ def update_result_text(new_text):
     result_text_area.config(state="disabled")
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        import prime_batch
+        sys.exit(prime_batch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        import prime_service
+        sys.exit(prime_service.main(sys.argv[2:]))
+    build_gui()
     root.mainloop()
 # -------------------  END OF PRIME NUMBERS GUI  -------------------
@@ -0,0 +1,414 @@
+"""
+Local HTTP/JSON service for the primality test and the factorization engine.
+
+Endpoints (GET with query parameters, or POST with a JSON object body; large
+inputs should be POSTed, a request line is limited to 64 KB):
+    /is_prime?n=2**127-1[&mode=bpsw][&bases=5][&timeout=30]
+        -> the batch-mode verdict: {"bits", "verdict", "stage", "witness", "factor", "cached", "timings"}
+    /factor?n=...[&timeout=30]
+        -> {"bits", "factors": [[p, e], ...], "complete": true}; when the deadline
+           is too short for ECM, "complete": false and the unsplit "cofactors"
+    /next_prime?n=...
+        -> {"n_bits", "next_prime", "bits"} (see prime_generation.py)
+    /stats
+        -> queue depth, running computations, coalesced/rejected/timed-out counts
+           and per-endpoint latency percentiles (over the last LATENCY_WINDOW requests)
+n is a number or an expression (see expression_eval.py).
+
+The work runs on the shared worker pool (worker_pool.py), one request per
+worker (the pipeline itself runs serially inside the worker, as in batch
+mode). At most one computation per worker is submitted; up to --max-queue
+more wait for a free worker, and beyond that requests are rejected at once with
+503 and Retry-After, so a burst cannot grow the pool's queue without bound.
+Concurrent identical requests (same endpoint, input text and options) share
+one computation. Each request has a deadline (timeout, default
+DEFAULT_TIMEOUT seconds): when it passes the client gets 504. A computation
+that nobody waits for any more is dropped if it has not started yet; one that is
+already running gets the deadline too and stops at its next cancellation check
+(worker_pool.raise_if_cancelled(): between Euler-Jacobi bases, in the
+special-form squarings, between next-prime windows, ...), so a few huge
+requests cannot keep every worker busy. /factor passes the deadline on to the
+rho, ECM and quadratic sieve time limits.
+
+The server only listens on the loopback interface (127.0.0.1 by default).
+
+Usage:
+    python -m prime_numbers serve [--port 8765] [--workers N] [--max-queue 64]
+"""
+import argparse
+import asyncio
+import collections
+import ipaddress
+import json
+import time
+import urllib.parse
+from concurrent.futures.process import BrokenProcessPool
+
+import prime_batch
+import prime_generation
+import prime_numbers
+import worker_pool
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_QUEUE = 64 # Computations waiting for a free worker before requests are rejected
+DEFAULT_TIMEOUT = 30.0 # Seconds per request unless the request asks for another deadline
+MAX_TIMEOUT = 3600.0
+MAX_BODY_BYTES = 64 * 2**20
+LATENCY_WINDOW = 1000 # Latencies kept per endpoint for the /stats percentiles
+ENDPOINTS = ("/is_prime", "/factor", "/next_prime")
+FACTOR_RHO_SHARE = 0.1 # Part of a /factor deadline given to Pollard rho...
+FACTOR_ECM_SHARE = 0.3 # ...to ECM (the rest to the quadratic sieve)
+
+
+class RequestError(Exception):
+    """An error reported to the client with an HTTP status."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+# -------------------  WORKER TASKS  -------------------
+
+class Deadline:
+    """
+    Cancel event for worker_pool.cancellation() inside a worker task: it is
+    set once time.monotonic() reaches the request's deadline.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def is_set(self):
+        return time.monotonic() >= self.deadline
+
+
+def run_before_deadline(fn, deadline, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs), stopping it at its next cancellation check once
+    the deadline (a time.monotonic() value) has passed.
+    Returns fn's result, or {"timeout": True} if the deadline stopped it.
+    """
+    with worker_pool.cancellation(Deadline(deadline)):
+        try:
+            return fn(*args, **kwargs)
+        except worker_pool.TaskCancelled:
+            return {"timeout": True}
+
+
+def is_prime_task(args):
+    """Worker task for /is_prime: the batch-mode verdict of one input."""
+    text, bases, mode, deadline = args
+    result = run_before_deadline(prime_batch.test_candidate, deadline, (None, text, bases, mode, True))
+    result.pop("id", None)
+    return result
+
+
+def factor_task(args):
+    """Worker task for /factor, with the rho, ECM and SIQS time limits taken from the deadline."""
+    import factorization
+    import number_decomposition
+    text, deadline = args
+    try:
+        n = prime_numbers.evaluate_input_expression(text)
+    except Exception as e: # Same as prime_batch.test_candidate: any evaluator failure is a bad request
+        return {"error": str(e)}
+    if n < 1:
+        return {"error": "Only positive integers can be factored."}
+    time_limit = max(0.0, deadline - time.monotonic())
+    limits = dict(rho_time_limit=min(factorization.RHO_TIME_LIMIT, time_limit * FACTOR_RHO_SHARE),
+                  ecm_time_limit=min(factorization.ECM_TIME_LIMIT, time_limit * FACTOR_ECM_SHARE),
+                  siqs_time_limit=min(factorization.SIQS_TIME_LIMIT,
+                                      time_limit * (1 - FACTOR_RHO_SHARE - FACTOR_ECM_SHARE)))
+    try:
+        factors = number_decomposition.decompose_number(n, parallel=False, **limits)
+    except factorization.FactorizationIncomplete as e:
+        return {"bits": int(n.bit_length()), "factors": e.factors, "cofactors": e.cofactors, "complete": False}
+    return {"bits": int(n.bit_length()), "factors": factors, "complete": True}
+
+
+def next_prime_task(args):
+    """Worker task for /next_prime, stopped at the deadline."""
+    text, deadline = args
+    try:
+        n = prime_numbers.evaluate_input_expression(text)
+    except Exception as e:
+        return {"error": str(e)}
+    if n < 0:
+        return {"error": "n must not be negative."}
+    p = run_before_deadline(prime_generation.next_prime, deadline, n, parallel=False)
+    if isinstance(p, dict):
+        return p
+    return {"n_bits": int(n.bit_length()), "next_prime": int(p), "bits": int(p.bit_length())}
+
+
+# -------------------  SERVICE  -------------------
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def as_dict(self):
+        stats = {"count": self.count, "errors": self.errors, "timeouts": self.timeouts}
+        latencies = sorted(self.latencies)
+        if latencies:
+            for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+                stats[name] = latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+            stats["mean"] = sum(latencies) / len(latencies)
+        return stats
+
+
+class PrimeService:
+    """The request handling behind the HTTP server (one instance per event loop)."""
+
+    def __init__(self, max_queue=DEFAULT_MAX_QUEUE):
+        self.max_queue = max_queue
+        self.slots = asyncio.Semaphore(worker_pool.get_pool_size())
+        self.queued = 0
+        self.running = 0
+        self.in_flight = {} # key -> [task, number of requests waiting for it]
+        self.coalesced = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+        self.endpoint_stats = collections.defaultdict(EndpointStats)
+
+    async def compute(self, fn, args):
+        """Runs fn(args) on the worker pool once a worker is free (or rejects the request)."""
+        try:
+            return await self.admit(fn, args)
+        except BrokenProcessPool:
+            worker_pool.restart_pool() # A worker died; retry once on a fresh pool
+            return await self.admit(fn, args)
+
+    async def admit(self, fn, args):
+        """Waits for a free worker, or rejects the request if too many are waiting, then runs fn(args)."""
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise RequestError(503, "Too many requests are waiting; try again later.", {"Retry-After": "1"})
+        self.queued += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        return await self.run_on_worker(fn, args)
+
+    def run_on_worker(self, fn, args):
+        """
+        Submits fn(args) to the pool, holding the worker slot until the task has
+        finished: a cancelled request cannot stop a task its worker has already
+        started, so the slot stays taken until the worker is really free.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            future = worker_pool.submit(fn, args)
+        except BaseException:
+            self.release_slot()
+            raise
+
+        def release(_):
+            try:
+                loop.call_soon_threadsafe(self.release_slot)
+            except RuntimeError:
+                pass # The event loop is closed
+
+        future.add_done_callback(release)
+        return asyncio.wrap_future(future)
+
+    def release_slot(self):
+        self.running -= 1
+        self.slots.release()
+
+    async def coalesced_compute(self, key, fn, args, timeout):
+        """
+        Runs fn(args), or joins the identical computation already in flight.
+        Raises RequestError(504) after timeout seconds; the computation is
+        dropped when no request waits for it any more.
+        """
+        entry = self.in_flight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self.compute(fn, args))
+            entry = self.in_flight[key] = [task, 0]
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None) if self.in_flight.get(key) is entry else None)
+        else:
+            self.coalesced += 1
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(504, f"No result within the deadline of {timeout:g} seconds.") from None
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel() # Nobody is waiting; a computation still queued never starts
+                self.in_flight.pop(key, None)
+
+    async def handle(self, path, params):
+        """Returns the JSON-serializable response for one request, or raises RequestError."""
+        if path == "/stats":
+            return self.stats()
+        if path not in ENDPOINTS:
+            raise RequestError(404, f"Unknown endpoint {path}.")
+
+        text = str(params.get("n", "")).strip()
+        if not text:
+            raise RequestError(400, "Missing parameter n.")
+        try:
+            timeout = float(params.get("timeout", DEFAULT_TIMEOUT))
+        except ValueError:
+            raise RequestError(400, "timeout must be a number of seconds.") from None
+        if not 0 < timeout <= MAX_TIMEOUT:
+            raise RequestError(400, f"timeout must be between 0 and {MAX_TIMEOUT:g} seconds.")
+        text = "".join(text.split())
+        deadline = time.monotonic() + timeout
+
+        if path == "/is_prime":
+            mode = params.get("mode", "euler_jacobi")
+            if mode not in prime_numbers.PRIMALITY_MODES:
+                raise RequestError(400, f"mode must be one of {', '.join(prime_numbers.PRIMALITY_MODES)}.")
+            try:
+                bases = prime_batch.parse_bases_argument(str(params.get("bases", prime_numbers.DEFAULT_NUM_BASES)))
+            except (ValueError, argparse.ArgumentTypeError) as e:
+                raise RequestError(400, f"Invalid bases: {e}") from None
+            key = (path, text, mode, str(bases))
+            result = await self.coalesced_compute(key, is_prime_task, (text, bases, mode, deadline), timeout)
+        elif path == "/factor":
+            result = await self.coalesced_compute((path, text), factor_task, (text, deadline), timeout)
+        else:
+            result = await self.coalesced_compute((path, text), next_prime_task, (text, deadline), timeout)
+        if result.get("timeout"):
+            raise RequestError(504, "The computation was stopped at the deadline of the request it started for.")
+        if "error" in result:
+            raise RequestError(400, result["error"])
+        return result
+
+    def stats(self):
+        return {"uptime": time.monotonic() - self.started, "workers": worker_pool.get_pool_size(),
+                "running": self.running, "queued": self.queued, "max_queue": self.max_queue,
+                "in_flight": len(self.in_flight), "coalesced": self.coalesced, "rejected": self.rejected,
+                "endpoints": {path: stats.as_dict() for path, stats in sorted(self.endpoint_stats.items())}}
+
+    async def respond(self, method, target, body):
+        """Handles one HTTP request. Returns (status, headers, payload)."""
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(target)
+        stats = self.endpoint_stats[url.path] if url.path in ENDPOINTS else None
+        status, headers = 200, {}
+        try:
+            if method not in ("GET", "POST"):
+                raise RequestError(405, "Use GET or POST.", {"Allow": "GET, POST"})
+            params = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+            if body:
+                try:
+                    posted = json.loads(body)
+                except ValueError:
+                    raise RequestError(400, "The body must be a JSON object.") from None
+                if not isinstance(posted, dict):
+                    raise RequestError(400, "The body must be a JSON object.")
+                params.update(posted)
+            payload = await self.handle(url.path, params)
+        except RequestError as e:
+            status, headers, payload = e.status, e.headers, {"error": str(e)}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+        if stats is not None:
+            stats.count += 1
+            stats.errors += status != 200
+            stats.timeouts += status == 504
+            stats.latencies.append(time.perf_counter() - start)
+        return status, headers, payload
+
+    async def handle_connection(self, reader, writer):
+        """Serves HTTP/1.1 requests (with keep-alive) on one connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                request_headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    request_headers[name.strip().lower()] = value.strip()
+                length = int(request_headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self.write_response(writer, 413, {}, {"error": "Request body too large."}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = version == "HTTP/1.1" and request_headers.get("connection", "").lower() != "close"
+                status, headers, payload = await self.respond(method, target, body)
+                await self.write_response(writer, status, headers, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass # Malformed request or the client went away
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, status, headers, payload, keep_alive):
+        body = json.dumps(payload, default=int, separators=(",", ":")).encode()
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+                  504: "Gateway Timeout"}[status]
+        lines = [f"HTTP/1.1 {status} {reason}", "Content-Type: application/json",
+                 f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+async def start_server(host="127.0.0.1", port=DEFAULT_PORT, max_queue=DEFAULT_MAX_QUEUE):
+    """
+    Starts the service on host:port (port 0 picks a free port).
+    Returns (server, service); server.sockets[0].getsockname() gives the address.
+    """
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError(f"The service only listens on the loopback interface, not {host}.")
+    # With the fork start method every worker is forked on the first submission;
+    # do it before any connection is open, or the workers would inherit the
+    # client sockets and keep them open after the server closes them.
+    await asyncio.get_running_loop().run_in_executor(None, lambda: worker_pool.submit(int).result())
+    service = PrimeService(max_queue)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    return server, service
+
+
+async def serve(host, port, max_queue):
+    server, _ = await start_server(host, port, max_queue)
+    address = server.sockets[0].getsockname()
+    print(f"Serving on http://{address[0]}:{address[1]} with {worker_pool.get_pool_size()} workers", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m prime_numbers serve",
+        description="Serve /is_prime, /factor, /next_prime and /stats as JSON over HTTP on localhost.")
+    parser.add_argument("--host", default="127.0.0.1", help="loopback address to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="port (default: %(default)s, 0: any free port)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    parser.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE,
+                        help="computations waiting for a worker before requests get 503 (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    worker_pool.configure_pool(args.workers)
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_queue))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
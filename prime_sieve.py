@@ -0,0 +1,247 @@
+"""
+Segmented Sieve of Eratosthenes for enumerating all primes in [a, b].
+
+Testing every integer of an interval with check_prime() is hopeless, so this
+module sieves the interval instead. It uses the same wheel idea as
+classical_filter's 6k±1 candidates, widened to a mod-30 wheel: only the 8
+residues coprime to 30 (1, 7, 11, 13, 17, 19, 23, 29) are stored, one
+bytearray per residue, so a segment of 30*SEGMENT_ROWS integers takes
+8*SEGMENT_ROWS bytes. Multiples of each sieving prime p form a slice with
+step p in every residue array, so crossing off runs at C speed. Each
+residue array is sieved by all primes before moving on to the next one, so
+only one 1 MB array is being written at a time. (Smaller segments would fit
+a lower cache level, but the per-prime interpreter overhead then dominates.)
+
+Segments are independent and are farmed out to the shared worker pool with a
+bounded number in flight, so memory use does not depend on the interval length.
+
+When sqrt(b) exceeds MAX_SIEVING_PRIME (e.g. small windows near 10**18),
+sieving with every prime up to sqrt(b) would cost more than the window itself;
+the segment is then sieved up to MAX_SIEVING_PRIME and the survivors are
+confirmed with deterministic Miller-Rabin (below 3.3 * 10**24) or
+gmpy2.is_prime() above that.
+
+Usage:
+    python prime_sieve.py A B [--count] [--output FILE] [--workers N]
+A and B may be expressions such as 10**12 or 10**12+10**9.
+"""
+import argparse
+import collections
+import functools
+import itertools
+import math
+import sys
+
+import gmpy2
+
+import distributed
+import small_primes
+import worker_pool
+
+WHEEL = 30
+WHEEL_RESIDUES = (1, 7, 11, 13, 17, 19, 23, 29)
+SEGMENT_ROWS = 2**20 # Rows of 30 integers per segment (~31M integers): 8 residue arrays of 1 MB
+MAX_SIEVING_PRIME = 2**25 # Larger factors are ruled out by Miller-Rabin instead of sieving
+
+# Miller-Rabin with the first 13 prime bases is deterministic below this bound
+DETERMINISTIC_MR_LIMIT = 3317044064679887385961981
+DETERMINISTIC_MR_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+
+@functools.lru_cache(maxsize=2)
+def sieving_primes(limit):
+    """
+    Returns (primes, inverses): the primes 7 <= p <= limit and 30^-1 mod p for each.
+    Cached per process, so every worker computes them only once.
+    """
+    primes = small_primes.primes_up_to(limit)[3:] # 2, 3 and 5 are handled by the wheel
+    inverses = [pow(WHEEL, -1, p) for p in primes]
+    return primes, inverses
+
+
+def is_prime_verified(n):
+    """Deterministic Miller-Rabin below DETERMINISTIC_MR_LIMIT, gmpy2.is_prime() above it."""
+    if n < DETERMINISTIC_MR_LIMIT:
+        return all(gmpy2.is_strong_prp(n, a) for a in DETERMINISTIC_MR_BASES if a < n)
+    return gmpy2.is_prime(n)
+
+
+def sieve_flags(base, rows, hi):
+    """
+    Sieves the rows [base, base + 30*rows) of the wheel (base a multiple of 30)
+    with the primes 7 <= p <= min(sqrt(hi - 1), MAX_SIEVING_PRIME).
+    Returns one bytearray per residue in WHEEL_RESIDUES, where byte k is 1 if
+    base + 30k + residue survived. The primes themselves (and the number 1)
+    stay set.
+    """
+    prime_limit = min(math.isqrt(hi - 1), MAX_SIEVING_PRIME)
+    primes, inverses = sieving_primes(prime_limit)
+
+    # Sieve one residue array at a time, so the array being written stays in cache
+    active = [(p, inverse) for p, inverse in zip(primes, inverses) if p * p < hi]
+    flags = []
+    for residue in WHEEL_RESIDUES:
+        flag = bytearray(b"\x01") * rows
+        offset = base + residue
+        for p, inverse in active:
+            # Row k holds base + 30k + residue; it is a multiple of p when k = -(base + residue) / 30 mod p
+            k = (-offset * inverse) % p
+            value = offset + WHEEL * k
+            p_squared = p * p
+            if value < p_squared:
+                # Smaller multiples were already crossed off by smaller primes (and p itself stays)
+                k += -(-(p_squared - value) // (WHEEL * p)) * p
+            if k < rows:
+                flag[k::p] = bytes((rows - 1 - k) // p + 1)
+        flags.append(flag)
+    return flags
+
+
+def sieve_segment(args):
+    """
+    Worker task: sieves [lo, hi) with the mod-30 wheel.
+    Returns the sorted list of primes >= 7 in the segment, or only their count
+    if count_only is set.
+    """
+    lo, hi, count_only = args
+    base = lo - lo % WHEEL
+    rows = -(-(hi - base) // WHEEL)
+    needs_verification = MAX_SIEVING_PRIME < math.isqrt(hi - 1)
+    flags = sieve_flags(base, rows, hi)
+
+    if count_only and not needs_verification:
+        count = sum(flag.count(1) for flag in flags)
+        # Remove survivors outside [lo, hi) in the partial first and last rows (and the number 1)
+        for row in {0, rows - 1}:
+            for residue_index, residue in enumerate(WHEEL_RESIDUES):
+                value = base + WHEEL * row + residue
+                if flags[residue_index][row] and (value < lo or value >= hi or value == 1):
+                    count -= 1
+        return count
+
+    found = []
+    for residue_index, residue in enumerate(WHEEL_RESIDUES):
+        offset = base + residue
+        found.extend(offset + WHEEL * row for row in itertools.compress(range(rows), flags[residue_index]))
+    found = [value for value in found if lo <= value < hi and value != 1]
+    if needs_verification:
+        found = [value for value in found if is_prime_verified(value)]
+    if count_only:
+        return len(found)
+    found.sort()
+    return found
+
+
+def segment_bounds(a, b, segment_rows=SEGMENT_ROWS):
+    """Yields half-open (lo, hi) segments covering [a, b], aligned to multiples of 30."""
+    span = WHEEL * segment_rows
+    lo = a
+    while lo <= b:
+        hi = min(lo - lo % WHEEL + span, b + 1)
+        yield lo, hi
+        lo = hi
+
+
+def run_segments(a, b, count_only, segment_rows=SEGMENT_ROWS, window=None):
+    """
+    Sieves [a, b] segment by segment and yields each segment's result in order.
+    Segments run on the shared worker pool with at most `window` in flight;
+    a single segment (or a single worker) is sieved in the calling process.
+    While workers are connected to a coordinator, the segments run on them
+    instead, `window` segments (by default four per worker) to a job, until
+    the last of them disconnects.
+    """
+    # Primes below 7 are not on the wheel, see wheel_primes_in()
+    tasks = ((lo, hi, count_only) for lo, hi in segment_bounds(max(a, 7), b, segment_rows))
+    coordinator = distributed.active_coordinator()
+    if b - a < WHEEL * segment_rows or (coordinator is None and worker_pool.get_pool_size() == 1):
+        for task in tasks:
+            yield sieve_segment(task)
+        return
+
+    if coordinator is not None:
+        chunk_size = window or coordinator.worker_count() * 4
+        while True:
+            chunk = list(itertools.islice(tasks, chunk_size))
+            if not chunk:
+                return
+            try:
+                results = coordinator.run_job("sieve", None, chunk).results
+            except distributed.NoWorkers:
+                tasks = itertools.chain(chunk, tasks) # Every worker left; the local pool takes over
+                break
+            for index in range(len(chunk)):
+                yield results[index]
+
+    window = window or worker_pool.get_pool_size() * 2
+    in_flight = collections.deque()
+    for task in tasks:
+        in_flight.append(worker_pool.submit(sieve_segment, task))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def wheel_primes_in(a, b):
+    """The primes 2, 3 and 5 that the wheel skips, restricted to [a, b]."""
+    return [p for p in (2, 3, 5) if a <= p <= b]
+
+
+def primes_between(a, b, segment_rows=SEGMENT_ROWS):
+    """Generator over all primes p with a <= p <= b, in increasing order."""
+    yield from wheel_primes_in(a, b)
+    for segment_primes in run_segments(a, b, False, segment_rows):
+        yield from segment_primes
+
+
+def count_primes_between(a, b, segment_rows=SEGMENT_ROWS):
+    """Returns the number of primes p with a <= p <= b without listing them."""
+    return len(wheel_primes_in(a, b)) + sum(run_segments(a, b, True, segment_rows))
+
+
+def write_primes_between(a, b, path, segment_rows=SEGMENT_ROWS):
+    """
+    Writes all primes in [a, b] to path, one per line.
+    Returns the number of primes written.
+    """
+    written = 0
+    with open(path, "w") as out:
+        small = wheel_primes_in(a, b)
+        if small:
+            out.write("".join(f"{p}\n" for p in small))
+            written += len(small)
+        for segment_primes in run_segments(a, b, False, segment_rows):
+            out.write("".join(f"{p}\n" for p in segment_primes))
+            written += len(segment_primes)
+    return written
+
+
+def main(argv=None):
+    import prime_numbers
+
+    parser = argparse.ArgumentParser(description="List or count the primes in [A, B] with a segmented sieve.")
+    parser.add_argument("a", help="lower bound (integer or expression, e.g. 10**12)")
+    parser.add_argument("b", help="upper bound (integer or expression, e.g. 10**12+10**9)")
+    parser.add_argument("--count", action="store_true", help="only print the number of primes")
+    parser.add_argument("--output", help="write the primes to this file instead of stdout")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    args = parser.parse_args(argv)
+
+    a = int(prime_numbers.evaluate_input_expression(args.a))
+    b = int(prime_numbers.evaluate_input_expression(args.b))
+    worker_pool.configure_pool(args.workers)
+
+    if args.count:
+        print(count_primes_between(a, b))
+    elif args.output:
+        print(f"{write_primes_between(a, b, args.output)} primes written to {args.output}")
+    else:
+        for p in primes_between(a, b):
+            sys.stdout.write(f"{p}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
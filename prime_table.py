@@ -0,0 +1,330 @@
+"""
+Memory-mapped, bit-packed table of all primes up to a fixed bound.
+
+small_primes.primes_up_to() sieves its primes again in every process that
+asks for them, and a lookup like "is 3999999979 prime?" has nowhere to go
+but a probable-prime test. This module stores the primes once, in a file
+built by
+
+    python prime_table.py build --bound 2**32
+
+and maps it read-only with mmap, so opening it costs nothing and all
+processes (the GUIs, batch mode and every pool worker) share the same
+pages of the OS page cache.
+
+The file uses the mod-30 wheel of prime_sieve.py: byte k holds 8 bits, one
+for each of 30k + 1, 7, 11, 13, 17, 19, 23, 29, set when that number is
+prime (2, 3 and 5 are implied). The primes up to 2**32 take 143 MB.
+After the bits comes a rank index: for every RANK_BLOCK_BYTES bytes, the
+number of primes >= 7 before them, so pi(x) costs one index read and one
+popcount over at most a block, and the k-th prime a binary search in the
+index and a scan of one block.
+
+File layout (little-endian):
+    header  HEADER: magic, version, RANK_BLOCK_BYTES, bound, number of primes, data bytes
+    data    the wheel bytes for 0 <= n <= bound
+    ranks   one uint64 per started block of data, aligned to 8 bytes
+
+The file is looked up at PRIME_TABLE_PATH (default ~/.prime_numbers_primes.bin).
+Without one, everything falls back to sieving as before.
+
+Usage:
+    python prime_table.py [--table FILE] build [--bound 2**32] [--workers N]
+    python prime_table.py [--table FILE] info | count X | nth K
+"""
+import argparse
+import bisect
+import collections
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+import expression_eval
+import prime_sieve
+import worker_pool
+
+WHEEL = prime_sieve.WHEEL
+WHEEL_RESIDUES = prime_sieve.WHEEL_RESIDUES
+MAGIC = b"PRIMETBL"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQQQ")
+RANK_BLOCK_BYTES = 4096 # Data bytes (122880 integers) per rank index entry
+DEFAULT_BOUND = 2**32
+MAX_BOUND = prime_sieve.MAX_SIEVING_PRIME**2 # Above this, sieve_flags() no longer sieves completely
+TABLE_PATH = os.environ.get("PRIME_TABLE_PATH", os.path.join(os.path.expanduser("~"), ".prime_numbers_primes.bin"))
+
+# Bit of the residue n % 30 in its byte (0 for residues sharing a factor with 30)
+RESIDUE_BITS = tuple(1 << WHEEL_RESIDUES.index(r) if r in WHEEL_RESIDUES else 0 for r in range(WHEEL))
+# Bits of the residues <= r, for counting the primes of a byte up to 30k + r
+RESIDUE_BITS_UP_TO = tuple(sum(RESIDUE_BITS[:r + 1]) for r in range(WHEEL))
+BIT_COUNTS = bytes(bin(b).count("1") for b in range(256)) # Translation table: byte -> popcount
+BYTE_RESIDUES = tuple(tuple(r for i, r in enumerate(WHEEL_RESIDUES) if b >> i & 1) for b in range(256))
+
+_lock = threading.Lock()
+_table = None
+_table_loaded = False
+
+
+def count_bits(data):
+    """Number of set bits in a bytes-like object."""
+    return sum(bytes(data).translate(BIT_COUNTS))
+
+
+class PrimeTable:
+    """A prime table file mapped read-only. Raises ValueError if the file is not a prime table."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, block_bytes, self.bound, self.count, data_bytes = HEADER.unpack_from(self._map)
+        except struct.error:
+            raise ValueError(f"{path} is not a prime table.") from None
+        rank_start = ranks_offset(data_bytes)
+        rank_entries = -(-data_bytes // block_bytes) if block_bytes else 0
+        if (magic != MAGIC or version != VERSION or block_bytes != RANK_BLOCK_BYTES
+                or data_bytes != self.bound // WHEEL + 1 or len(self._map) != rank_start + 8 * rank_entries):
+            self._map.close()
+            raise ValueError(f"{path} is not a prime table of version {VERSION}.")
+        view = memoryview(self._map)
+        self._data = view[HEADER.size:HEADER.size + data_bytes]
+        self._ranks = view[rank_start:].cast("Q")
+
+    def __repr__(self):
+        return f"PrimeTable({self.path!r}, bound={self.bound}, count={self.count})"
+
+    def close(self):
+        self._data.release()
+        self._ranks.release()
+        self._map.close()
+
+    def covers(self, x):
+        """True if the table decides x, i.e. 0 <= x <= bound."""
+        return 0 <= x <= self.bound
+
+    def _check(self, x):
+        if not self.covers(x):
+            raise ValueError(f"{x} is outside the prime table (0 to {self.bound}).")
+
+    def is_prime_small(self, x):
+        """True if x is prime; x must be within the table."""
+        x = int(x)
+        self._check(x)
+        if x < 7:
+            return x in (2, 3, 5)
+        return bool(self._data[x // WHEEL] & RESIDUE_BITS[x % WHEEL])
+
+    def prime_count(self, x):
+        """pi(x), the number of primes <= x (rank); x must not exceed the bound."""
+        x = int(x)
+        if x < 2:
+            return 0
+        self._check(x)
+        row = x // WHEEL
+        block_start = row - row % RANK_BLOCK_BYTES
+        return (sum(1 for p in (2, 3, 5) if p <= x) + self._ranks[row // RANK_BLOCK_BYTES]
+                + count_bits(self._data[block_start:row])
+                + BIT_COUNTS[self._data[row] & RESIDUE_BITS_UP_TO[x % WHEEL]])
+
+    def nth_prime(self, k):
+        """The k-th prime, counting from nth_prime(1) == 2 (select)."""
+        k = int(k)
+        if not 1 <= k <= self.count:
+            raise ValueError(f"The table holds the primes 1 to {self.count}, not prime number {k}.")
+        if k <= 3:
+            return (2, 3, 5)[k - 1]
+        remaining = k - 3 # Position among the primes >= 7
+        block = bisect.bisect_left(self._ranks, remaining) - 1
+        remaining -= self._ranks[block]
+        start = block * RANK_BLOCK_BYTES
+        for row, byte in enumerate(self._data[start:start + RANK_BLOCK_BYTES], start):
+            if BIT_COUNTS[byte] >= remaining:
+                return WHEEL * row + BYTE_RESIDUES[byte][remaining - 1]
+            remaining -= BIT_COUNTS[byte]
+        raise AssertionError("The rank index of the prime table is inconsistent.")
+
+    def primes(self, start=0, stop=None):
+        """Generator over the primes p with start <= p <= stop (default: the bound), in increasing order."""
+        stop = self.bound if stop is None else min(int(stop), self.bound)
+        start = max(int(start), 0)
+        yield from (p for p in (2, 3, 5) if start <= p <= stop)
+        first_row = max(start, 7) // WHEEL
+        last_row = stop // WHEEL
+        for block_start in range(first_row, last_row + 1, RANK_BLOCK_BYTES):
+            block = self._data[block_start:min(block_start + RANK_BLOCK_BYTES, last_row + 1)]
+            found = [WHEEL * row + r for row, byte in enumerate(block, block_start) for r in BYTE_RESIDUES[byte]]
+            if block_start == first_row or block_start + RANK_BLOCK_BYTES > last_row:
+                found = [p for p in found if start <= p <= stop] # Partial rows at either end
+            yield from found
+
+    def primes_up_to(self, bound):
+        """An array of all primes <= bound, as small_primes.primes_up_to() returns it."""
+        self._check(bound)
+        return array("L", self.primes(0, bound))
+
+
+def ranks_offset(data_bytes):
+    """File offset of the rank index: after the header and the data, rounded up to 8 bytes."""
+    end = HEADER.size + data_bytes
+    return end + -end % 8
+
+
+def configure_table(path=None):
+    """Uses the prime table at path from now on (path="" disables it). Closes the table in use."""
+    global TABLE_PATH, _table, _table_loaded
+    import small_primes
+
+    with _lock:
+        if path is not None:
+            TABLE_PATH = path
+        if _table is not None:
+            _table.close()
+        _table = None
+        _table_loaded = False
+    small_primes.primes_up_to.cache_clear() # Its arrays may have come from the old table
+
+
+def get_table():
+    """The prime table at TABLE_PATH, mapped on first use; None if there is none (or it is not valid)."""
+    global _table, _table_loaded
+    with _lock:
+        if not _table_loaded:
+            _table_loaded = True
+            if TABLE_PATH and os.path.exists(TABLE_PATH):
+                try:
+                    _table = PrimeTable(TABLE_PATH)
+                except (OSError, ValueError):
+                    _table = None
+        return _table
+
+
+def covering_table(x):
+    """The prime table if there is one that reaches x, otherwise None."""
+    table = get_table()
+    if table is not None and table.covers(x):
+        return table
+    return None
+
+
+def is_prime_small(x):
+    """True if x is prime, looked up in the prime table. Raises ValueError if no table covers x."""
+    table = covering_table(x)
+    if table is None:
+        raise ValueError(f"No prime table covers {x}; build one with 'python prime_table.py build'.")
+    return table.is_prime_small(x)
+
+
+def pack_segment(args):
+    """
+    Worker task: the table bytes for the rows [first_row, first_row + rows) of
+    the wheel, none of them past bound.
+    """
+    first_row, rows, bound = args
+    base = WHEEL * first_row
+    flags = prime_sieve.sieve_flags(base, rows, min(base + WHEEL * rows, bound + 1))
+    # Each flag byte is 0 or 1, so shifting by the residue's bit never carries into the next byte
+    packed = 0
+    for bit, flag in enumerate(flags):
+        packed |= int.from_bytes(flag, "little") << bit
+    data = bytearray(packed.to_bytes(rows, "little"))
+    if first_row == 0:
+        data[0] &= ~RESIDUE_BITS[1] # 1 is not prime
+    if first_row + rows > bound // WHEEL:
+        data[-1] &= RESIDUE_BITS_UP_TO[bound % WHEEL]
+    return bytes(data)
+
+
+def build_table(path=None, bound=DEFAULT_BOUND, segment_rows=prime_sieve.SEGMENT_ROWS):
+    """
+    Sieves the primes up to bound into a new table file at path (default
+    TABLE_PATH), segment by segment on the worker pool, and replaces the old
+    file only once the new one is complete. Returns the number of primes.
+    """
+    path = path or TABLE_PATH
+    if not WHEEL <= bound <= MAX_BOUND:
+        raise ValueError(f"The bound must be between {WHEEL} and {MAX_BOUND}.")
+    if segment_rows % RANK_BLOCK_BYTES:
+        raise ValueError(f"segment_rows must be a multiple of {RANK_BLOCK_BYTES}.")
+    data_bytes = bound // WHEEL + 1
+    tasks = [(row, min(segment_rows, data_bytes - row), bound) for row in range(0, data_bytes, segment_rows)]
+    ranks = array("Q")
+    found = 0
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as out:
+        out.write(bytes(HEADER.size))
+        for segment in run_tasks(pack_segment, tasks):
+            for offset in range(0, len(segment), RANK_BLOCK_BYTES):
+                ranks.append(found)
+                found += count_bits(segment[offset:offset + RANK_BLOCK_BYTES])
+            out.write(segment)
+        out.write(bytes(ranks_offset(data_bytes) - HEADER.size - data_bytes))
+        if sys.byteorder != "little":
+            ranks.byteswap()
+        out.write(ranks.tobytes())
+        count = found + 3 # 2, 3 and 5
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, RANK_BLOCK_BYTES, bound, count, data_bytes))
+    os.replace(temporary, path)
+    if os.path.abspath(path) == os.path.abspath(TABLE_PATH):
+        configure_table()
+    return count
+
+
+def run_tasks(task, tasks):
+    """Runs task over tasks on the shared pool with a bounded window, yielding the results in order."""
+    if len(tasks) <= 1 or worker_pool.get_pool_size() == 1:
+        for args in tasks:
+            yield task(args)
+        return
+    in_flight = collections.deque()
+    for args in tasks:
+        in_flight.append(worker_pool.submit(task, args))
+        if len(in_flight) >= 2 * worker_pool.get_pool_size():
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the memory-mapped prime table.")
+    parser.add_argument("--table", default=None, help=f"table file (default: PRIME_TABLE_PATH or {TABLE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="sieve the primes up to a bound into a new table file")
+    build.add_argument("--bound", default=str(DEFAULT_BOUND), help="largest number covered (default: 2**32)")
+    build.add_argument("--workers", type=int, default=None,
+                       help="number of worker processes (default: PRIME_WORKERS or CPU count)")
+    commands.add_parser("info", help="print the bound and the number of primes of the table")
+    count = commands.add_parser("count", help="print pi(x)")
+    count.add_argument("x", help="integer or expression")
+    nth = commands.add_parser("nth", help="print the k-th prime")
+    nth.add_argument("k", help="integer or expression")
+    args = parser.parse_args(argv)
+
+    if args.table is not None:
+        configure_table(args.table)
+    if args.command == "build":
+        worker_pool.configure_pool(args.workers)
+        bound = int(expression_eval.evaluate_expression(args.bound))
+        count = build_table(TABLE_PATH, bound)
+        print(f"{count} primes up to {bound} written to {TABLE_PATH}")
+        return 0
+
+    table = get_table()
+    if table is None:
+        print(f"No prime table at {TABLE_PATH}; build one with 'python prime_table.py build'.", file=sys.stderr)
+        return 1
+    if args.command == "info":
+        print(f"{TABLE_PATH}: {table.count} primes up to {table.bound}")
+    elif args.command == "count":
+        print(table.prime_count(int(expression_eval.evaluate_expression(args.x))))
+    else:
+        print(table.nth_prime(int(expression_eval.evaluate_expression(args.k))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""
+Checkpointed, resumable modular exponentiation with a Gerbicz-Li error check,
+for the Euler-Jacobi test of very large candidates.
+
+gmpy2.powmod() on a number with tens of millions of bits runs for hours as one
+call: if the process dies, all of that work is lost, and a silent arithmetic
+error (bad RAM, an overheated core) goes unnoticed. checkpointed_powmod()
+computes a^e mod n itself, left to right over the exponent in blocks of
+block_bits bits (a fixed window of WINDOW_BITS bits inside each block):
+
+    x_0 = 1,   x_(j+1) = x_j^(2^B) * a^(c_j)      (c_j: the j-th B-bit chunk of e)
+
+Gerbicz-Li check: alongside x it keeps the product d_t = x_1 * ... * x_t
+(one extra multiplication per block). Since every step follows the recurrence,
+
+    d_t = d_(t-1)^(2^B) * a^(S_t),   S_t = c_0 + ... + c_(t-1)
+
+which costs about 2B squarings to verify. It is verified every check_blocks
+blocks and at the end; an error anywhere in x since the start breaks the
+identity. On a mismatch the state goes back to the last verified one and the
+blocks are computed again. With the defaults the checks add about 2%; the
+explicit squarings as a whole take about 1.3 to 1.4 times as long as one
+gmpy2.powmod() call, the price of being able to stop, resume and verify.
+
+The state is written to a checkpoint file every checkpoint_seconds (atomically,
+with a digest of its contents). The file holds the current state and the last
+verified one, so a restarted run resumes where the previous one stopped and
+still has a verified state to go back to. Checkpoints live in
+PRIME_CHECKPOINT_DIR (default ~/.prime_numbers_checkpoints) under a hash of
+(a, e, n) and are deleted once the result is known.
+
+The engine is opt-in: with PRIME_CHECKPOINT_BITS set, the Euler-Jacobi bases
+of n from that size on run on it (see use_checkpoints()), and the workers
+report their progress through a worker_pool.progress_board(). A checkpoint
+only resumes for the same base, so the bases of such a run are stored next
+to the checkpoints; a rerun that asks for as many random bases reuses them
+(resumable_bases()) instead of drawing new ones.
+
+Usage:
+    PRIME_CHECKPOINT_BITS=1000000 python -m prime_numbers batch candidates.txt
+"""
+import hashlib
+import json
+import os
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+import instrumentation
+import worker_pool
+
+CHECKPOINT_BITS = int(os.environ.get("PRIME_CHECKPOINT_BITS", 0)) # Opt-in: Euler-Jacobi bases of n this large use this engine (0: off)
+CHECKPOINT_DIR = os.environ.get("PRIME_CHECKPOINT_DIR",
+                                os.path.join(os.path.expanduser("~"), ".prime_numbers_checkpoints"))
+CHECKPOINT_SECONDS = 60.0 # Seconds between checkpoint writes
+GERBICZ_BLOCK_BITS = 100 # Exponent bits per block (a multiple of WINDOW_BITS)
+GERBICZ_CHECK_BLOCKS = 100 # Blocks between two Gerbicz-Li checks
+GERBICZ_MAX_FAILURES = 3 # Consecutive failed checks before giving up
+WINDOW_BITS = 4 # Fixed window: 4 squarings, then one multiplication by a table entry
+PROGRESS_INTERVAL = 0.5 # Seconds between progress reports
+CHECKPOINT_FORMAT = 1
+
+
+class GerbiczCheckFailed(ArithmeticError):
+    """Raised when the Gerbicz-Li check keeps failing after going back to the verified state."""
+
+
+def use_checkpoints(n):
+    """True if the Euler-Jacobi bases of n run on the checkpointed engine (PRIME_CHECKPOINT_BITS)."""
+    return CHECKPOINT_BITS > 0 and mpz(n).bit_length() >= CHECKPOINT_BITS
+
+
+def checkpoint_path(a, e, n):
+    """Checkpoint file of the computation a^e mod n."""
+    digest = hashlib.blake2b(digest_size=20)
+    for value in (a, e, n):
+        digest.update(gmpy2.to_binary(mpz(value)))
+    return os.path.join(CHECKPOINT_DIR, f"powmod_{digest.hexdigest()}.ckpt")
+
+
+def bases_path(n):
+    """File with the Euler-Jacobi bases of a checkpointed test of n."""
+    digest = hashlib.blake2b(gmpy2.to_binary(mpz(n)), digest_size=20)
+    return os.path.join(CHECKPOINT_DIR, f"bases_{digest.hexdigest()}.json")
+
+
+def save_euler_bases(n, bases):
+    """Records the bases a checkpointed test of n runs, so that a rerun can resume them."""
+    path = bases_path(n)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump([int(b) for b in bases], f)
+    os.replace(temporary, path)
+
+
+def resumable_bases(n, count):
+    """
+    The bases of an interrupted checkpointed test of n if it ran count bases,
+    else None; callers drawing count random bases for n use them instead.
+    """
+    if not use_checkpoints(n):
+        return None
+    try:
+        with open(bases_path(n)) as f:
+            bases = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(bases, list) or len(bases) != count or not all(isinstance(b, int) for b in bases):
+        return None
+    return bases
+
+
+def save_checkpoint(path, header, numbers):
+    """
+    Writes header (a JSON-serializable dict) and the numbers to path atomically:
+    a JSON line with the header, the byte length of each number and a digest,
+    then the numbers in gmpy2's binary format.
+    """
+    blobs = [gmpy2.to_binary(x) for x in numbers]
+    digest = hashlib.blake2b(digest_size=20)
+    for blob in blobs:
+        digest.update(blob)
+    header = dict(header, format=CHECKPOINT_FORMAT, lengths=[len(blob) for blob in blobs], digest=digest.hexdigest())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with instrumentation.span("checkpoint_write"):
+        with open(temporary, "wb") as f:
+            f.write(json.dumps(header, default=int).encode() + b"\n")
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+
+def load_checkpoint(path):
+    """Returns (header, numbers) from save_checkpoint(), or None if the file is missing or damaged."""
+    try:
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            blobs = [f.read(length) for length in header["lengths"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    digest = hashlib.blake2b(digest_size=20)
+    for blob in blobs:
+        digest.update(blob)
+    if header.get("format") != CHECKPOINT_FORMAT or digest.hexdigest() != header.get("digest"):
+        return None
+    return header, [gmpy2.from_binary(blob) for blob in blobs]
+
+
+def discard_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def checkpointed_powmod(a, e, n, path=None, block_bits=GERBICZ_BLOCK_BITS, check_blocks=GERBICZ_CHECK_BLOCKS,
+                        checkpoint_seconds=CHECKPOINT_SECONDS, progress_callback=None):
+    """
+    Returns a^e mod n (e >= 0, n odd), computed in verified blocks as described above.
+    path is the checkpoint file (default: checkpoint_path(a, e, n); "" disables
+    checkpoints). An existing checkpoint for the same computation is resumed.
+    progress_callback(fraction) is called at most every PROGRESS_INTERVAL seconds.
+    Raises GerbiczCheckFailed after GERBICZ_MAX_FAILURES failed checks in a row.
+    """
+    a, e, n = mpz(a) % n, mpz(e), mpz(n)
+    if block_bits <= 0 or block_bits % WINDOW_BITS:
+        raise ValueError(f"block_bits must be a positive multiple of {WINDOW_BITS}")
+    if path is None:
+        path = checkpoint_path(a, e, n)
+    total_blocks = max(1, -(-e.bit_length() // block_bits))
+    chunk_mask = (1 << block_bits) - 1
+    window_mask = (1 << WINDOW_BITS) - 1
+    table = [mpz(1)]
+    for _ in range(window_mask):
+        table.append(table[-1] * a % n)
+
+    # State after t blocks: x = x_t, d = d_t, chunk_sum = S_t
+    t, x, d, chunk_sum = 0, mpz(1), mpz(1), 0
+    saved = load_checkpoint(path) if path else None
+    if saved is not None and saved[0].get("block_bits") == block_bits and saved[0].get("t", 0) <= total_blocks:
+        header, numbers = saved
+        t, x, d = header["t"], numbers[0], numbers[1]
+        chunk_sum = header["chunk_sum"]
+        verified = (header["verified_t"], numbers[2], numbers[3], header["verified_chunk_sum"])
+        instrumentation.count("checkpoint_resumes")
+    else:
+        verified = (t, x, d, chunk_sum)
+
+    failures = 0
+    last_save = last_progress = time.monotonic()
+    d_previous = d
+    while True:
+        if t == total_blocks or (t - verified[0] >= check_blocks and t > 0):
+            # Gerbicz-Li check of the blocks since the last verified state
+            with instrumentation.span("gerbicz_check"):
+                expected = gmpy2.powmod(d_previous, 1 << block_bits, n) * gmpy2.powmod(a, chunk_sum, n) % n
+            if expected == d:
+                failures = 0
+                verified = (t, x, d, chunk_sum)
+                instrumentation.count("gerbicz_checks")
+            else:
+                failures += 1
+                instrumentation.count("gerbicz_failures")
+                if failures >= GERBICZ_MAX_FAILURES:
+                    raise GerbiczCheckFailed(f"Gerbicz check failed {failures} times in a row at block {t}")
+                t, x, d, chunk_sum = verified
+                continue
+            if t == total_blocks:
+                break
+
+        if path and time.monotonic() - last_save >= checkpoint_seconds:
+            save_checkpoint(path, {"block_bits": block_bits, "t": t, "chunk_sum": chunk_sum,
+                                   "verified_t": verified[0], "verified_chunk_sum": verified[3]},
+                            [x, d, verified[1], verified[2]])
+            last_save = time.monotonic()
+
+        # Block t: x <- x^(2^B) * a^c in windows of WINDOW_BITS bits
+        chunk = (e >> (block_bits * (total_blocks - 1 - t))) & chunk_mask
+        for shift in range(block_bits - WINDOW_BITS, -1, -WINDOW_BITS):
+            for _ in range(WINDOW_BITS):
+                x = x * x % n
+            digit = (chunk >> shift) & window_mask
+            if digit:
+                x = x * table[digit] % n
+        chunk_sum += chunk
+        d_previous = d
+        d = d * x % n
+        t += 1
+
+        if progress_callback and time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+            progress_callback(t / total_blocks)
+            last_progress = time.monotonic()
+
+    if path:
+        discard_checkpoint(path)
+    if progress_callback:
+        progress_callback(1.0)
+    return x
+
+
+def euler_test_checkpointed(args):
+    """
+    Worker task: the Euler-Jacobi test of n for base a, like
+    prime_numbers.euler_test_single_base, but with the exponentiation done by
+    checkpointed_powmod(). args is (n, a, progress): n may be a
+    worker_pool.SharedOperand handle, progress a worker_pool.progress_board()
+    slot (or None). Returns (base, passed_bool, residue_sign).
+    """
+    n_mpz, a_mpz, progress = args
+    n_mpz = worker_pool.resolve_operand(n_mpz)
+    if n_mpz <= 2 or n_mpz % 2 == 0 or not (1 < a_mpz < n_mpz) or gmpy2.gcd(a_mpz, n_mpz) != 1:
+        return (int(a_mpz), False, 0)
+    jacobi_symbol = gmpy2.jacobi(a_mpz, n_mpz)
+    if jacobi_symbol == 0:
+        return (int(a_mpz), False, 0)
+
+    report = (lambda fraction: worker_pool.report_progress(progress, fraction)) if progress is not None else None
+    x = checkpointed_powmod(a_mpz, (n_mpz - 1) // 2, n_mpz, progress_callback=report)
+    jacobi_mod_n = n_mpz - 1 if jacobi_symbol == -1 else mpz(jacobi_symbol)
+    residue_sign = 1 if x == 1 else (-1 if x == (n_mpz - 1) else 0)
+    return (int(a_mpz), x == jacobi_mod_n, residue_sign)
+
+
+def discard_euler_checkpoints(n_mpz, bases):
+    """
+    Deletes the checkpoints left by bases whose test was abandoned once the
+    verdict was known, and the record of the bases.
+    """
+    exponent = (mpz(n_mpz) - 1) // 2
+    for b in bases:
+        discard_checkpoint(checkpoint_path(mpz(b) % n_mpz, exponent, n_mpz))
+    discard_checkpoint(bases_path(n_mpz))
@@ -0,0 +1,533 @@
+"""
+Self-initialising quadratic sieve (SIQS) for composites of 24 to 100 digits.
+
+Pollard rho and ECM find a factor in time that grows with the factor, so
+they stall on balanced semiprimes; the quadratic sieve takes time that only
+depends on the size of n. factorization.factorize() hands it the composite
+cofactors of 24 to 100 digits (SIQS_MIN_DIGITS to SIQS_MAX_DIGITS there)
+once a short ECM run for small factors has failed.
+
+Outline (Contini's SIQS):
+  * A Knuth-Schroeppel multiplier k makes many small primes quadratic
+    residues of kN. The factor base holds -1, 2 and the primes p with
+    (kN/p) = 1 (or p | k), with sqrt(kN) mod p, as NumPy arrays.
+  * A polynomial leading coefficient A is a product of s factor base primes
+    near (sqrt(2kN)/M)^(1/s). Each A gives 2^(s-1) polynomials
+    g(x) = A x^2 + 2 B x + C with (Ax + B)^2 - kN = A g(x); switching from
+    one B to the next (Gray code) moves every sieve root by one precomputed
+    vector addition.
+  * g is sieved over [-M, M): the positions hit by every factor base prime
+    are generated as one index array and summed with np.bincount, weighted
+    by log2(p). Positions above the threshold are trial divided (by testing
+    x against the roots, for all primes and candidates at once) and kept if
+    the rest is 1 or a single large prime below LARGE_PRIME_MULTIPLIER times
+    the largest factor base prime. Partial relations with the same large
+    prime are combined.
+  * Every A is an independent task on the shared worker pool.
+  * The exponent vectors mod 2 are reduced by structured Gaussian
+    elimination (relations with a prime that no other relation has are
+    dropped, columns of weight 2 are merged away), and the rest are
+    eliminated as bit-packed uint64 rows. Each dependency gives a congruence
+    X^2 = Y^2 (mod n), and gcd(X - Y, n) a factor with probability 1/2.
+
+Requires NumPy (the rest of the factorization engine does not; without it
+factorize() skips this stage).
+"""
+import bisect
+import collections
+import concurrent.futures
+import functools
+import math
+import time
+
+import gmpy2
+import numpy as np
+from gmpy2 import mpz
+
+import instrumentation
+import small_primes
+import worker_pool
+
+LARGE_PRIME_MULTIPLIER = 128 # Large primes up to this times the largest factor base prime
+SIEVE_MIN_PRIME = 128 # Smaller primes are not sieved, only trial divided at the candidates
+EXTRA_RELATIONS = 64 # Relations beyond the number of columns before the linear algebra
+THRESHOLD_SLACK = 10.0 # Bits below the log of the largest value still worth trial dividing
+A_FACTOR_TARGET = 2000 # Preferred size of the primes whose product is A
+MULTIPLIERS = (1, 2, 3, 5, 6, 7, 10, 11, 13, 14, 15, 17, 19, 21, 22, 23, 26, 29, 30, 31, 33, 34, 35, 37, 38,
+               39, 41, 42, 43, 46, 47, 51, 53, 55, 57, 58, 59, 61, 62, 65, 66, 67, 69, 70, 71, 73)
+
+# (digits, factor base size, sieve half-width M); interpolated in between
+PARAMETERS = [
+    (30, 300, 32768),
+    (40, 900, 65536),
+    (50, 2200, 65536),
+    (60, 4500, 65536),
+    (70, 9000, 98304),
+    (80, 18000, 131072),
+    (90, 32000, 196608),
+    (100, 60000, 262144),
+]
+
+FactorBase = collections.namedtuple("FactorBase", "primes roots logs sieved")
+
+
+def parameters(digits):
+    """(factor base size, M) for n of the given number of digits."""
+    if digits <= PARAMETERS[0][0]:
+        return PARAMETERS[0][1:]
+    for (d0, f0, m0), (d1, f1, m1) in zip(PARAMETERS, PARAMETERS[1:]):
+        if digits <= d1:
+            t = (digits - d0) / (d1 - d0)
+            return int(f0 + t * (f1 - f0)), int(m0 + t * (m1 - m0)) // 2048 * 2048
+    return PARAMETERS[-1][1:]
+
+
+def knuth_schroeppel(n):
+    """The multiplier k in MULTIPLIERS that maximises the expected contribution of small primes to kn."""
+    best, best_score = 1, None
+    for k in MULTIPLIERS:
+        kn = k * n
+        score = -0.5 * math.log(k)
+        residue = kn % 8
+        score += math.log(2) * (2 if residue == 1 else 1 if residue == 5 else 0.5 if residue in (3, 7) else 0)
+        for p in small_primes.primes_up_to(1000)[1:]:
+            if k % p == 0:
+                score += math.log(p) / p
+            elif gmpy2.legendre(kn, p) == 1:
+                score += 2 * math.log(p) / (p - 1)
+        if best_score is None or score > best_score:
+            best, best_score = k, score
+    return best
+
+
+def sqrt_mod(a, p):
+    """A square root of the quadratic residue a modulo the odd prime p (Tonelli-Shanks)."""
+    a %= p
+    if a == 0:
+        return 0
+    if p % 4 == 3:
+        return pow(a, (p + 1) // 4, p)
+    q, s = p - 1, 0
+    while q % 2 == 0:
+        q //= 2
+        s += 1
+    z = 2
+    while pow(z, (p - 1) // 2, p) != p - 1:
+        z += 1
+    m, c, t, r = s, pow(z, q, p), pow(a, q, p), pow(a, (q + 1) // 2, p)
+    while t != 1:
+        i, t_power = 0, t
+        while t_power != 1:
+            t_power = t_power * t_power % p
+            i += 1
+        b = pow(c, 1 << (m - i - 1), p)
+        m, c, t, r = i, b * b % p, t * b * b % p, r * b % p
+    return r
+
+
+@functools.lru_cache(maxsize=2)
+def factor_base(kn, size):
+    """
+    The first `size` primes p with (kn/p) = 1 or p | kn (and 2), as a
+    FactorBase of NumPy arrays: the primes, sqrt(kn) mod p, log2(p), and
+    whether p is sieved (not below SIEVE_MIN_PRIME or when p | kn). Column 0
+    of the exponent vectors is the sign, column i + 1 the prime primes[i].
+    Cached per process.
+    """
+    bound = 16 * size
+    while True:
+        primes, roots = [], []
+        for p in small_primes.primes_up_to(bound):
+            if p == 2 or kn % p == 0:
+                primes.append(p)
+                roots.append(kn % p)
+            elif gmpy2.legendre(kn, p) == 1:
+                primes.append(p)
+                roots.append(sqrt_mod(kn % p, p))
+            if len(primes) == size:
+                sieved = np.array([p >= SIEVE_MIN_PRIME and kn % p != 0 for p in primes], dtype=bool)
+                primes = np.array(primes, dtype=np.int64)
+                return FactorBase(primes, np.array(roots, dtype=np.int64), np.log2(primes), sieved)
+        bound *= 2
+
+
+def residues(value, moduli):
+    """value mod each entry of moduli (an int64 array of moduli below 2**31), without a Python loop over them."""
+    negative = value < 0
+    value = abs(int(value))
+    result = np.zeros_like(moduli)
+    limbs = []
+    while value:
+        limbs.append(value & 0xFFFFFFFF)
+        value >>= 32
+    for limb in reversed(limbs):
+        result = ((result << 32) + limb) % moduli
+    return (moduli - result) % moduli if negative else result
+
+
+def inverses(values, moduli):
+    """values**-1 mod each (prime) modulus, by Fermat's little theorem with one vectorized ladder."""
+    result = np.ones_like(moduli)
+    base = values % moduli
+    exponent = moduli - 2
+    while exponent.any():
+        result = np.where(exponent & 1, result * base % moduli, result)
+        base = base * base % moduli
+        exponent >>= 1
+    return result
+
+
+def sieve_interval(starts, steps, weights, length):
+    """
+    Sums weights[i] over the positions starts[i] + j * steps[i] below length,
+    for all i at once: the positions are built as one array by a cumulative
+    sum of the steps (each run of a prime restarting at its first position)
+    and added up with np.bincount.
+    """
+    hits = (length - 1 - starts) // steps + 1
+    used = hits > 0
+    # int32 halves the memory traffic of the position arrays (every position is below length)
+    starts, steps, weights, hits = starts[used].astype(np.int32), steps[used].astype(np.int32), weights[used], hits[used]
+    firsts = np.cumsum(hits) - hits
+    increments = np.repeat(steps, hits)
+    # The first position of a run follows the last position of the previous one
+    increments[firsts[1:]] = starts[1:] - (starts[:-1] + (hits[:-1] - 1) * steps[:-1])
+    increments[0] = starts[0]
+    return np.bincount(np.cumsum(increments, dtype=np.int32), weights=np.repeat(weights, hits), minlength=length)
+
+
+def choose_a_factors(kn, fb, m, random_state):
+    """
+    Indices of the factor base primes whose product A is near sqrt(2 kn) / m:
+    s - 1 random primes around A_FACTOR_TARGET and the last one closest to
+    what remains of the target.
+    """
+    target = math.log(math.isqrt(2 * kn) // m)
+    candidates = np.flatnonzero(fb.sieved & (fb.primes > 3 * SIEVE_MIN_PRIME))
+    primes = fb.primes[candidates]
+    size = min(A_FACTOR_TARGET, int(primes[len(primes) // 2]))
+    s = max(2, round(target / math.log(size)))
+    while s > 2 and math.exp(target / s) < primes[0]:
+        s -= 1
+    centre = bisect.bisect_left(primes.tolist(), math.exp(target / s))
+    low, high = max(0, centre - 20 * s), min(len(primes) - 1, centre + 20 * s)
+    chosen = set()
+    while len(chosen) < s - 1:
+        chosen.add(low + int(gmpy2.mpz_random(random_state, high - low + 1)))
+    remaining = target - sum(math.log(int(primes[i])) for i in chosen)
+    order = np.argsort(np.abs(np.log(primes.astype(np.float64)) - remaining))
+    last = next(int(i) for i in order if int(i) not in chosen)
+    chosen.add(last)
+    return tuple(sorted(int(candidates[i]) for i in chosen))
+
+
+def sieve_a(args):
+    """
+    Worker task: sieves all 2^(s-1) polynomials of one A, given by the factor
+    base indices of its primes. Returns the relations found as tuples
+    (u, columns, large_prime) with u^2 = (the product over columns) * large_prime (mod n):
+    columns are exponent vector columns, repeated by multiplicity.
+    """
+    n, k, fb_size, m, a_indices = args
+    kn = k * n
+    fb = factor_base(kn, fb_size)
+    primes, logs = fb.primes, fb.logs
+    largest = int(primes[-1])
+    large_bound = LARGE_PRIME_MULTIPLIER * largest
+    q = [int(primes[i]) for i in a_indices]
+    a = math.prod(q)
+
+    # B = sum of B_l with B_l^2 = kn (mod q_l) and B_l = 0 (mod q_j), j != l
+    b_terms = []
+    for l, q_l in enumerate(q):
+        cofactor = a // q_l
+        gamma = int(fb.roots[a_indices[l]]) * pow(cofactor, -1, q_l) % q_l
+        gamma = min(gamma, q_l - gamma)
+        b_terms.append(cofactor * gamma)
+    b = sum(b_terms)
+
+    sieved = fb.sieved.copy()
+    sieved[list(a_indices)] = False
+    a_inverse = inverses(residues(a, primes), primes)
+    root_steps = [2 * residues(b_l, primes) % primes * a_inverse % primes for b_l in b_terms]
+    shifted = residues(m, primes)
+    root1 = (a_inverse * ((fb.roots - residues(b, primes)) % primes) + shifted) % primes
+    root2 = (a_inverse * ((-fb.roots - residues(b, primes)) % primes) + shifted) % primes
+
+    steps = np.concatenate((primes[sieved], primes[sieved]))
+    weights = np.concatenate((logs[sieved], logs[sieved]))
+    unsieved = [(i, int(p)) for i, p in enumerate(primes.tolist()) if not sieved[i]]
+    threshold = math.log2(m * math.isqrt(kn)) - math.log2(large_bound) - THRESHOLD_SLACK
+    signs = [1] * len(b_terms)
+    relations = []
+    for index in range(2 ** (len(q) - 1)):
+        if index:
+            # Gray code: flip the sign of B_j, j = 1 + the number of trailing zeros of index
+            j = (index & -index).bit_length()
+            b -= 2 * signs[j] * b_terms[j]
+            root1 = (root1 + signs[j] * root_steps[j]) % primes
+            root2 = (root2 + signs[j] * root_steps[j]) % primes
+            signs[j] = -signs[j]
+        c = (b * b - kn) // a
+
+        sieve = sieve_interval(np.concatenate((root1[sieved], root2[sieved])), steps, weights, 2 * m)
+        candidates = np.flatnonzero(sieve >= threshold)
+        if not len(candidates):
+            continue
+        # Primes dividing g at each candidate: those whose roots the candidate hits
+        remainders = candidates[:, None] % primes[None, :]
+        divides = (remainders == root1[None, :]) | (remainders == root2[None, :])
+        divides &= sieved[None, :]
+        for row, position in enumerate(candidates.tolist()):
+            x = position - m
+            g = (a * x + 2 * b) * x + c
+            columns = [0] if g < 0 else []
+            g = abs(g)
+            for i in np.flatnonzero(divides[row]).tolist():
+                p = int(primes[i])
+                while g % p == 0:
+                    g //= p
+                    columns.append(i + 1)
+            for i, p in unsieved:
+                while g % p == 0:
+                    g //= p
+                    columns.append(i + 1)
+            if g == 1 or g <= large_bound:
+                columns.extend(i + 1 for i in a_indices) # (ax + b)^2 - kn = a * g
+                relations.append((a * x + b, tuple(columns), int(g)))
+    return relations
+
+
+def combine_relations(relations):
+    """
+    Turns full relations and pairs of partial relations with the same large
+    prime into relations (u, columns, square) with u^2 = (product over
+    columns) * square^2 (mod n).
+    """
+    combined = []
+    partials = {}
+    seen = set()
+    for u, columns, large_prime in relations:
+        if u in seen:
+            continue
+        seen.add(u)
+        if large_prime == 1:
+            combined.append((u, columns, 1))
+        elif large_prime in partials:
+            first_u, first_columns = partials[large_prime]
+            combined.append((first_u * u, first_columns + columns, large_prime))
+        else:
+            partials[large_prime] = (u, columns)
+    return combined
+
+
+def odd_columns(columns):
+    """The columns that occur an odd number of times."""
+    odd = set()
+    for column in columns:
+        odd ^= {column}
+    return odd
+
+
+def structured_elimination(rows):
+    """
+    Structured Gaussian elimination on the exponent vectors mod 2 (sets of
+    columns). Repeatedly drops every row with a column that no other row has
+    (it cannot be part of a dependency) and merges the two rows of every
+    column of weight 2 into one (that column then disappears).
+    Returns (rows, histories, squares): the remaining nonzero rows; for each,
+    the set of original rows it is the sum of; and the histories of the rows
+    that merging has already reduced to zero (dependencies found on the way).
+    """
+    histories = [{i} for i in range(len(rows))]
+    rows = [set(row) for row in rows]
+    changed = True
+    while changed:
+        changed = False
+        where = collections.defaultdict(list)
+        for i, row in enumerate(rows):
+            for column in row:
+                where[column].append(i)
+        dropped = set()
+        for column, holders in where.items():
+            if len(holders) == 1:
+                dropped.add(holders[0])
+        if dropped:
+            rows = [row for i, row in enumerate(rows) if i not in dropped]
+            histories = [h for i, h in enumerate(histories) if i not in dropped]
+            changed = True
+            continue
+        used = set()
+        for column, holders in where.items():
+            if len(holders) == 2 and not used.intersection(holders):
+                keep, merge = holders
+                rows[keep] ^= rows[merge]
+                histories[keep] ^= histories[merge]
+                rows[merge] = None
+                used.update(holders)
+                changed = True
+        keep = [i for i, row in enumerate(rows) if row is not None]
+        rows = [rows[i] for i in keep]
+        histories = [histories[i] for i in keep]
+    empty = [h for row, h in zip(rows, histories) if not row and h]
+    rows_left = [(row, h) for row, h in zip(rows, histories) if row]
+    return [row for row, _ in rows_left], [h for _, h in rows_left], empty
+
+
+def dependencies(rows):
+    """
+    Gaussian elimination over GF(2) on rows (sets of columns) packed into
+    uint64 words, with an identity matrix alongside to record which rows were
+    added. Yields the sets of row indices whose sum is zero.
+    """
+    columns = sorted(set().union(*rows)) if rows else []
+    column_index = {column: i for i, column in enumerate(columns)}
+    count = len(rows)
+    left_words = (len(columns) + 63) // 64
+    right_words = (count + 63) // 64
+    matrix = np.zeros((count, left_words + right_words), dtype=np.uint64)
+    for i, row in enumerate(rows):
+        for column in row:
+            j = column_index[column]
+            matrix[i, j // 64] |= np.uint64(1 << (j % 64))
+        matrix[i, left_words + i // 64] |= np.uint64(1 << (i % 64))
+
+    free = np.ones(count, dtype=bool)
+    for j in range(len(columns)):
+        bit = np.uint64(1 << (j % 64))
+        has_bit = ((matrix[:, j // 64] & bit) != 0) & free
+        holders = np.flatnonzero(has_bit)
+        if not len(holders):
+            continue
+        pivot = holders[0]
+        free[pivot] = False
+        if len(holders) > 1:
+            matrix[holders[1:]] ^= matrix[pivot]
+    for i in np.flatnonzero(free).tolist():
+        combination = set()
+        for word in range(right_words):
+            value = int(matrix[i, left_words + word])
+            while value:
+                low = value & -value
+                combination.add(64 * word + low.bit_length() - 1)
+                value ^= low
+        yield combination
+
+
+def factor_from_dependency(n, fb, relations, combination):
+    """gcd(X - Y, n) for the congruence of squares given by a set of relations, or None if it is trivial."""
+    x = mpz(1)
+    y = mpz(1)
+    exponents = collections.Counter()
+    for i in combination:
+        u, columns, square = relations[i]
+        x = x * u % n
+        y = y * square % n
+        exponents.update(columns)
+    for column, exponent in exponents.items():
+        if column:
+            y = y * gmpy2.powmod(int(fb.primes[column - 1]), exponent // 2, n) % n
+    factor = gmpy2.gcd(x - y, n)
+    if 1 < factor < n:
+        return factor
+    return None
+
+
+def find_factor(n, relations, fb):
+    """Tries the dependencies of the relations until one splits n. Returns the factor or None."""
+    with instrumentation.span("siqs_linear_algebra"):
+        rows = [odd_columns(columns) for _, columns, _ in relations]
+        reduced, histories, already_square = structured_elimination(rows)
+        instrumentation.count("siqs_matrix_rows", len(reduced))
+        candidates = list(already_square)
+        for combination in dependencies(reduced):
+            total = set()
+            for i in combination:
+                total ^= histories[i]
+            candidates.append(total)
+    for combination in candidates:
+        factor = factor_from_dependency(n, fb, relations, combination)
+        if factor is not None:
+            return factor
+    return None
+
+
+def siqs(n, time_limit=math.inf, parallel=True, seed=1):
+    """
+    Returns a nontrivial factor of the odd composite n (not a perfect power)
+    found with the self-initialising quadratic sieve, or None if time_limit
+    seconds pass first.
+    """
+    n = int(n)
+    deadline = time.monotonic() + time_limit
+    digits = len(str(n))
+    fb_size, m = parameters(digits)
+    k = knuth_schroeppel(n)
+    kn = k * n
+    fb = factor_base(kn, fb_size)
+    common = math.gcd(n, math.prod(int(p) for p in fb.primes))
+    if 1 < common < n:
+        return mpz(common)
+    needed = fb_size + 1 + EXTRA_RELATIONS
+    random_state = gmpy2.random_state(seed)
+    used_a = set()
+
+    def next_task():
+        while True:
+            a_indices = choose_a_factors(kn, fb, m, random_state)
+            if a_indices not in used_a:
+                used_a.add(a_indices)
+                return n, k, fb_size, m, a_indices
+
+    found = []
+    while True:
+        with instrumentation.span("siqs_sieve"):
+            relations = gather_relations(next_task, needed, found, deadline, parallel)
+        if relations is None:
+            return None
+        instrumentation.count("siqs_relations", len(relations))
+        factor = find_factor(n, relations, fb)
+        if factor is not None:
+            return factor
+        needed = len(relations) + EXTRA_RELATIONS # Every dependency was trivial (rare): sieve some more
+
+
+def gather_relations(next_task, needed, found, deadline, parallel):
+    """
+    Sieves the polynomial groups of next_task() (on the pool if parallel) and
+    adds their relations to found until combine_relations(found) has `needed`
+    of them. Returns those, or None once the deadline passes.
+    """
+    relations = combine_relations(found)
+    if not parallel or worker_pool.get_pool_size() == 1:
+        while len(relations) < needed:
+            if time.monotonic() >= deadline:
+                return None
+            found.extend(sieve_a(next_task()))
+            instrumentation.count("siqs_polynomial_groups")
+            relations = combine_relations(found)
+        return relations
+
+    backend = worker_pool.select_backend(gil_bound=True) # Processes, unless threads run in parallel
+    window = 2 * worker_pool.get_pool_size()
+    in_flight = set()
+    try:
+        while len(relations) < needed:
+            while len(in_flight) < window:
+                in_flight.add(worker_pool.submit(sieve_a, next_task(), backend=backend))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            done, in_flight = concurrent.futures.wait(
+                in_flight, timeout=min(remaining, worker_pool.CANCEL_CHECK_INTERVAL),
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            worker_pool.raise_if_cancelled()
+            for future in done:
+                found.extend(future.result())
+                instrumentation.count("siqs_polynomial_groups")
+            if done:
+                relations = combine_relations(found)
+    finally:
+        for future in in_flight:
+            future.cancel()
+    return relations
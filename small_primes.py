@@ -0,0 +1,127 @@
+"""
+Small prime tables and a GCD-based small divisor filter.
+
+classical_filter() used to trial-divide n by every number of the form 6k±1
+up to its bound, one interpreted mpz % at a time. Here the primes up to the
+bound are multiplied into a handful of block products once (cached per
+process), so checking n for small factors costs a single gmpy2.gcd against
+the product of all of them. Only when that gcd is not 1 are the block
+products scanned to recover the exact (smallest) divisor.
+
+When a prime table file covers the bound (see prime_table.py), the primes
+are read from it instead of being sieved again in every process.
+"""
+import functools
+import itertools
+import math
+from array import array
+
+import gmpy2
+from gmpy2 import mpz
+
+import instrumentation
+
+DEFAULT_FILTER_BOUND = 10**6 + 3 # Last 6k±1 candidate the original classical_filter loop tried
+PRIMES_PER_BLOCK = 4096 # Primes multiplied into one block product
+
+
+def covering_table(x):
+    """The prime table (prime_table.py) if there is one that reaches x, otherwise None."""
+    import prime_table # Imported here: prime_table builds on prime_sieve, which imports this module
+    return prime_table.covering_table(x)
+
+
+@functools.lru_cache(maxsize=4)
+def primes_up_to(bound):
+    """
+    Returns an array of all primes <= bound, read from the prime table if it
+    reaches bound, else from a Sieve of Eratosthenes over odd numbers.
+    The result is cached, so later calls with the same bound are free.
+    """
+    if bound < 2:
+        return array('L')
+    table = covering_table(bound)
+    if table is not None:
+        return table.primes_up_to(bound)
+    # sieve[i] represents the odd number 2*i + 1
+    size = (bound + 1) // 2
+    sieve = bytearray([1]) * size
+    sieve[0] = 0 # 1 is not prime
+    for i in range(1, (math.isqrt(bound) + 1) // 2):
+        if sieve[i]:
+            p = 2 * i + 1
+            start = p * p // 2
+            sieve[start::p] = bytes(len(range(start, size, p)))
+    primes = array('L', [2])
+    primes.extend(2 * i + 1 for i in itertools.compress(range(size), sieve))
+    return primes
+
+
+def product_of(values):
+    """Multiplies values with a balanced product tree (much faster than a running product)."""
+    products = [mpz(v) for v in values]
+    if not products:
+        return mpz(1)
+    while len(products) > 1:
+        paired = [products[i] * products[i + 1] for i in range(0, len(products) - 1, 2)]
+        if len(products) % 2:
+            paired.append(products[-1])
+        products = paired
+    return products[0]
+
+
+@functools.lru_cache(maxsize=4)
+def primorial_blocks(bound):
+    """
+    Returns (block_products, primorial) for all primes <= bound.
+    block_products[i] is the product of the i-th run of PRIMES_PER_BLOCK primes,
+    primorial is the product of all of them. Cached on first use.
+    """
+    primes = primes_up_to(bound)
+    block_products = [product_of(primes[i:i + PRIMES_PER_BLOCK])
+                      for i in range(0, len(primes), PRIMES_PER_BLOCK)]
+    return block_products, product_of(block_products)
+
+
+def smallest_prime_divisor(n, bound=DEFAULT_FILTER_BOUND):
+    """
+    Returns the smallest prime p <= bound that divides n with p != n, or None.
+    Uses one gcd against the primorial of the bound; the block products are
+    only scanned when n is known to have a small factor.
+    """
+    n = mpz(n)
+    if n < 2:
+        return None
+    primes = primes_up_to(bound)
+
+    if n <= bound:
+        table = covering_table(n)
+        if table is not None and table.is_prime_small(n):
+            return None
+        # n may itself be one of the tabulated primes; its smallest factor is <= sqrt(n)
+        limit = math.isqrt(int(n))
+        trial_divisions = 0
+        divisor = None
+        for p in primes:
+            if p > limit:
+                break
+            trial_divisions += 1
+            if n % p == 0:
+                divisor = p
+                break
+        instrumentation.count("trial_divisions", trial_divisions)
+        return divisor
+
+    block_products, primorial = primorial_blocks(bound)
+    common = gmpy2.gcd(n, primorial)
+    instrumentation.count("gcd_filter_primes", len(primes)) # Primes checked at once by the gcd
+    if common == 1:
+        return None
+
+    for block_index, block_product in enumerate(block_products):
+        if gmpy2.gcd(common, block_product) != 1:
+            start = block_index * PRIMES_PER_BLOCK
+            for p in primes[start:start + PRIMES_PER_BLOCK]:
+                if common % p == 0:
+                    return p
+    return None
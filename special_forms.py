@@ -0,0 +1,271 @@
+"""
+Deterministic primality tests for numbers of the form k*2^n+-1.
+
+The known prime tables (known_primes.py) only answer for tabulated primes;
+an unknown 2^p - 1 or k*2^n +- 1 went through the classical filter and the
+generic Euler-Jacobi or BPSW exponentiations, which only give a "likely
+prime". For these forms a proof costs about n squarings:
+
+  * 2^p - 1 (Mersenne): Lucas-Lehmer, u_0 = 4, u_(i+1) = u_i^2 - 2; M_p is
+    prime iff u_(p-2) = 0. For composite p, 2^d - 1 divides M_p (d | p).
+  * k*2^n + 1 with k < 2^n (Proth): prime iff a^((N-1)/2) = -1 (mod N) for
+    an a with Jacobi(a/N) = -1, found among the small primes with Jacobi
+    symbols alone (no exponentiation).
+  * 2^(2^m) + 1 (Fermat): Pepin's test, the Proth test with a = 3.
+  * k*2^n - 1 with k < 2^n (Riesel): Lucas-Lehmer-Riesel with Rodseth's
+    start, u_0 = V_k(P, 1) for a P with Jacobi((P-2)/N) = 1 and
+    Jacobi((P+2)/N) = -1; N is prime iff u_(n-2) = 0.
+
+The form is taken from the shape expression_eval.parse_expression()
+reports for typed expressions such as 3*2**100-1 or 4**50+1, and otherwise
+read from the bits of the value (n - 1 or n + 1 is k*2^e with k < 2^e), so
+it is found for decimal input as well.
+The squarings reduce mod N = k*2^n + c by shift and add instead of a
+division: x = q*k*2^n + r*2^n + lo = r*2^n + lo - c*q (mod N), with q, r
+from a division of the top half by the small k (a single subtraction or
+addition of the halves when k = 1). For M_p that makes each step about four
+times faster than (x*x - 2) % M_p.
+
+Usage:
+    form = special_forms.detect_special_form(n[, shape])    # None unless n is k*2^e+-1 with k < 2^e
+    result = special_forms.prove_special_form(n, form)
+"""
+import time
+
+import gmpy2
+from gmpy2 import mpz
+
+import instrumentation
+import small_primes
+import worker_pool
+
+MAX_SEARCH = 1000 # Largest a (Proth) or P (LLR) tried before falling back to the generic tests
+PROGRESS_INTERVAL = 0.5 # Seconds between progress reports and cancel checks
+CHECK_EVERY = 256 # Squarings between two looks at the clock
+
+TEST_NAMES = {
+    "lucas_lehmer": "Lucas-Lehmer test",
+    "pepin": "Pepin test",
+    "proth": "Proth test",
+    "llr": "Lucas-Lehmer-Riesel test",
+    "algebraic": "algebraic factorization",
+}
+
+
+def form_expression(k, e, c):
+    """k*2^e+c written as an expression, e.g. "3*2**100-1"."""
+    return f"{f'{k}*' if k != 1 else ''}2**{e}{'+' if c > 0 else '-'}{abs(c)}"
+
+
+def classify_form(k, e, c):
+    """
+    The dict of detect_special_form() for k*2^e + c (k >= 1, c = +-1), or
+    None unless k < 2^e once the factors 2 of k are moved into 2^e.
+    """
+    k = mpz(k)
+    if k < 1 or c not in (1, -1):
+        return None
+    shift = gmpy2.bit_scan1(k)
+    k, e = k >> shift, e + shift
+    if k.bit_length() > e:
+        return None
+    if k == 1 and c == -1:
+        form = "mersenne"
+    elif k == 1 and e & (e - 1) == 0:
+        form = "fermat"
+    else:
+        form = "proth" if c == 1 else "riesel"
+    return {"form": form, "k": int(k), "e": int(e), "c": c, "expression": form_expression(k, e, c)}
+
+
+def detect_special_form(n, shape=None):
+    """
+    Returns a dict describing n if it is k*2^e + c with c = +-1, k odd and
+    k < 2^e, otherwise None:
+      form       - "mersenne" (k = 1, c = -1), "fermat" (k = 1, c = +1, e a power of two),
+                   "proth" (c = +1) or "riesel" (c = -1)
+      k, e, c    - the parameters of the form
+      expression - n as an expression, e.g. "2**127-1"
+    shape is what expression_eval.parse_expression() reported for the input
+    n was typed as, if any. A k*b**m+-1 shape with b a power of two gives the
+    form directly (n - c is then k*2^e for exactly one c); otherwise n - 1
+    and n + 1 are scanned for their lowest set bit.
+    """
+    n = mpz(n)
+    if n < 7 or n % 2 == 0:
+        return None
+    if shape is not None and shape["form"] == "power" and shape["c"] in (1, -1):
+        b = shape["b"]
+        if b > 1 and b & (b - 1) == 0:
+            return classify_form(shape["k"], (b.bit_length() - 1) * shape["n"], shape["c"])
+    for c in (1, -1):
+        e = gmpy2.bit_scan1(n - c)
+        form = classify_form((n - c) >> e, e, c)
+        if form is not None:
+            return form
+    return None
+
+
+def reduce_special(x, k, e, c, n, mask):
+    """x mod n for n = k*2^e + c, by shift and add (see the module docstring)."""
+    high = x >> e
+    if k == 1:
+        x = (x & mask) - c * high
+    else:
+        q, r = gmpy2.f_divmod(high, k)
+        x = (r << e) + (x & mask) - c * q
+    while x >= n:
+        x -= n
+    while x < 0:
+        x += n
+    return x
+
+
+def square_chain(x, count, k, e, c, subtract=0, progress_callback=None):
+    """
+    Applies x -> x^2 - subtract (mod k*2^e + c) count times.
+    progress_callback(fraction) is called at most every PROGRESS_INTERVAL
+    seconds, and the chain stops with worker_pool.TaskCancelled once the
+    request running in this thread is cancelled.
+    """
+    n = k * (mpz(1) << e) + c
+    mask = (mpz(1) << e) - 1
+    last_report = time.monotonic()
+    for i in range(count):
+        x = reduce_special(x * x - subtract, k, e, c, n, mask)
+        if i % CHECK_EVERY == 0 and time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            worker_pool.raise_if_cancelled()
+            if progress_callback:
+                progress_callback(i / count)
+            last_report = time.monotonic()
+    instrumentation.count("special_form_squarings", count)
+    if progress_callback:
+        progress_callback(1.0)
+    return x
+
+
+def smallest_prime_factor(m):
+    """The smallest prime factor of m >= 2 (m is an exponent, so below 2^28)."""
+    for p in small_primes.primes_up_to(gmpy2.isqrt(m)):
+        if m % p == 0:
+            return int(p)
+    return m
+
+
+def algebraic_factor(k, e, c):
+    """
+    A factor of 2^e + c that follows from e alone, or None: 2^d - 1 divides
+    2^e - 1 for the smallest prime d | e, and 2^(e/q) + 1 divides 2^e + 1 for
+    the smallest odd prime q | e.
+    """
+    if k != 1:
+        return None
+    if c == -1:
+        d = smallest_prime_factor(e)
+        return (mpz(1) << d) - 1 if d < e else None
+    odd_part = e >> gmpy2.bit_scan1(e)
+    if odd_part == 1:
+        return None
+    return (mpz(1) << (e // smallest_prime_factor(odd_part))) + 1
+
+
+def proth_base(n):
+    """
+    The smallest prime a with Jacobi(a/n) = -1 for the Proth test, or a
+    factor of n found on the way (returned as ("factor", p)), or None if no
+    a up to MAX_SEARCH qualifies (only squares have none at all).
+    """
+    for a in small_primes.primes_up_to(MAX_SEARCH):
+        jacobi = gmpy2.jacobi(a, n)
+        if jacobi == -1:
+            return a
+        if jacobi == 0 and a != n:
+            return ("factor", int(a))
+    return None
+
+
+def rodseth_parameter(n):
+    """
+    The smallest P >= 3 with Jacobi((P-2)/n) = 1 and Jacobi((P+2)/n) = -1
+    (Rodseth's start for the LLR test), a factor of n found on the way
+    (returned as ("factor", f)), or None if no P up to MAX_SEARCH qualifies.
+    """
+    for P in range(3, MAX_SEARCH):
+        minus, plus = gmpy2.jacobi(P - 2, n), gmpy2.jacobi(P + 2, n)
+        if minus == 0 or plus == 0:
+            common_divisor = gmpy2.gcd((P - 2) * (P + 2), n)
+            if 1 < common_divisor < n:
+                return ("factor", int(common_divisor))
+            continue
+        if minus == 1 and plus == -1:
+            return P
+    return None
+
+
+def lucas_lehmer_test(p, progress_callback=None):
+    """True if 2^p - 1 is prime, for an odd prime p (Lucas-Lehmer)."""
+    return square_chain(mpz(4), p - 2, 1, p, -1, 2, progress_callback) == 0
+
+
+def proth_test(k, e, a, progress_callback=None):
+    """
+    True if N = k*2^e + 1 is prime, given Jacobi(a/N) = -1 (for k < 2^e):
+    a^((N-1)/2) = a^(k*2^(e-1)) is computed as (a^k mod N) squared e-1 times.
+    Pepin's test for a Fermat number is this with k = 1 and a = 3.
+    """
+    n = k * (mpz(1) << e) + 1
+    x = gmpy2.powmod(a, k, n)
+    return square_chain(x, e - 1, k, e, 1, 0, progress_callback) == n - 1
+
+
+def llr_test(k, e, P, progress_callback=None):
+    """
+    True if N = k*2^e - 1 is prime, given Rodseth's P for N (for odd k < 2^e):
+    u_0 = V_k(P, 1) mod N and u_(i+1) = u_i^2 - 2, N is prime iff u_(e-2) = 0.
+    """
+    n = k * (mpz(1) << e) - 1
+    u = gmpy2.lucasv_mod(P, 1, k, n)
+    return square_chain(u, e - 2, k, e, -1, 2, progress_callback) == 0
+
+
+def prove_special_form(n, form=None, progress_callback=None):
+    """
+    Runs the deterministic test matching the form of n (detect_special_form()
+    is called when form is not given). Returns None if n has none of the
+    forms or no Proth base / Rodseth parameter was found, otherwise a dict:
+      prime     - True if n is proven prime, False if proven composite
+      test      - "lucas_lehmer", "pepin", "proth", "llr" or "algebraic"
+      parameter - the Proth base a or the Rodseth P, or None
+      factor    - a nontrivial factor of n found on the way, or None
+    plus the keys of the form (form, k, e, c, expression).
+    """
+    n = mpz(n)
+    if form is None:
+        form = detect_special_form(n)
+        if form is None:
+            return None
+    k, e, c = form["k"], form["e"], form["c"]
+    result = dict(form, prime=False, parameter=None, factor=None)
+
+    factor = algebraic_factor(k, e, c)
+    if factor is not None and 1 < factor < n:
+        return dict(result, test="algebraic", factor=int(factor))
+
+    if form["form"] == "mersenne":
+        return dict(result, test="lucas_lehmer", prime=lucas_lehmer_test(e, progress_callback))
+
+    if c == 1:
+        a = 3 if form["form"] == "fermat" else proth_base(n)
+        test = "pepin" if form["form"] == "fermat" else "proth"
+        if isinstance(a, tuple):
+            return dict(result, test=test, factor=a[1])
+        if a is None:
+            return None
+        return dict(result, test=test, parameter=a, prime=proth_test(k, e, a, progress_callback))
+
+    P = rodseth_parameter(n)
+    if isinstance(P, tuple):
+        return dict(result, test="llr", factor=P[1])
+    if P is None:
+        return None
+    return dict(result, test="llr", parameter=P, prime=llr_test(k, e, P, progress_callback))
@@ -0,0 +1,304 @@
+"""
+Two-tier cache for primality verdicts and factorizations.
+
+The same large candidates are often tested (and the same moduli factored)
+again and again, so results are remembered:
+  - in memory, in an LRU dict per process limited to MEMORY_BUDGET bytes
+    (the size of the stored JSON),
+  - on disk, in a sqlite database shared by all processes (the GUIs, batch
+    mode and every worker of the pool), limited to DISK_LIMIT bytes; the
+    least recently used entries are evicted first.
+sqlite runs in WAL mode with a busy timeout, so concurrent readers and
+writers in different processes are safe; each thread opens its own
+connection (reopened after a fork). The lock of this module only guards the
+memory tier and the counters, never a query, so lookups from different
+threads (the service, the GUI) do not queue behind each other's disk I/O.
+The last_used time of a disk hit is not written at once: hits are collected
+and written in one transaction with the next store, once TOUCH_BATCH of
+them are pending, or at exit.
+
+Keys are a BLAKE2b hash of gmpy2.to_binary(n) together with the kind of
+result ("verdict" or "factors"), the test mode and the bases, so results of
+different modes or bases never mix. Values are JSON.
+
+The disk path is PRIME_CACHE_PATH (default ~/.prime_numbers_cache.sqlite3);
+PRIME_CACHE=0 disables the cache, and callers can skip it per call
+(use_cache=False). If the database cannot be used, only the memory tier is kept.
+"""
+import atexit
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import gmpy2
+
+import instrumentation
+
+ENABLED = os.environ.get("PRIME_CACHE", "1") != "0"
+DISK_PATH = os.environ.get("PRIME_CACHE_PATH", os.path.join(os.path.expanduser("~"), ".prime_numbers_cache.sqlite3"))
+MEMORY_BUDGET = 64 * 2**20 # Bytes of JSON kept in the in-process LRU
+DISK_LIMIT = 256 * 2**20 # Bytes of JSON kept on disk before the oldest entries are evicted
+DISK_TIMEOUT = 30.0 # Seconds to wait for another process holding the database lock
+EVICTION_CHECK_INTERVAL = 256 # Stores between checks of the on-disk size
+TOUCH_BATCH = 64 # Disk hits whose last_used updates are written together
+
+_lock = threading.Lock()
+_memory = collections.OrderedDict() # key -> JSON text, least recently used first
+_memory_bytes = 0
+_local = threading.local() # .connection, .pid, .path: this thread's sqlite connection
+_pending_touches = {} # key -> time of a disk hit whose last_used is not written yet
+_stores_since_check = 0
+_stats = collections.Counter()
+
+
+def configure_cache(enabled=None, path=None, memory_budget=None, disk_limit=None):
+    """
+    Changes the cache settings for this process. path=None keeps the current
+    database, path="" keeps only the memory tier. Arguments left as None are unchanged.
+    """
+    global ENABLED, DISK_PATH, MEMORY_BUDGET, DISK_LIMIT
+    with _lock:
+        if enabled is not None:
+            ENABLED = enabled
+        if path is not None:
+            DISK_PATH = path # Each thread reopens its connection on its next query
+            _pending_touches.clear()
+        if memory_budget is not None:
+            MEMORY_BUDGET = memory_budget
+            _evict_memory_locked()
+        if disk_limit is not None:
+            DISK_LIMIT = disk_limit
+
+
+def cache_key(kind, n, mode="", bases=None):
+    """Hash identifying one result: kind, the binary form of n, the test mode and the bases."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{kind}\0{mode}\0{bases_description(bases)}\0".encode())
+    digest.update(gmpy2.to_binary(gmpy2.mpz(n)))
+    return digest.hexdigest()
+
+
+def bases_description(bases):
+    """A count of random bases and an explicit base list are described differently."""
+    if bases is None:
+        return ""
+    if isinstance(bases, int):
+        return f"random:{bases}"
+    return ",".join(str(int(b)) for b in sorted(bases))
+
+
+def lookup(kind, n, mode="", bases=None):
+    """
+    Returns (value, tier) with tier "memory" or "disk", or (None, None) on a miss.
+    A disk hit is copied into the memory tier.
+    """
+    if not ENABLED:
+        return None, None
+    key = cache_key(kind, n, mode, bases)
+    with _lock:
+        text = _memory.get(key)
+        if text is not None:
+            _memory.move_to_end(key)
+            _stats["memory_hits"] += 1
+            instrumentation.count("cache_memory_hits")
+            return json.loads(text), "memory"
+
+    row = None
+    connection = _get_connection()
+    if connection is not None:
+        try:
+            row = connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            _disk_error(e)
+    if row is not None:
+        with _lock:
+            _stats["disk_hits"] += 1
+            _remember_locked(key, row[0])
+            _pending_touches[key] = time.time()
+            flush = len(_pending_touches) >= TOUCH_BATCH
+        instrumentation.count("cache_disk_hits")
+        if flush:
+            flush_touches()
+        return json.loads(row[0]), "disk"
+    with _lock:
+        _stats["misses"] += 1
+    instrumentation.count("cache_misses")
+    return None, None
+
+
+def store(kind, n, value, mode="", bases=None):
+    """Stores a JSON-serializable value in both tiers."""
+    global _stores_since_check
+    if not ENABLED:
+        return
+    key = cache_key(kind, n, mode, bases)
+    text = json.dumps(value, default=int, separators=(",", ":"))
+    with _lock:
+        _stats["stores"] += 1
+        _remember_locked(key, text)
+        _stores_since_check += 1
+        evict = _stores_since_check >= EVICTION_CHECK_INTERVAL or len(text) > DISK_LIMIT // EVICTION_CHECK_INTERVAL
+        if evict:
+            _stores_since_check = 0
+        touches = _take_touches_locked()
+    connection = _get_connection()
+    if connection is None:
+        return
+    try:
+        _write_touches(connection, touches) # Pending hits go in the same transaction
+        connection.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                           (key, text, len(text), time.time()))
+        connection.commit()
+        if evict:
+            _evict_disk(connection)
+    except sqlite3.Error as e:
+        _disk_error(e)
+
+
+def flush_touches():
+    """Writes the last_used times of the pending disk hits (called at exit as well)."""
+    with _lock:
+        touches = _take_touches_locked()
+    connection = _get_connection() if touches else None
+    if connection is None:
+        return
+    try:
+        _write_touches(connection, touches)
+        connection.commit()
+    except sqlite3.Error as e:
+        _disk_error(e)
+
+
+def cache_stats():
+    """Returns this process's counters: memory_hits, disk_hits, misses, stores, evictions, ..."""
+    with _lock:
+        stats = dict(_stats)
+        stats.update(memory_entries=len(_memory), memory_bytes=_memory_bytes)
+    for name in ("memory_hits", "disk_hits", "misses", "stores", "memory_evictions", "disk_evictions"):
+        stats.setdefault(name, 0)
+    return stats
+
+
+def clear_cache(disk=True):
+    """Empties the memory tier and (with disk=True) the on-disk store."""
+    global _memory_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+        if disk:
+            _pending_touches.clear()
+    connection = _get_connection() if disk else None
+    if connection is not None:
+        try:
+            connection.execute("DELETE FROM results")
+            connection.commit()
+        except sqlite3.Error as e:
+            _disk_error(e)
+
+
+def _remember_locked(key, text):
+    global _memory_bytes
+    if len(text) > MEMORY_BUDGET:
+        return
+    previous = _memory.pop(key, None)
+    if previous is not None:
+        _memory_bytes -= len(previous)
+    _memory[key] = text
+    _memory_bytes += len(text)
+    _evict_memory_locked()
+
+
+def _evict_memory_locked():
+    global _memory_bytes
+    while _memory_bytes > MEMORY_BUDGET and _memory:
+        _, text = _memory.popitem(last=False)
+        _memory_bytes -= len(text)
+        _stats["memory_evictions"] += 1
+
+
+def _take_touches_locked():
+    """The pending last_used updates as (time, key) rows, which are then no longer pending."""
+    touches = [(used, key) for key, used in _pending_touches.items()]
+    _pending_touches.clear()
+    return touches
+
+
+def _write_touches(connection, touches):
+    """Writes last_used updates (rows from _take_touches_locked()) in the open transaction."""
+    if touches:
+        connection.executemany("UPDATE results SET last_used = ? WHERE key = ?", touches)
+
+
+def _evict_disk(connection):
+    """Deletes the least recently used rows until the store is below 90% of DISK_LIMIT."""
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+    if total <= DISK_LIMIT:
+        return
+    target = total - DISK_LIMIT * 9 // 10
+    freed = 0
+    victims = []
+    for key, size in connection.execute("SELECT key, size FROM results ORDER BY last_used"):
+        victims.append((key,))
+        freed += size
+        if freed >= target:
+            break
+    connection.executemany("DELETE FROM results WHERE key = ?", victims)
+    connection.commit()
+    with _lock:
+        _stats["disk_evictions"] += len(victims)
+
+
+def _get_connection():
+    """
+    The sqlite connection of this thread (opened lazily, reopened after a
+    fork or a change of DISK_PATH), or None.
+    """
+    path = DISK_PATH
+    if not path:
+        return None
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.pid == os.getpid() and _local.path == path:
+        return connection
+    _close_connection()
+    try:
+        connection = sqlite3.connect(path, timeout=DISK_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS results ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        connection.commit()
+    except (sqlite3.Error, OSError) as e:
+        _disk_error(e)
+        return None
+    _local.connection, _local.pid, _local.path = connection, os.getpid(), path
+    return connection
+
+
+def _close_connection():
+    """Closes this thread's connection (one inherited over a fork is only dropped)."""
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.pid == os.getpid():
+        connection.close()
+    _local.connection = None
+
+
+def _disk_error(error):
+    """
+    Counts a failed disk operation. A database that stays locked longer than
+    DISK_TIMEOUT only skips this operation; any other error (read-only disk,
+    corrupt file, ...) falls back to the memory tier for the rest of the process.
+    """
+    global DISK_PATH
+    with _lock:
+        _stats["disk_errors"] += 1
+    if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+        return
+    _close_connection()
+    DISK_PATH = ""
+
+
+atexit.register(flush_touches)
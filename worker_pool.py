@@ -0,0 +1,515 @@
+"""
+Shared worker pool for prime_numbers.py and number_decomposition.py.
+
+Starting a ProcessPoolExecutor costs more than the modular exponentiations
+it runs for numbers below a few thousand bits, so instead of creating a new
+pool for every test, both tools reuse one long-lived pool from this module.
+The pool is started lazily on first use, restarted if a worker process dies
+and shut down at interpreter exit.
+
+Large operands (the n under test, a cofactor in ECM) are not pickled into
+every task: shared_operand(n) publishes gmpy2.to_binary(n) once in a
+multiprocessing.shared_memory block and the tasks carry a small
+SharedOperand handle instead, which resolve_operand() turns back into the
+mpz in the worker (once per job and worker, then from a small cache).
+
+A thread can run its pool calls inside cancellation(event) (the GUIs do, from
+their background thread): once the event is set, the next check in
+as_completed_results() or raise_if_cancelled() terminates the workers and
+raises TaskCancelled.
+
+Below a few thousand bits a modular exponentiation takes less time than
+pickling its task and waking a worker process, so submit(),
+as_completed_results() and map_tasks() take a backend: "process" (the pool
+above, the default), "thread" (a thread pool of the same size, sharing the
+operands without pickling) or "inline" (the calling thread, one task after
+the other). select_backend(bits) picks one per job from the operand size:
+inline below INLINE_MAX_BITS, threads up to THREAD_MAX_BITS if they run in
+parallel here (a free-threaded interpreter, or gmpy2 releasing the GIL during
+its arithmetic, which the pool threads enable), processes above that, where
+a running task must stay terminable. PRIME_BACKEND or configure_backend()
+overrides the choice; python benchmarks/bench_backends.py measures the
+crossovers on the host and prints the thresholds to set.
+"""
+import atexit
+import collections
+import contextlib
+import os
+import multiprocessing
+import pickle
+import secrets
+import struct
+import sys
+import threading
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+import gmpy2
+
+import instrumentation
+
+# Pool size can be overridden with the PRIME_WORKERS environment variable
+# or at runtime with configure_pool().
+DEFAULT_POOL_SIZE = int(os.environ.get("PRIME_WORKERS", multiprocessing.cpu_count()))
+
+CANCEL_CHECK_INTERVAL = 0.1 # Seconds between checks of the cancel event while waiting for results
+SHARED_OPERAND_BITS = 2**18 # Operands from this size on go to the workers through shared memory
+RESOLVED_OPERANDS_CACHED = 2 # Shared operands each worker keeps rebuilt (the current job and the last one)
+
+BACKENDS = ("process", "thread", "inline")
+# "auto" lets select_backend() choose by operand size; the thresholds come from benchmarks/bench_backends.py
+DEFAULT_BACKEND = os.environ.get("PRIME_BACKEND", "auto")
+DEFAULT_INLINE_MAX_BITS = int(os.environ.get("PRIME_INLINE_MAX_BITS", 512)) # Smaller operands: inline
+DEFAULT_THREAD_MAX_BITS = int(os.environ.get("PRIME_THREAD_MAX_BITS", 6144)) # Smaller operands: threads
+# Threads run gmpy2 work in parallel on a free-threaded interpreter, or with
+# a gmpy2 that can release the GIL during its arithmetic (2.1 and later)
+FREE_THREADED = hasattr(sys, "_is_gil_enabled") and not sys._is_gil_enabled()
+GMPY2_RELEASES_GIL = hasattr(gmpy2.get_context(), "allow_release_gil")
+
+_pool_lock = threading.Lock()
+_executor = None
+_executor_pid = None # The process that started _executor (forked workers inherit the global)
+_thread_executor = None
+_pool_size = DEFAULT_POOL_SIZE
+_backend = DEFAULT_BACKEND
+_inline_max_bits = DEFAULT_INLINE_MAX_BITS
+_thread_max_bits = DEFAULT_THREAD_MAX_BITS
+_cancel_local = threading.local() # .event: the cancel event of the request running in this thread
+_resolved_operands = collections.OrderedDict() # In a worker: shared block name -> rebuilt mpz
+_attached_board = None # In a worker: the progress board block it last reported to
+
+
+class TaskCancelled(Exception):
+    """Raised in a thread whose request was cancelled (see cancellation())."""
+
+
+def configure_pool(max_workers=None):
+    """
+    Sets the number of worker processes used by the shared pool (and of
+    threads of the thread backend).
+    None restores the default (one worker per CPU core).
+    A running pool with a different size is shut down and will be
+    restarted lazily with the new size on the next request.
+    """
+    global _pool_size, _thread_executor
+    if max_workers is not None and max_workers < 1:
+        raise ValueError("max_workers must be a positive integer")
+    new_size = DEFAULT_POOL_SIZE if max_workers is None else int(max_workers)
+    with _pool_lock:
+        if new_size == _pool_size:
+            return
+        _pool_size = new_size
+        _shutdown_locked(wait=True)
+        if _thread_executor is not None:
+            _thread_executor.shutdown(wait=True)
+            _thread_executor = None
+
+
+def get_pool_size():
+    """Returns the configured number of worker processes."""
+    return _pool_size
+
+
+def configure_backend(backend=None, inline_max_bits=None, thread_max_bits=None):
+    """
+    Sets the backend select_backend() returns: "auto" (chosen by operand
+    size) or one of BACKENDS for every job, and the size thresholds of
+    "auto". None restores the default of each (PRIME_BACKEND,
+    PRIME_INLINE_MAX_BITS, PRIME_THREAD_MAX_BITS).
+    """
+    global _backend, _inline_max_bits, _thread_max_bits
+    backend = DEFAULT_BACKEND if backend is None else backend
+    if backend != "auto" and backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected 'auto' or one of {', '.join(BACKENDS)}.")
+    _backend = backend
+    _inline_max_bits = DEFAULT_INLINE_MAX_BITS if inline_max_bits is None else int(inline_max_bits)
+    _thread_max_bits = DEFAULT_THREAD_MAX_BITS if thread_max_bits is None else int(thread_max_bits)
+
+
+def threads_run_in_parallel(gil_bound=False):
+    """
+    True if tasks on the thread backend run at the same time: always on a
+    free-threaded interpreter, otherwise only for tasks that spend their
+    time inside gmpy2 calls (not gil_bound) with a gmpy2 that releases the GIL.
+    """
+    return FREE_THREADED or (not gil_bound and GMPY2_RELEASES_GIL)
+
+
+def select_backend(bits=None, gil_bound=False):
+    """
+    The backend for a job whose tasks work on operands of `bits` bits, unless
+    configure_backend() or PRIME_BACKEND fixed one:
+      process - from THREAD_MAX_BITS on (a task is long enough to be worth
+                a process, and terminate_pool() can stop it)
+      inline  - below INLINE_MAX_BITS, or with a single worker
+      thread  - in between if threads_run_in_parallel(gil_bound), else process
+    gil_bound marks tasks that spend their time in Python-level loops (a
+    Lucas ladder, ECM curves) rather than in single gmpy2 calls. bits=None
+    is for tasks that are long at any operand size (ECM curve batches).
+    """
+    if _backend != "auto":
+        return _backend
+    if bits is not None and bits >= _thread_max_bits:
+        return "process"
+    if _pool_size == 1 or (bits is not None and bits < _inline_max_bits):
+        return "inline"
+    return "thread" if threads_run_in_parallel(gil_bound) else "process"
+
+
+class InlineExecutor(concurrent.futures.Executor):
+    """Runs each task in the calling thread as it is submitted; returns finished futures."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+_inline_executor = InlineExecutor()
+
+
+def _allow_gil_release():
+    """Initializer of the pool threads (gmpy2 contexts are per thread)."""
+    if GMPY2_RELEASES_GIL:
+        gmpy2.get_context().allow_release_gil = True
+
+
+def get_executor(backend="process"):
+    """
+    Returns the shared executor of backend (see BACKENDS), starting it on
+    first use: the ProcessPoolExecutor, a ThreadPoolExecutor of the same
+    size, or an InlineExecutor.
+    """
+    global _executor, _executor_pid, _thread_executor
+    if backend == "inline":
+        return _inline_executor
+    with _pool_lock:
+        if backend == "thread":
+            if _thread_executor is None:
+                _thread_executor = ThreadPoolExecutor(max_workers=_pool_size, thread_name_prefix="prime_worker",
+                                                      initializer=_allow_gil_release)
+            return _thread_executor
+        if _executor is None:
+            with instrumentation.span("pool_startup"):
+                # Workers attaching to shared operands must share the parent's
+                # resource tracker, or theirs would unlink the blocks when they exit.
+                resource_tracker.ensure_running()
+                _executor = ProcessPoolExecutor(max_workers=_pool_size)
+                _executor_pid = os.getpid()
+            instrumentation.count("pool_starts")
+        return _executor
+
+
+def restart_pool():
+    """
+    Discards the current pool (e.g. after a worker crashed) so that the
+    next request starts a fresh one.
+    """
+    with _pool_lock:
+        _shutdown_locked(wait=False)
+
+
+def shutdown_pool(wait=True):
+    """Shuts down the shared pool (and the thread pool) if it is running."""
+    global _thread_executor
+    with _pool_lock:
+        _shutdown_locked(wait=wait)
+        thread_executor, _thread_executor = _thread_executor, None
+    if thread_executor is not None:
+        thread_executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def terminate_pool():
+    """
+    Kills the worker processes of the current pool, abandoning the tasks they
+    are running, so that long computations whose result is no longer needed
+    stop at once (tasks on the thread and inline backends run to their end).
+    Every task still queued or running on the pool fails with
+    BrokenProcessPool (as_completed_results() and map_tasks() resubmit other
+    callers' tasks). Call it before cancelling your own futures: on Python 3.11
+    the executor cannot fail a future that was already cancelled.
+    The next request starts a fresh pool.
+    """
+    global _executor
+    if _executor_pid != os.getpid():
+        return # A pool worker (e.g. a task stopped at its deadline): the pool is its parent's
+    with _pool_lock:
+        executor = _executor
+        _executor = None
+    if executor is None:
+        return
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    # The executor notices the dead workers and fails every pending future with
+    # BrokenProcessPool; wait for that, so none of them is left unresolved.
+    executor.shutdown(wait=True)
+
+
+@contextlib.contextmanager
+def cancellation(event):
+    """
+    Makes the pool calls of this thread stop with TaskCancelled once the
+    threading.Event `event` is set.
+    """
+    previous = getattr(_cancel_local, "event", None)
+    _cancel_local.event = event
+    try:
+        yield
+    finally:
+        _cancel_local.event = previous
+
+
+def raise_if_cancelled():
+    """
+    Raises TaskCancelled if the request running in this thread was cancelled.
+    The pool is terminated first, so the tasks still running for it stop at
+    once (this thread is the one that terminates it, before its futures are cancelled).
+    """
+    event = getattr(_cancel_local, "event", None)
+    if event is not None and event.is_set():
+        terminate_pool()
+        raise TaskCancelled()
+
+
+class SharedOperand:
+    """
+    Picklable handle of an integer published by shared_operand(): the name of
+    the shared memory block and the length of the binary export stored in it.
+    """
+    __slots__ = ("name", "size")
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+    def __getstate__(self):
+        return (self.name, self.size)
+
+    def __setstate__(self, state):
+        self.name, self.size = state
+
+    def __repr__(self):
+        return f"SharedOperand({self.name!r}, {self.size} bytes)"
+
+
+@contextlib.contextmanager
+def shared_operand(n):
+    """
+    Publishes n for the workers for the duration of the block and yields the
+    value to put into the task arguments: a SharedOperand handle if n has at
+    least SHARED_OPERAND_BITS bits, otherwise n itself (pickling a small
+    number is cheaper than a shared memory block, and the thread and inline
+    backends need neither, see select_backend()). The block is unlinked on
+    exit, so every task using the handle must have finished or been
+    cancelled by then; tasks call resolve_operand() on it.
+    """
+    n = gmpy2.mpz(n)
+    if n.bit_length() < SHARED_OPERAND_BITS or select_backend(n.bit_length()) != "process":
+        yield n
+        return
+    with instrumentation.span("share_operand"):
+        data = gmpy2.to_binary(n)
+        size = len(data)
+        block = shared_memory.SharedMemory(name=f"prime_{os.getpid()}_{secrets.token_hex(6)}",
+                                           create=True, size=size)
+        block.buf[:size] = data
+        del data
+    instrumentation.count("bytes_shared", size)
+    try:
+        yield SharedOperand(block.name, size)
+    finally:
+        block.close()
+        block.unlink()
+
+
+def resolve_operand(value):
+    """
+    Returns the integer behind a SharedOperand handle (attaching to its block
+    the first time this process sees it); any other value is returned as is,
+    so tasks accept both handles and plain numbers.
+    """
+    if not isinstance(value, SharedOperand):
+        return value
+    n = _resolved_operands.get(value.name)
+    if n is not None:
+        _resolved_operands.move_to_end(value.name)
+        return n
+    block = shared_memory.SharedMemory(name=value.name)
+    try:
+        n = gmpy2.from_binary(bytes(block.buf[:value.size]))
+    finally:
+        block.close()
+    _resolved_operands[value.name] = n
+    while len(_resolved_operands) > RESOLVED_OPERANDS_CACHED:
+        _resolved_operands.popitem(last=False)
+    return n
+
+
+class ProgressBoard:
+    """
+    Fractions of work done, one slot per task, in a shared memory block
+    created by progress_board(). The tasks get slot(i) and write through
+    report_progress(); the caller reads them with fractions().
+    """
+
+    def __init__(self, slots):
+        self.block = shared_memory.SharedMemory(name=f"prime_{os.getpid()}_{secrets.token_hex(6)}",
+                                                create=True, size=8 * max(1, slots))
+        self.slots = slots
+
+    def slot(self, index):
+        """Picklable (block name, index) for the task that owns slot index."""
+        return (self.block.name, index)
+
+    def fractions(self):
+        return list(struct.unpack_from(f"{self.slots}d", self.block.buf))
+
+
+@contextlib.contextmanager
+def progress_board(slots):
+    """Creates a ProgressBoard with `slots` slots for the duration of the block."""
+    board = ProgressBoard(slots)
+    try:
+        yield board
+    finally:
+        board.block.close()
+        board.block.unlink()
+
+
+def report_progress(slot, fraction):
+    """Called in a task: stores fraction (0 to 1) in its ProgressBoard slot."""
+    global _attached_board
+    name, index = slot
+    if _attached_board is None or _attached_board.name != name:
+        if _attached_board is not None:
+            _attached_board.close()
+        try:
+            _attached_board = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            _attached_board = None
+            return # The caller no longer waits for this task
+    struct.pack_into("d", _attached_board.buf, 8 * index, fraction)
+
+
+def _shutdown_locked(wait):
+    global _executor
+    if _executor is not None:
+        executor = _executor
+        _executor = None
+        executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def count_pickled_bytes(fn, args):
+    """
+    Counts the size of a task as sent to a worker (bytes_pickled). The executor
+    pickles it in a background thread, so an equivalent pickle.dumps() is
+    timed (span "pickle") and measured here; skipped in the no-op mode.
+    """
+    if not instrumentation.ENABLED:
+        return
+    with instrumentation.span("pickle"):
+        try:
+            size = len(pickle.dumps((fn, args), protocol=pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return # The executor reports unpicklable tasks through the future
+    instrumentation.count("bytes_pickled", size)
+    instrumentation.count("tasks_submitted")
+
+
+def submit(fn, *args, backend="process"):
+    """
+    Submits fn(*args) to the shared pool, or to the executor of another backend.
+    If the pool is broken (a worker died), it is restarted and the
+    submission is retried once.
+    """
+    if backend != "process":
+        return get_executor(backend).submit(fn, *args)
+    count_pickled_bytes(fn, args)
+    try:
+        return get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        restart_pool()
+        return get_executor().submit(fn, *args)
+
+
+def map_tasks(fn, args_list, chunksize=1, backend="process"):
+    """
+    Runs fn over args_list on the shared pool (or the executor of backend)
+    and returns the results in input order. If a worker crashes during the
+    run, the pool is restarted and the whole batch is retried once.
+    """
+    args_list = list(args_list)
+    if backend != "process":
+        return list(get_executor(backend).map(fn, args_list))
+    for args in args_list:
+        count_pickled_bytes(fn, (args,))
+    try:
+        return list(get_executor().map(fn, args_list, chunksize=chunksize))
+    except BrokenProcessPool:
+        raise_if_cancelled()
+        restart_pool()
+        return list(get_executor().map(fn, args_list, chunksize=chunksize))
+
+
+def as_completed_results(fn, args_list, retries=1, poll=None, backend="process"):
+    """
+    Submits fn(arg) for every arg in args_list and yields
+    (arg, result, exception) tuples in completion order (input order on the
+    inline backend, which runs each task as the previous one is consumed).
+    Tasks lost to a crashed worker are resubmitted on a restarted pool
+    up to `retries` times before their exception is reported.
+    Closing the generator early (e.g. breaking out of the loop once the
+    answer is known) cancels every task that has not started yet.
+    poll(), if given, is called every CANCEL_CHECK_INTERVAL while waiting
+    (e.g. to show the progress the tasks write to a progress_board()).
+    Raises TaskCancelled if this thread's request is cancelled while waiting.
+    """
+    if backend == "inline":
+        for arg in args_list:
+            raise_if_cancelled()
+            try:
+                result, error = fn(arg), None
+            except Exception as exc:
+                result, error = None, exc
+            if poll is not None:
+                poll()
+            yield arg, result, error
+        return
+
+    cancel_event = getattr(_cancel_local, "event", None)
+    timeout = CANCEL_CHECK_INTERVAL if cancel_event is not None or poll is not None else None
+    pending = {}
+    with instrumentation.span("pool_submit"): # Includes starting the worker processes on first use
+        for arg in args_list:
+            pending[submit(fn, arg, backend=backend)] = (arg, 0)
+
+    try:
+        while pending:
+            done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            raise_if_cancelled()
+            if poll is not None:
+                poll()
+            for future in done:
+                arg, attempts = pending.pop(future)
+                try:
+                    result, error = future.result(), None
+                except BrokenProcessPool as exc:
+                    if attempts < retries:
+                        pending[submit(fn, arg, backend=backend)] = (arg, attempts + 1)
+                        continue
+                    result, error = None, exc
+                except Exception as exc:
+                    result, error = None, exc
+                yield arg, result, error
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+atexit.register(shutdown_pool)